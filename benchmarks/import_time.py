@@ -0,0 +1,137 @@
+"""
+Check that the command line tools start quickly and don't load Qt. Each
+command is run in a fresh interpreter against an empty library, and the
+fastest of `--repeat` runs is compared against its budget. Exits non-zero if
+any command goes over budget or imports Qt. Run from the repository root with
+`python -m benchmarks.import_time`.
+
+Usage:
+    import_time [--repeat=<n>] [--json]
+
+Options:
+    --repeat=<n>    Runs of each command [default: 5]
+    --json          Print the results as JSON
+"""
+
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import tempfile
+import time
+
+import docopt
+
+from fantasia2 import db
+
+# Wall time of the whole process in milliseconds, interpreter startup
+# included, with headroom for slower machines. A Qt import creeping back in is
+# caught by the module check regardless of time.
+BUDGETS_MS = {
+    "stats": 800,
+    "sync": 800,
+    "analyse": 800,
+    "export": 900,
+    "init": 1500,
+}
+
+# Top level packages none of the commands may import
+FORBIDDEN = {"PySide6", "shiboken6"}
+
+# Runs the command line as `python -m fantasia2` would, then writes the
+# loaded modules to the file named by the first argument
+RUNNER = """
+import atexit, json, runpy, sys
+
+report, sys.argv = sys.argv[1], ["fantasia2", *sys.argv[2:]]
+
+@atexit.register
+def write_modules():
+    with open(report, "w", encoding="utf-8") as f:
+        json.dump(sorted({name.split(".")[0] for name in sys.modules}), f)
+
+runpy.run_module("fantasia2", run_name="__main__")
+"""
+
+
+def make_library(directory: pathlib.Path) -> pathlib.Path:
+    library = directory / "library"
+    library.mkdir()
+    instance = db.F2Instance(
+        base_dir=library,
+        db_addr=f"sqlite+pysqlite:///{library.as_posix()}/db.sqlite3",
+    )
+    db.Base.metadata.create_all(instance.engine)
+    instance.initialize()
+    instance.engine.dispose()
+    return library
+
+
+def command_args(command: str, directory: pathlib.Path, library: pathlib.Path):
+    match command:
+        case "init":
+            # A new library each time, as init won't reuse one
+            new_dir = pathlib.Path(tempfile.mkdtemp(dir=directory))
+            return ["init", str(new_dir / "library")]
+        case "export":
+            return ["export", str(library), str(directory / "export")]
+        case _:
+            return [command, str(library)]
+
+
+def run(args: list[str], report: pathlib.Path) -> tuple[float, set[str]]:
+    started = time.perf_counter()
+    subprocess.run(
+        [sys.executable, "-c", RUNNER, str(report), *args],
+        check=True,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        cwd=pathlib.Path(__file__).resolve().parent.parent,
+        env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+    )
+    elapsed = (time.perf_counter() - started) * 1000
+    return elapsed, set(json.loads(report.read_text(encoding="utf-8")))
+
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    repeat = int(args["--repeat"])
+
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        library = make_library(directory)
+        report = directory / "modules.json"
+        for command, budget in BUDGETS_MS.items():
+            times = []
+            forbidden = set()
+            for _ in range(repeat):
+                elapsed, modules = run(
+                    command_args(command, directory, library), report
+                )
+                times.append(elapsed)
+                forbidden |= modules & FORBIDDEN
+            results[command] = {
+                "ms": min(times),
+                "budget_ms": budget,
+                "forbidden_imports": sorted(forbidden),
+                "ok": min(times) <= budget and not forbidden,
+            }
+
+    if args["--json"]:
+        print(json.dumps(results, indent=2))
+    else:
+        for command, result in results.items():
+            line = f"{command:<10}{result['ms']:>8.0f} ms / {result['budget_ms']} ms"
+            if result["forbidden_imports"]:
+                line += "  imports " + ", ".join(result["forbidden_imports"])
+            if not result["ok"]:
+                line += "  FAIL"
+            print(line)
+    if not all(result["ok"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
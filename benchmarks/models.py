@@ -0,0 +1,308 @@
+"""
+Check the Qt models with QAbstractItemModelTester and time the interactions
+that have to feel instant, on a synthetic library under the offscreen
+platform. Every interaction is first run with testers attached to all the
+models, then timed without them. Exits non-zero if a tester reports a problem
+or an interaction goes over its budget. Run from the repository root with
+`python -m benchmarks.models`.
+
+Usage:
+    models [--tracks=<n>] [--repeat=<n>] [--output=<file>] [--baseline=<file>]
+           [--json]
+
+Options:
+    --tracks=<n>        Tracks in the synthetic library [default: 10000]
+    --repeat=<n>        Runs of each interaction, the fastest is kept
+                        [default: 3]
+    --output=<file>     Save the results to this file
+    --baseline=<file>   Budget each interaction from results saved earlier on
+                        the same machine and library size, instead of the
+                        fixed budgets
+    --json              Print the results as JSON
+
+"keystroke" is the slowest key of typing a search and deleting it again,
+"sort" the slowest SortOrder change, "album.enter" and "album.exit" the slowest
+step walking down to a disc of an album and back out, "playlist.append"
+appends 10k rows from the library view and shows the first page, and
+"scroll.<model>" is the slowest page of data() calls when jumping through a
+view whose rows haven't been shown yet.
+"""
+
+import collections
+import json
+import os
+import pathlib
+import sys
+import tempfile
+import time
+import warnings
+
+import docopt
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+# pylint: disable=wrong-import-position
+from PySide6 import QtCore, QtGui, QtTest
+
+from fantasia2 import query_model, tag_model, writer
+
+from . import synthetic
+
+# Milliseconds on the default 10k track library, about three times the
+# slowest of a few --repeat=1 runs on a single core, so a noisy machine
+# passes. Smaller regressions are for --baseline to catch.
+BUDGETS_MS = {
+    "keystroke": 1000,
+    "sort": 1000,
+    "album.enter": 50,
+    "album.exit": 50,
+    "playlist.append": 800,
+    "scroll.QueryModel": 100,
+    "scroll.PlaylistModel": 300,
+    "tags.refresh": 50,
+}
+# Against a baseline, an interaction may take this many times as long, plus
+# a few milliseconds for the ones that are over in an instant
+BASELINE_FACTOR = 1.5
+BASELINE_SLACK_MS = 5
+
+SEARCH = "track 0012"
+PLAYLIST_APPEND_ROWS = 10000
+# Rows a view shows at once, and how many pages to jump to when scrolling
+PAGE_ROWS = 40
+SCROLL_PAGES = 50
+
+
+class Models:
+    def __init__(self, instance) -> None:
+        self.writer = writer.Writer(instance)
+        self.query = query_model.QueryModel(instance, self.writer)
+        self.albums = query_model.AlbumModel(instance, self.writer)
+        self.playlist = query_model.PlaylistModel(instance, self.writer)
+        self.tags = tag_model.TagModel(instance)
+
+    def all(self) -> list[QtCore.QAbstractItemModel]:
+        return [
+            self.query,
+            self.albums,
+            self.albums.trackModel,
+            self.playlist,
+            self.tags,
+        ]
+
+    def close(self) -> None:
+        self.playlist.close()
+        self.writer.close()
+
+
+def _elapsed(func, *args) -> float:
+    started = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - started) * 1000
+
+
+def _rows(model) -> int:
+    return model.rowCount(QtCore.QModelIndex())
+
+
+def _show_page(model, first: int) -> None:
+    for row in range(first, min(first + PAGE_ROWS, _rows(model))):
+        for column in range(model.columnCount(QtCore.QModelIndex())):
+            model.data(model.index(row, column), QtCore.Qt.ItemDataRole.DisplayRole)
+
+
+def keystroke(models: Models) -> float:
+    worst = 0
+    model = models.query
+    typed = [SEARCH[:i] for i in range(1, len(SEARCH) + 1)]
+    for query in typed + typed[-2::-1] + [""]:
+        worst = max(worst, _elapsed(setattr, model, "query", query))
+    return worst
+
+
+def sort(models: Models) -> float:
+    orders = list(query_model.QueryModel.SortOrder)
+    worst = max(
+        _elapsed(setattr, models.query, "ordering", order) for order in orders[1:]
+    )
+    return max(worst, _elapsed(setattr, models.query, "ordering", orders[0]))
+
+
+# Artist, album and disc
+ALBUM_DEPTH = 3
+
+
+def album_enter(models: Models) -> float:
+    worst = max(_elapsed(models.albums.enterAlbum, 0) for _ in range(ALBUM_DEPTH))
+    for _ in range(ALBUM_DEPTH):
+        models.albums.exitAlbum()
+    return worst
+
+
+def album_exit(models: Models) -> float:
+    for _ in range(ALBUM_DEPTH):
+        models.albums.enterAlbum(0)
+    return max(_elapsed(models.albums.exitAlbum) for _ in range(ALBUM_DEPTH))
+
+
+def playlist_append(models: Models) -> float:
+    models.playlist.clear()
+    indexes = _library_indexes(models)
+
+    def append():
+        models.playlist.appendItems(indexes)
+        _show_page(models.playlist, 0)
+
+    return _elapsed(append)
+
+
+def _library_indexes(models: Models) -> list[QtCore.QModelIndex]:
+    rows = min(PLAYLIST_APPEND_ROWS, _rows(models.query))
+    return [models.query.index(row, 0) for row in range(rows)]
+
+
+def _scroll(model) -> float:
+    step = max(PAGE_ROWS, _rows(model) // SCROLL_PAGES)
+    return max(
+        (_elapsed(_show_page, model, first) for first in range(0, _rows(model), step)),
+        default=0,
+    )
+
+
+def scroll_query(models: Models) -> float:
+    # Read the rows again, so none have had their tags loaded yet
+    models.query.refresh()
+    return _scroll(models.query)
+
+
+def scroll_playlist(models: Models) -> float:
+    # Rows are loaded as they are shown, so start from a fresh playlist
+    models.playlist.clear()
+    models.playlist.appendItems(_library_indexes(models))
+    return _scroll(models.playlist)
+
+
+def tags_refresh(models: Models) -> float:
+    return _elapsed(models.tags.refresh)
+
+
+INTERACTIONS = {
+    "keystroke": keystroke,
+    "sort": sort,
+    "album.enter": album_enter,
+    "album.exit": album_exit,
+    "playlist.append": playlist_append,
+    "scroll.QueryModel": scroll_query,
+    "scroll.PlaylistModel": scroll_playlist,
+    "tags.refresh": tags_refresh,
+}
+
+
+def check(models: Models) -> list[str]:
+    """
+    Run every interaction with testers on all the models, returning what they
+    reported.
+    """
+    failures = []
+
+    def handler(mode, context, message):
+        if context.category == "qt.modeltest" or "FAIL" in message:
+            failures.append(message)
+
+    previous = QtCore.qInstallMessageHandler(handler)
+    try:
+        with warnings.catch_warnings(record=True) as caught:
+            # PySide warns rather than raising when a method returns the wrong
+            # type, like rowCount() returning None
+            warnings.simplefilter("always", RuntimeWarning)
+            mode = QtTest.QAbstractItemModelTester.FailureReportingMode.Warning
+            testers = [
+                QtTest.QAbstractItemModelTester(model, mode)
+                for model in models.all()
+            ]
+            for interaction in INTERACTIONS.values():
+                interaction(models)
+            # Moves and removals aren't timed, but the tester should see them
+            models.playlist.moveItem(0, 5)
+            models.playlist.removeRows(1, 3)
+            models.playlist.clear()
+            QtCore.QCoreApplication.processEvents()
+            del testers
+    finally:
+        QtCore.qInstallMessageHandler(previous)
+    failures.extend(
+        str(w.message) for w in caught if issubclass(w.category, RuntimeWarning)
+    )
+    return failures
+
+
+def run(tracks: int, repeat: int, budgets: dict[str, float]) -> dict:
+    """
+    Check and time the models on a library of `tracks` tracks.
+    """
+    _app = QtGui.QGuiApplication.instance() or QtGui.QGuiApplication([])
+    with tempfile.TemporaryDirectory() as directory:
+        instance = synthetic.make_instance(pathlib.Path(directory))
+        synthetic.add_tracks(instance, tracks)
+        synthetic.add_library_data(instance)
+
+        models = Models(instance)
+        try:
+            failures = check(models)
+            results = {}
+            for name, interaction in INTERACTIONS.items():
+                ms = min(interaction(models) for _ in range(repeat))
+                results[name] = {
+                    "ms": ms,
+                    "budget_ms": budgets[name],
+                    "ok": ms <= budgets[name],
+                }
+        finally:
+            models.close()
+            instance.engine.dispose()
+    return {"tracks": tracks, "tester_failures": failures, "results": results}
+
+
+def baseline_budgets(path: pathlib.Path, tracks: int) -> dict[str, float]:
+    """
+    Budgets from the results of an earlier run saved with --output.
+    """
+    baseline = json.loads(path.read_text(encoding="utf-8"))
+    if baseline.get("tracks") != tracks:
+        sys.exit(f"{path} is for {baseline.get('tracks')} tracks, not {tracks}")
+    return {
+        name: round(result["ms"] * BASELINE_FACTOR + BASELINE_SLACK_MS, 1)
+        for name, result in baseline["results"].items()
+    }
+
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    tracks = int(args["--tracks"])
+    repeat = int(args["--repeat"])
+    budgets = dict(BUDGETS_MS)
+    if args["--baseline"]:
+        budgets.update(baseline_budgets(pathlib.Path(args["--baseline"]), tracks))
+
+    report = run(tracks, repeat, budgets)
+    failures, results = report["tester_failures"], report["results"]
+    if args["--output"]:
+        pathlib.Path(args["--output"]).write_text(
+            json.dumps(report, indent=2) + "\n", encoding="utf-8"
+        )
+    if args["--json"]:
+        print(json.dumps(report, indent=2))
+    else:
+        for failure, times in collections.Counter(failures).items():
+            print(f"Model tester ({times}x): {failure}")
+        for name, result in results.items():
+            line = f"{name:<24}{result['ms']:>8.1f} ms / {result['budget_ms']} ms"
+            if not result["ok"]:
+                line += "  FAIL"
+            print(line)
+    if failures or not all(result["ok"] for result in results.values()):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
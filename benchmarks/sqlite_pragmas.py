@@ -0,0 +1,177 @@
+"""
+Compare SQLite pragma profiles on a synthetic library. Run from the
+repository root with `python -m benchmarks.sqlite_pragmas`.
+
+Usage:
+    sqlite_pragmas [--tracks=<n>] [--seconds=<s>] [--json]
+
+Options:
+    --tracks=<n>    Tracks in the synthetic library [default: 20000]
+    --seconds=<s>   Duration of the concurrent read/write test [default: 5]
+    --json          Print the results as JSON
+
+"sync" inserts the library in one transaction like `fantasia2 sync`, then
+makes single-row commits like ratings and listen counts do. "search" runs the
+library view's name search and sort. "concurrent" has a writer committing
+small transactions while a reader runs searches, as when the GUI is open
+during a sync, and counts the lock errors each side gets.
+"""
+
+import json
+import pathlib
+import random
+import tempfile
+import threading
+import time
+
+import docopt
+from sqlalchemy import exc, func, update
+
+from fantasia2 import db
+
+PROFILES = {
+    # What engines got before pragmas were configurable
+    "legacy": dict.fromkeys(db.DEFAULT_SQLITE_PRAGMAS),
+    "default": {},
+}
+
+SMALL_COMMITS = 300
+SEARCHES = 50
+
+
+def make_instance(directory: pathlib.Path, pragmas: dict) -> db.F2Instance:
+    instance = db.F2Instance(
+        base_dir=directory,
+        db_addr=f"sqlite+pysqlite:///{directory.as_posix()}/db.sqlite3",
+        sqlite_pragmas=pragmas,
+    )
+    db.Base.metadata.create_all(instance.engine)
+    return instance
+
+
+def bench_sync(instance: db.F2Instance, tracks: int) -> dict:
+    rng = random.Random(0)
+    started = time.perf_counter()
+    with instance.session() as session:
+        tags = [db.Tag(name=f"tag{i}") for i in range(20)]
+        session.add_all(tags)
+        albums = [db.Album(name=f"album{i}") for i in range((tracks + 11) // 12)]
+        session.add_all(albums)
+        for i in range(tracks):
+            track = db.Track(
+                name=f"track {i} {rng.randrange(10**6)}",
+                folder=f"album{i // 12}",
+                extension=".mp3",
+                duration=rng.uniform(60, 600),
+                file_hash=rng.randbytes(32),
+                file_size=rng.randrange(2**20, 2**24),
+                album=albums[i // 12],
+            )
+            track.tags.extend(rng.sample(tags, rng.randrange(3)))
+            session.add(track)
+    bulk = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(SMALL_COMMITS):
+        with instance.session() as session:
+            session.execute(
+                update(db.Track)
+                .where(db.Track.id == rng.randrange(1, tracks + 1))
+                .values(listenings=db.Track.listenings + 1)
+            )
+    small = time.perf_counter() - started
+    return {"bulk_insert_s": bulk, "commit_ms": small / SMALL_COMMITS * 1000}
+
+
+def search(session, term: str) -> int:
+    return len(
+        session.query(db.Track)
+        .filter(db.Track.name.like(f"%{term}%"))
+        .order_by(func.lower(db.Track.name))
+        .limit(500)
+        .all()
+    )
+
+
+def bench_search(instance: db.F2Instance) -> dict:
+    rng = random.Random(1)
+    started = time.perf_counter()
+    with instance.session() as session:
+        for _ in range(SEARCHES):
+            search(session, str(rng.randrange(100)))
+    return {"search_ms": (time.perf_counter() - started) / SEARCHES * 1000}
+
+
+def bench_concurrent(instance: db.F2Instance, tracks: int, seconds: float) -> dict:
+    stop = threading.Event()
+    counts = {"reads": 0, "writes": 0, "read_errors": 0, "write_errors": 0}
+
+    def writer():
+        rng = random.Random(2)
+        while not stop.is_set():
+            try:
+                with instance.session() as session:
+                    session.execute(
+                        update(db.Track)
+                        .where(db.Track.id == rng.randrange(1, tracks + 1))
+                        .values(rating=rng.randrange(6))
+                    )
+                counts["writes"] += 1
+            except exc.OperationalError:
+                counts["write_errors"] += 1
+
+    def reader():
+        rng = random.Random(3)
+        while not stop.is_set():
+            try:
+                with instance.session() as session:
+                    search(session, str(rng.randrange(100)))
+                counts["reads"] += 1
+            except exc.OperationalError:
+                counts["read_errors"] += 1
+
+    threads = [threading.Thread(target=writer), threading.Thread(target=reader)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    return {
+        "reads_per_s": counts["reads"] / seconds,
+        "writes_per_s": counts["writes"] / seconds,
+        "read_errors": counts["read_errors"],
+        "write_errors": counts["write_errors"],
+    }
+
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    tracks = int(args["--tracks"])
+    seconds = float(args["--seconds"])
+
+    results = {}
+    for name, pragmas in PROFILES.items():
+        with tempfile.TemporaryDirectory() as directory:
+            instance = make_instance(pathlib.Path(directory), pragmas)
+            results[name] = {
+                **bench_sync(instance, tracks),
+                **bench_search(instance),
+                **bench_concurrent(instance, tracks, seconds),
+            }
+            instance.engine.dispose()
+
+    if args["--json"]:
+        print(json.dumps(results, indent=2))
+        return
+    metrics = list(next(iter(results.values())))
+    print(f"{'':<16}" + "".join(f"{name:>12}" for name in results))
+    for metric in metrics:
+        print(
+            f"{metric:<16}"
+            + "".join(f"{values[metric]:>12.2f}" for values in results.values())
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Time the library operations on synthetic libraries of each size, and save the
+results as JSON to compare across commits. Run from the repository root with
+`python -m benchmarks.suite`. Syncing runs ffprobe on every new file, so the
+cold sync of the largest library takes a while.
+
+Usage:
+    suite [--sizes=<list>] [--churn=<fraction>] [--repeat=<n>]
+          [--output=<file>] [--compare=<file>] [--json]
+
+Options:
+    --sizes=<list>        Tracks in each library [default: 1000,10000,100000]
+    --churn=<fraction>    Fraction of tracks moved, deleted and added before
+                          the last sync [default: 0.01]
+    --repeat=<n>          Runs of each refresh, the fastest is kept
+                          [default: 3]
+    --output=<file>       Save the results to this file
+    --compare=<file>      Print the change from results saved earlier
+    --json                Print the results as JSON
+
+"sync.cold" adds every file to an empty database, "sync.noop" finds nothing to
+do, and "sync.churn" picks up the moves, deletions and additions. Each
+"refresh.<order>" is QueryModel.refresh with that SortOrder. "export.cold"
+copies the library to an empty directory and "export.noop" finds it up to
+date. "stats" is `fantasia2 stats`.
+"""
+
+import contextlib
+import datetime
+import io
+import json
+import os
+import pathlib
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from unittest import mock
+
+import docopt
+
+from fantasia2 import export, utils
+
+from . import synthetic
+
+
+def _quiet():
+    # The operations print a line per file and export draws progress bars,
+    # which would dominate the timings on a terminal
+    stack = contextlib.ExitStack()
+    stack.enter_context(contextlib.redirect_stdout(io.StringIO()))
+    stack.enter_context(contextlib.redirect_stderr(io.StringIO()))
+    return stack
+
+
+def timed(func, *args, **kwargs) -> float:
+    started = time.perf_counter()
+    with _quiet():
+        func(*args, **kwargs)
+    return time.perf_counter() - started
+
+
+def bench_refresh(instance, repeat: int) -> dict:
+    # Qt is only needed here, so the other benchmarks run without it
+    from PySide6 import QtCore  # pylint: disable=import-outside-toplevel
+
+    from fantasia2 import (  # pylint: disable=import-outside-toplevel
+        query_model,
+        writer,
+    )
+
+    _app = QtCore.QCoreApplication.instance() or QtCore.QCoreApplication([])
+    db_writer = writer.Writer(instance)
+    model = query_model.QueryModel(instance, db_writer)
+    results = {}
+    try:
+        for order in query_model.QueryModel.SortOrder:
+            times = []
+            for _ in range(repeat):
+                started = time.perf_counter()
+                model.ordering = order
+                times.append(time.perf_counter() - started)
+            results[f"refresh.{order.name.lower()}"] = min(times)
+    finally:
+        db_writer.close()
+    return results
+
+
+def bench_size(size: int, churn: float, repeat: int) -> dict:
+    with tempfile.TemporaryDirectory() as directory:
+        directory = pathlib.Path(directory)
+        library = directory / "library"
+        library.mkdir()
+
+        started = time.perf_counter()
+        tracks = synthetic.generate_files(library, size)
+        generate = time.perf_counter() - started
+
+        instance = synthetic.make_instance(library)
+        results = {"sync.cold": timed(utils.sync_database_with_fs, instance)}
+        synthetic.add_library_data(instance)
+        results["sync.noop"] = timed(utils.sync_database_with_fs, instance)
+
+        results.update(bench_refresh(instance, repeat))
+
+        target = [(directory / "export", [])]
+        with mock.patch("builtins.input", return_value=""):
+            for name in ("export.cold", "export.noop"):
+                results[name] = timed(
+                    export.export_library_to_location,
+                    instance,
+                    target,
+                    export.ExportSettings(link="copy"),
+                )
+        results["stats"] = timed(utils.print_stats, instance)
+
+        churned = synthetic.churn(tracks, churn)
+        results["sync.churn"] = timed(utils.sync_database_with_fs, instance)
+        instance.engine.dispose()
+
+    return {
+        "tracks": size,
+        "generate_seconds": generate,
+        "churn": churned,
+        "seconds": results,
+    }
+
+
+def git_commit() -> str | None:
+    try:
+        return (
+            subprocess.check_output(
+                ["git", "rev-parse", "HEAD"],
+                cwd=pathlib.Path(__file__).resolve().parent,
+                stderr=subprocess.DEVNULL,
+            )
+            .decode()
+            .strip()
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old: dict, new: dict) -> None:
+    old_sizes = {str(r["tracks"]): r["seconds"] for r in old["results"]}
+    print(f"Against {old.get('commit') or 'unknown commit'} from {old['at']}:")
+    for result in new["results"]:
+        before = old_sizes.get(str(result["tracks"]))
+        if before is None:
+            continue
+        print(f"{result['tracks']} tracks")
+        for name, seconds in result["seconds"].items():
+            if name in before and before[name] > 0:
+                print(
+                    f"    {name:<28}{before[name]:>9.3f} s ->{seconds:>9.3f} s"
+                    f"  x{seconds / before[name]:.2f}"
+                )
+
+
+def main() -> None:
+    args = docopt.docopt(__doc__)
+    sizes = [int(size) for size in args["--sizes"].split(",")]
+    churn = float(args["--churn"])
+    repeat = int(args["--repeat"])
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    report = {
+        "at": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": [],
+    }
+    for size in sizes:
+        print(f"{size} tracks...", file=sys.stderr)
+        report["results"].append(bench_size(size, churn, repeat))
+
+    if args["--output"]:
+        pathlib.Path(args["--output"]).write_text(
+            json.dumps(report, indent=2) + "\n", encoding="utf-8"
+        )
+    if args["--json"]:
+        print(json.dumps(report, indent=2))
+    else:
+        for result in report["results"]:
+            print(f"{result['tracks']} tracks")
+            for name, seconds in result["seconds"].items():
+                print(f"    {name:<28}{seconds:>9.3f} s")
+    if args["--compare"]:
+        previous = pathlib.Path(args["--compare"]).read_text(encoding="utf-8")
+        compare(json.loads(previous), report)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Synthetic music libraries for the benchmarks. The files are real but tiny:
+each track is a short WAV whose samples encode its number, so every file has
+its own hash and ffprobe reads it like any other, and each album has a 1x1
+PNG cover. The tree is artist/album, with a disc level under some albums, and
+the same seed always gives the same library.
+"""
+
+import datetime
+import pathlib
+import random
+import struct
+import wave
+import zlib
+
+from sqlalchemy import insert, select
+
+from fantasia2 import db
+
+TRACKS_PER_ALBUM = 12
+ALBUMS_PER_ARTIST = 5
+# Every this many albums is split into two discs
+DISC_ALBUM_EVERY = 4
+TAGS = 40
+SAMPLE_RATE = 8000
+SAMPLES = 80
+
+
+def make_instance(base_dir: pathlib.Path) -> db.F2Instance:
+    instance = db.F2Instance(
+        base_dir=base_dir,
+        db_addr=f"sqlite+pysqlite:///{base_dir.as_posix()}/db.sqlite3",
+    )
+    db.Base.metadata.create_all(instance.engine)
+    instance.initialize()
+    return instance
+
+
+def write_track(path: pathlib.Path, number: int) -> None:
+    samples = [(number >> (i % 32) & 1) * 2000 + i for i in range(SAMPLES)]
+    with wave.open(str(path), "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(SAMPLE_RATE)
+        f.writeframes(struct.pack(f"<{SAMPLES}h", *samples))
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def write_cover(path: pathlib.Path, colour: int) -> None:
+    pixel = b"\0" + colour.to_bytes(3, "big")
+    path.write_bytes(
+        b"\x89PNG\r\n\x1a\n"
+        + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", 1, 1, 8, 2, 0, 0, 0))
+        + _png_chunk(b"IDAT", zlib.compress(pixel))
+        + _png_chunk(b"IEND", b"")
+    )
+
+
+def album_dirs(base_dir: pathlib.Path, tracks: int) -> list[pathlib.Path]:
+    """
+    The directories holding tracks, enough for `tracks` tracks.
+    """
+    dirs = []
+    albums = -(-tracks // TRACKS_PER_ALBUM)
+    for album in range(albums):
+        artist_dir = base_dir / f"Artist {album // ALBUMS_PER_ARTIST:05}"
+        album_dir = artist_dir / f"Album {album:06}"
+        if album % DISC_ALBUM_EVERY == 0:
+            dirs.extend(album_dir / f"Disc {disc}" for disc in (1, 2))
+        else:
+            dirs.append(album_dir)
+    return dirs
+
+
+def generate_files(base_dir: pathlib.Path, tracks: int, seed: int = 0):
+    """
+    Write the tracks and covers of a library under `base_dir`, returning the
+    track paths.
+    """
+    rng = random.Random(seed)
+    dirs = album_dirs(base_dir, tracks)
+    paths = []
+    for i in range(tracks):
+        directory = dirs[i * len(dirs) // tracks]
+        if not directory.exists():
+            directory.mkdir(parents=True)
+            cover = directory / "cover.png"
+            if directory.name.startswith("Disc"):
+                cover = directory.parent / "cover.png"
+            if not cover.exists():
+                write_cover(cover, rng.getrandbits(24))
+        path = directory / f"{i % TRACKS_PER_ALBUM + 1:02} Track {i:06}.wav"
+        write_track(path, i)
+        paths.append(path)
+    return paths
+
+
+def add_tracks(instance: db.F2Instance, tracks: int) -> None:
+    """
+    Add the albums and tracks `generate_files` would give to the database
+    only, for benchmarks that don't touch the files.
+    """
+    base_dir = instance.base_dir
+    with instance.session() as session:
+        albums = {}
+
+        def album_for(directory: pathlib.Path) -> db.Album:
+            if directory not in albums:
+                parent = directory.parent
+                albums[directory] = db.Album(
+                    name=directory.name,
+                    parent=album_for(parent) if parent != base_dir else None,
+                )
+            return albums[directory]
+
+        dirs = album_dirs(base_dir, tracks)
+        for directory in dirs:
+            album_for(directory)
+        session.add_all(albums.values())
+        session.flush()
+
+        rows = []
+        for i in range(tracks):
+            directory = dirs[i * len(dirs) // tracks]
+            rows.append(
+                {
+                    "name": f"{i % TRACKS_PER_ALBUM + 1:02} Track {i:06}",
+                    "folder": directory.relative_to(base_dir).as_posix(),
+                    "extension": ".wav",
+                    "duration": SAMPLES / SAMPLE_RATE + i % 600,
+                    "file_hash": i.to_bytes(32, "big"),
+                    "file_size": 44 + 2 * SAMPLES,
+                    "album_id": albums[directory].id,
+                }
+            )
+        session.execute(insert(db.Track), rows)
+
+
+def add_library_data(instance: db.F2Instance, seed: int = 0) -> None:
+    """
+    Give the synced tracks tags, ratings, listens and recent plays, as a
+    library in use would have.
+    """
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    with instance.session() as session:
+        track_ids = session.scalars(select(db.Track.id).order_by(db.Track.id)).all()
+        tags = [db.Tag(name=f"tag {i:02}") for i in range(TAGS)]
+        session.add_all(tags)
+        session.flush()
+
+        links, daily, weekly = [], [], []
+        for track_id in track_ids:
+            for tag in rng.sample(tags, rng.randrange(4)):
+                links.append({"track_id": track_id, "tag_id": tag.id})
+            if rng.random() < 0.3:
+                for days in rng.sample(range(30), rng.randrange(1, 4)):
+                    daily.append(
+                        {
+                            "track_id": track_id,
+                            "period_start": today - datetime.timedelta(days=days),
+                            "plays": rng.randrange(1, 5),
+                            "seconds_played": 10.0,
+                        }
+                    )
+                for weeks in rng.sample(range(52), rng.randrange(1, 6)):
+                    weekly.append(
+                        {
+                            "track_id": track_id,
+                            "period_start": db.WeeklyPlays.period_for(
+                                today - datetime.timedelta(weeks=weeks)
+                            ),
+                            "plays": rng.randrange(1, 20),
+                            "seconds_played": 100.0,
+                        }
+                    )
+        for table, rows in (
+            (db.TrackToTags, links),
+            (db.DailyPlays, daily),
+            (db.WeeklyPlays, weekly),
+        ):
+            if rows:
+                session.execute(insert(table), rows)
+
+        for track in session.query(db.Track):
+            track.rating = rng.choice((None, None, 1, 2, 3, 4, 5))
+            track.listenings = rng.randrange(50)
+
+
+def churn(tracks: list[pathlib.Path], fraction: float, seed: int = 0) -> dict:
+    """
+    Move, delete and add `fraction` of the tracks each, keeping every
+    directory non-empty. Returns the counts and updates `tracks` in place.
+    """
+    rng = random.Random(seed)
+    count = max(1, int(len(tracks) * fraction))
+    by_dir = {}
+    for path in tracks:
+        by_dir.setdefault(path.parent, []).append(path)
+
+    chosen = rng.sample(tracks, min(len(tracks), 2 * count))
+    moved = deleted = 0
+    for path in chosen:
+        siblings = by_dir[path.parent]
+        if len(siblings) < 2:
+            continue
+        siblings.remove(path)
+        tracks.remove(path)
+        if moved < count:
+            dest_dir = rng.choice(list(by_dir))
+            dest = dest_dir / f"Moved {path.name}"
+            path.rename(dest)
+            by_dir[dest_dir].append(dest)
+            tracks.append(dest)
+            moved += 1
+        else:
+            path.unlink()
+            deleted += 1
+            if deleted == count:
+                break
+
+    number = len(tracks) + moved + deleted
+    dirs = list(by_dir)
+    for i in range(count):
+        path = rng.choice(dirs) / f"New Track {number + i:06}.wav"
+        write_track(path, number + i)
+        tracks.append(path)
+    return {"moved": moved, "deleted": deleted, "added": count}
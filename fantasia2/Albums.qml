@@ -5,7 +5,7 @@ import QtQuick.Controls as QQC
 import QtQuick.Layouts as QQL
 import QtQuick.Effects as QQE
 import fantasia2.query_model as QueryModel
-import fantasia2.utils as Utils
+import fantasia2.qml_utils as Utils
 
 QQC.ScrollView {
     id: root
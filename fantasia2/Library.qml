@@ -61,10 +61,11 @@ QQL.ColumnLayout {
                             id: addTagDelegate
 
                             required property color color
+                            required property int count
                             required property int id
                             required property string name
 
-                            text: name
+                            text: "%1 (%2)".arg(name).arg(count)
 
                             background: Rectangle {
                                 color: addTagDelegate.color
@@ -101,10 +102,11 @@ QQL.ColumnLayout {
                             id: removeTagDelegate
 
                             required property color color
+                            required property int count
                             required property int id
                             required property string name
 
-                            text: name
+                            text: "%1 (%2)".arg(name).arg(count)
 
                             background: Rectangle {
                                 color: removeTagDelegate.color
@@ -183,6 +185,18 @@ QQL.ColumnLayout {
                         "value": QueryModel.QueryModel.SortOrder.MOST_PLAYED,
                         "text": qsTr("Most played")
                     },
+                    {
+                        "value": QueryModel.QueryModel.SortOrder.MOST_PLAYED_WEEK,
+                        "text": qsTr("Most played this week")
+                    },
+                    {
+                        "value": QueryModel.QueryModel.SortOrder.MOST_PLAYED_MONTH,
+                        "text": qsTr("Most played this month")
+                    },
+                    {
+                        "value": QueryModel.QueryModel.SortOrder.MOST_PLAYED_YEAR,
+                        "text": qsTr("Most played this year")
+                    },
                     {
                         "value": QueryModel.QueryModel.SortOrder.RATING,
                         "text": qsTr("Rating")
@@ -6,7 +6,7 @@ import fantasia2.controller as Controller
 import fantasia2.mpris as MPRIS
 import fantasia2.player as Player
 import fantasia2.query_model as QueryModel
-import fantasia2.utils as Utils
+import fantasia2.qml_utils as Utils
 
 QQC.ApplicationWindow {
     id: root
@@ -57,6 +57,7 @@ QQC.ApplicationWindow {
     Player.Player {
         id: player
 
+        listenRecorder: root.controller.listenRecorder
         playlistModel: root.controller.playlistModel
     }
 
@@ -130,6 +131,29 @@ QQC.ApplicationWindow {
         onTriggered: player.next_track()
     }
 
+    QQC.Action {
+        id: shuffleAction
+
+        checkable: true
+        checked: player.shuffle
+        icon.name: "media-playlist-shuffle"
+
+        onTriggered: player.shuffle = checked
+    }
+
+    QQC.Action {
+        id: loopAction
+
+        checked: player.loopStatus != "None"
+        icon.name: player.loopStatus == "Track" ? "media-playlist-repeat-song" : "media-playlist-repeat"
+
+        onTriggered: player.loopStatus = {
+            "None": "Playlist",
+            "Playlist": "Track",
+            "Track": "None"
+        }[player.loopStatus]
+    }
+
     QQC.Action {
         id: trackAppendAction
 
@@ -249,6 +273,21 @@ QQC.ApplicationWindow {
                     icon.height: 36
                     icon.width: 36
                 }
+
+                QQC.ToolSeparator {
+                }
+
+                QQC.ToolButton {
+                    action: shuffleAction
+                    icon.height: 36
+                    icon.width: 36
+                }
+
+                QQC.ToolButton {
+                    action: loopAction
+                    icon.height: 36
+                    icon.width: 36
+                }
             }
         }
     }
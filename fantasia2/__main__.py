@@ -1,28 +1,45 @@
 """
 Usage:
-    fantasia2 init [<path>]
-    fantasia2 sync [<path>]
-    fantasia2 dbupgrade <path>
-    fantasia2 dbupdate <path>
-    fantasia2 dbdowngrade <path> <revision>
-    fantasia2 export <path> <exportpath> [--exclude=<excluded_albums>]
-    fantasia2 stats [<path>]
-    fantasia2 [<path>]
+    fantasia2 init [<path>] [options]
+    fantasia2 sync [<path>] [options]
+    fantasia2 dbupgrade <path> [options]
+    fantasia2 dbupdate <path> [options]
+    fantasia2 dbdowngrade <path> <revision> [options]
+    fantasia2 export <path> <exportpath>... [--exclude=<excluded_albums>]... [--jobs=<jobs>] [--copy-jobs=<jobs>] [--link=<strategy>] [--no-cache] [options]
+    fantasia2 stats [<path>] [options]
+    fantasia2 analyse [<path>] [--jobs=<jobs>] [--pause=<seconds>] [--retry-failed] [options]
+    fantasia2 slowqueries [<path>] [--top=<n>] [options]
+    fantasia2 [<path>] [options]
+
+Options:
+    --profile=<file>     Time and count what the command does, and write the
+                         results to <file> on exit. Prometheus textfile format
+                         if it ends in .prom, JSON otherwise. Setting
+                         FANTASIA2_PROFILE does the same.
+    --slow-queries=<ms>  Log SQL statements taking longer than <ms>, with
+                         their query plans, for `fantasia2 slowqueries` to
+                         summarise. Setting FANTASIA2_SLOW_QUERY_MS does the
+                         same.
 """
 
+# Only what every command needs is imported up front. Qt, alembic and the
+# export and analysis code are imported by the commands using them, so the
+# command line tools start quickly and run without a display.
+# pylint: disable=import-outside-toplevel
+
+import os
 import pathlib
 import sys
 
 import docopt
-from PySide6 import QtCore, QtGui, QtQml, QtQuickControls2, QtWidgets
-
-from alembic import command as alembic_command
 
-from . import controller, db, mpris, player, utils  # pylint: disable=unused-import
+from . import db, profiling, utils
 
 
 def main() -> None:
     args = docopt.docopt(__doc__)
+    if args["--profile"]:
+        profiling.enable(args["--profile"])
     base_dir = (
         pathlib.Path(args["<path>"])
         if args["<path>"] is not None
@@ -32,57 +49,140 @@ def main() -> None:
     print("Using base directory", base_dir)
 
     if args["init"]:
-        if not base_dir.exists():
-            base_dir.mkdir()
-        assert base_dir.is_dir()
-        instance = db.F2Instance(
-            base_dir=base_dir,
-            db_addr=f"sqlite+pysqlite:///{base_dir.as_posix()}/db.sqlite3",
-        )
-        alembic_command.upgrade(utils.alembic_cfg(instance), "head")
-        instance.initialize()
+        _init(base_dir)
         return
 
     instance = db.F2Instance.from_path(base_dir)
+    slow_query_ms = args["--slow-queries"] or os.environ.get("FANTASIA2_SLOW_QUERY_MS")
+    if slow_query_ms:
+        from . import slow_queries
+
+        slow_queries.SlowQueryLog(
+            instance.engine, instance.base_dir, float(slow_query_ms)
+        )
+
+    if args["dbupgrade"] or args["dbupdate"] or args["dbdowngrade"]:
+        _migrate(instance, args)
+    elif args["sync"]:
+        utils.sync_database_with_fs(instance)
+    elif args["export"]:
+        _export(instance, args)
+    elif args["stats"]:
+        utils.print_stats(instance)
+    elif args["slowqueries"]:
+        _slow_queries(instance, args)
+    elif args["analyse"]:
+        _analyse(instance, args)
+    else:
+        _run_app(instance)
+
+
+def _init(base_dir: pathlib.Path) -> None:
+    if not base_dir.exists():
+        base_dir.mkdir()
+    assert base_dir.is_dir()
+    from alembic import command as alembic_command
+
+    instance = db.F2Instance(
+        base_dir=base_dir,
+        db_addr=f"sqlite+pysqlite:///{base_dir.as_posix()}/db.sqlite3",
+    )
+    alembic_command.upgrade(utils.alembic_cfg(instance), "head")
+    instance.initialize()
+
+
+def _migrate(instance: db.F2Instance, args: dict) -> None:
+    from alembic import command as alembic_command
 
     if args["dbupgrade"]:
         alembic_command.revision(utils.alembic_cfg(instance), "head", autogenerate=True)
-
     elif args["dbupdate"]:
         alembic_command.upgrade(utils.alembic_cfg(instance), "head")
-
-    elif args["dbdowngrade"]:
+    else:
         alembic_command.downgrade(utils.alembic_cfg(instance), args["<revision>"])
 
-    elif args["sync"]:
-        utils.sync_database_with_fs(instance)
 
-    elif args["export"]:
-        target_dir = pathlib.Path(args["<exportpath>"])
-        excluded_albums = (
-            [a.strip() for a in args["--exclude"].split(",")]
-            if args["--exclude"]
-            else []
+def _export(instance: db.F2Instance, args: dict) -> None:
+    from . import export
+
+    # Each --exclude goes with the export path in the same position
+    if len(args["--exclude"]) > len(args["<exportpath>"]):
+        sys.exit("More --exclude options than export paths")
+    targets = []
+    for i, export_path in enumerate(args["<exportpath>"]):
+        excluded = args["--exclude"][i] if i < len(args["--exclude"]) else ""
+        targets.append(
+            (
+                pathlib.Path(export_path),
+                [a.strip() for a in excluded.split(",") if a.strip()],
+            )
         )
-        utils.export_library_to_location(instance, target_dir, excluded_albums)
+    export.export_library_to_location(
+        instance,
+        targets,
+        export.ExportSettings(
+            transcode_jobs=(
+                int(args["--jobs"]) if args["--jobs"] else export.TRANSCODE_JOBS
+            ),
+            copy_jobs=(
+                int(args["--copy-jobs"]) if args["--copy-jobs"] else export.COPY_JOBS
+            ),
+            link=args["--link"] or "auto",
+            cache=None if args["--no-cache"] else export.TranscodeCache(),
+        ),
+    )
 
-    elif args["stats"]:
-        utils.print_stats(instance)
 
-    else:
-        print("Qt version", QtCore.qVersion())
-        app = QtWidgets.QApplication(sys.argv)
-        app.setApplicationName("Fantasia2")
-        app.setWindowIcon(QtGui.QIcon.fromTheme("emblem-music-symbolic"))
-        engine = QtQml.QQmlApplicationEngine()
-        with instance.session() as main_session:
-            cont = controller.Controller(instance, main_session)
-            engine.setInitialProperties({"controller": cont})
-            engine.load(str(pathlib.Path(__file__).resolve().parent / "Main.qml"))
-
-            if not engine.rootObjects():
-                sys.exit(-1)
-            sys.exit(app.exec())
+def _slow_queries(instance: db.F2Instance, args: dict) -> None:
+    from . import slow_queries
+
+    slow_queries.print_summary(
+        instance.base_dir, top=int(args["--top"]) if args["--top"] else 10
+    )
+
+
+def _analyse(instance: db.F2Instance, args: dict) -> None:
+    from . import loudness
+
+    loudness.analyse_library(
+        instance,
+        jobs=int(args["--jobs"]) if args["--jobs"] else 2,
+        pause=float(args["--pause"]) if args["--pause"] else 0.0,
+        retry_failed=args["--retry-failed"],
+    )
+
+
+def _run_app(instance: db.F2Instance) -> None:
+    from PySide6 import (  # pylint: disable=unused-import
+        QtCore,
+        QtGui,
+        QtQml,
+        QtQuickControls2,
+        QtWidgets,
+    )
+
+    # Imported for their QML registrations
+    from . import (  # pylint: disable=unused-import
+        controller,
+        mpris,
+        player,
+        qml_utils,
+    )
+
+    print("Qt version", QtCore.qVersion())
+    app = QtWidgets.QApplication(sys.argv)
+    app.setApplicationName("Fantasia2")
+    app.setWindowIcon(QtGui.QIcon.fromTheme("emblem-music-symbolic"))
+    engine = QtQml.QQmlApplicationEngine()
+    cont = controller.Controller(instance)
+    engine.setInitialProperties({"controller": cont})
+    engine.load(str(pathlib.Path(__file__).resolve().parent / "Main.qml"))
+
+    if not engine.rootObjects():
+        sys.exit(-1)
+    ret = app.exec()
+    cont.close()
+    sys.exit(ret)
 
 
 if __name__ == "__main__":
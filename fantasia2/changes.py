@@ -0,0 +1,108 @@
+import dataclasses
+
+import sqlalchemy
+
+from . import db
+
+
+@dataclasses.dataclass
+class ChangeSet:
+    """
+    What a write did to the library, by id, so the views can update just the
+    affected rows.
+    """
+
+    tracks_added: set[int] = dataclasses.field(default_factory=set)
+    tracks_removed: set[int] = dataclasses.field(default_factory=set)
+    tracks_updated: set[int] = dataclasses.field(default_factory=set)
+    # What changed about the updated tracks: Track attribute names, with
+    # "plays" for play history. Updates that don't say could be anything.
+    track_fields: set[str] = dataclasses.field(default_factory=set)
+    # Album ids whose name, place in the tree or covers changed
+    albums: set[int] = dataclasses.field(default_factory=set)
+    # Tag ids whose name, colour or usage changed
+    tags: set[int] = dataclasses.field(default_factory=set)
+
+    def __bool__(self) -> bool:
+        return any(dataclasses.astuple(self))
+
+    def normalised(self) -> "ChangeSet":
+        return self | ChangeSet()
+
+    def __or__(self, other: "ChangeSet") -> "ChangeSet":
+        merged = ChangeSet(
+            *(
+                a | b
+                for a, b in zip(dataclasses.astuple(self), dataclasses.astuple(other))
+            )
+        )
+        merged._normalise()
+        return merged
+
+    @property
+    def tracks(self) -> set[int]:
+        return self.tracks_added | self.tracks_removed | self.tracks_updated
+
+    def _normalise(self) -> None:
+        # A track added and removed again within one batch is no change, and
+        # updates to added or removed tracks are implied
+        gone = self.tracks_added & self.tracks_removed
+        self.tracks_added -= gone
+        self.tracks_removed -= gone
+        self.tracks_updated -= self.tracks_added | self.tracks_removed | gone
+
+
+def for_session(session) -> ChangeSet:
+    """
+    The changes recorded so far in `session`'s transaction. Jobs writing with
+    bulk statements, which the ORM doesn't see, add to this themselves.
+    """
+    return session.info.setdefault("changes", ChangeSet())
+
+
+def record_flushes(session) -> None:
+    """
+    Record everything `session` flushes through the ORM in its ChangeSet.
+    """
+    sqlalchemy.event.listen(session, "after_flush", _after_flush)
+
+
+def _after_flush(session, flush_context) -> None:
+    changes = for_session(session)
+    for obj in session.new:
+        _record(changes, obj, changes.tracks_added)
+    for obj in session.dirty:
+        if session.is_modified(obj, include_collections=True):
+            _record(changes, obj, changes.tracks_updated)
+    for obj in session.deleted:
+        _record(changes, obj, changes.tracks_removed)
+
+
+def _record(changes: ChangeSet, obj, track_ids: set[int]) -> None:
+    match obj:
+        case db.Track():
+            track_ids.add(obj.id)
+            attrs = sqlalchemy.inspect(obj).attrs
+            if track_ids is changes.tracks_updated:
+                changes.track_fields.update(
+                    attr.key for attr in attrs if attr.history.has_changes()
+                )
+                # Moved to another album, so both albums changed
+                moved = attrs.album.history
+                changes.albums.update(
+                    a.id for a in (*moved.added, *moved.deleted) if a is not None
+                )
+            elif obj.album_id is not None:
+                changes.albums.add(obj.album_id)
+            history = attrs.tags.history
+            changes.tags.update(t.id for t in (*history.added, *history.deleted))
+        case db.TrackToTags():
+            changes.tracks_updated.add(obj.track_id)
+            changes.track_fields.add("tags")
+            changes.tags.add(obj.tag_id)
+        case db.Album():
+            changes.albums.add(obj.id)
+        case db.Cover():
+            changes.albums.add(obj.album_id)
+        case db.Tag():
+            changes.tags.add(obj.id)
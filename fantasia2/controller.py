@@ -1,32 +1,101 @@
+import logging
 import threading
 
 from PySide6 import QtCore, QtQml
 
-from . import db, query_model, tag_model, utils
+from . import (
+    changes,
+    db,
+    listens,
+    loudness,
+    query_model,
+    snapshot,
+    tag_model,
+    utils,
+    writer,
+)
 
 QML_IMPORT_NAME = __name__
 QML_IMPORT_MAJOR_VERSION = 1
 
+logger = logging.getLogger(__name__)
+
+
+class ChangeBus(QtCore.QObject):
+    """
+    Brings the writer's change sets over to the GUI thread. Those arriving
+    within one event loop iteration are merged, so the models see one batch.
+    """
+
+    changed = QtCore.Signal(object)
+    _received = QtCore.Signal(object)
+
+    def __init__(self, db_writer: writer.Writer, parent=None) -> None:
+        super().__init__(parent)
+        self._pending = changes.ChangeSet()
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.timeout.connect(self._flush)
+        # Emitted on the writer thread, so delivered queued to this one
+        self._received.connect(self._collect)
+        db_writer.subscribe(self._received.emit)
+
+    @QtCore.Slot(object)
+    def _collect(self, changeset: changes.ChangeSet) -> None:
+        self._pending = self._pending | changeset
+        if not self._flush_timer.isActive():
+            self._flush_timer.start(0)
+
+    @QtCore.Slot()
+    def _flush(self) -> None:
+        changeset, self._pending = self._pending, changes.ChangeSet()
+        if changeset:
+            self.changed.emit(changeset)
+
 
 @QtQml.QmlElement
 @QtQml.QmlUncreatable()
 class Controller(QtCore.QObject):
-    def __init__(self, instance: db.F2Instance, session) -> None:
+    def __init__(self, instance: db.F2Instance) -> None:
         super().__init__()
 
-        self._query_model = query_model.QueryModel(session)
-        self._tag_model = tag_model.TagModel(session)
-        self._album_model = query_model.AlbumModel(session)
-        self._playlist_model = query_model.PlaylistModel(session)
+        # Every write goes through here, while the models read through their
+        # own short-lived sessions
+        self._writer = writer.Writer(instance)
+        self._snapshot_path = snapshot.default_path(instance)
+        self._query_model = query_model.QueryModel(
+            instance, self._writer, self._snapshot_path
+        )
+        self._tag_model = tag_model.TagModel(instance)
+        self._album_model = query_model.AlbumModel(instance, self._writer)
+        self._playlist_model = query_model.PlaylistModel(instance, self._writer)
+        self._listen_recorder = listens.ListenRecorder(self._writer)
+        self._change_bus = ChangeBus(self._writer, self)
         self._syncing = False
+        self._analysis_thread = None
+        self._stop_analysis = threading.Event()
         self._instance = instance
 
         self._sync_timer = QtCore.QTimer(self)
         self._sync_timer.timeout.connect(self.syncLibrary)
         self._sync_timer.start(5 * 60 * 1000)  # Every 5 mins, resync
 
-        self.syncingLibraryChanged.connect(self._refresh_model_when_sync_done)
-        self.syncLibrary()
+        for model in (
+            self._query_model,
+            self._album_model.trackModel,
+            self._playlist_model,
+        ):
+            model.tagUsageChanged.connect(self._tag_model.adjustCount)
+        for model in (
+            self._query_model,
+            self._tag_model,
+            self._album_model,
+            self._playlist_model,
+        ):
+            self._change_bus.changed.connect(model.applyChanges)
+
+        # Once the window is up
+        QtCore.QTimer.singleShot(0, self.syncLibrary)
 
     @QtCore.Property(query_model.QueryModel, constant=True)
     def queryModel(self) -> query_model.QueryModel:
@@ -44,9 +113,47 @@ class Controller(QtCore.QObject):
     def playlistModel(self) -> query_model.PlaylistModel:
         return self._playlist_model
 
+    @QtCore.Property(listens.ListenRecorder, constant=True)
+    def listenRecorder(self) -> listens.ListenRecorder:
+        return self._listen_recorder
+
+    # Seconds to wait on exit for the files being analysed, so their results
+    # can still go through the writer
+    ANALYSIS_STOP_TIMEOUT = 5
+
+    def close(self) -> None:
+        self._sync_timer.stop()
+        self._stop_analysis.set()
+        if self._analysis_thread is not None:
+            self._analysis_thread.join(self.ANALYSIS_STOP_TIMEOUT)
+        self._playlist_model.close()
+        self._listen_recorder.close()
+        # Last, as the others flush their remaining writes through it
+        self._writer.close()
+        self._save_snapshot()
+
+    def _save_snapshot(self) -> None:
+        """
+        Save the default view of the library for a quick start next time.
+        """
+        try:
+            with self._instance.read_session() as session:
+                snapshot.write(
+                    self._snapshot_path,
+                    snapshot.tracks(
+                        session, query_model.QueryModel.SortOrder.ALPHABETICAL.sql
+                    ),
+                )
+        except OSError as e:
+            logger.warning("Could not save the library snapshot: %s", e)
+
     @QtCore.Slot()
     def syncLibrary(self) -> None:
-        threading.Thread(target=self._sync_library).start()
+        # Only the last step writes, through the writer, so exiting during a
+        # scan doesn't need to wait for it
+        threading.Thread(
+            target=self._sync_library, name="library-sync", daemon=True
+        ).start()
 
     syncingLibraryChanged = QtCore.Signal(bool, name="syncingLibraryChanged")
 
@@ -62,10 +169,27 @@ class Controller(QtCore.QObject):
         if self._syncing:
             return
         self._set_syncing(True)
-        utils.sync_database_with_fs(self._instance)
-        self._set_syncing(False)
-
-    @QtCore.Slot()
-    def _refresh_model_when_sync_done(self, syncing: bool) -> None:
-        if not syncing:
-            self._query_model.refresh()
+        try:
+            utils.sync_database_with_fs(self._instance, self._writer)
+        finally:
+            self._set_syncing(False)
+
+        # Analyse new tracks after each sync, unless a previous analysis is
+        # still working through a backlog
+        if self._analysis_thread is None or not self._analysis_thread.is_alive():
+            self._analysis_thread = threading.Thread(
+                target=self._analyse_library, name="loudness-analysis", daemon=True
+            )
+            self._analysis_thread.start()
+
+    def _analyse_library(self) -> None:
+        try:
+            loudness.analyse_library(
+                self._instance,
+                progress=False,
+                db_writer=self._writer,
+                cancel=self._stop_analysis,
+            )
+        except Exception:  # pylint: disable=broad-exception-caught
+            # Including the writer having closed under a slow file on exit
+            logger.exception("Loudness analysis stopped")
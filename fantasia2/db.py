@@ -1,19 +1,56 @@
 import contextlib
+import datetime
 import hashlib
 import json
 import logging
 import pathlib
+import re
+from typing import TYPE_CHECKING
 
 import sqlalchemy
-from PySide6 import QtGui
-from sqlalchemy import BINARY, Column, Float, ForeignKey, Integer, String, create_engine
+from sqlalchemy import (
+    BINARY,
+    Column,
+    Date,
+    DateTime,
+    Float,
+    ForeignKey,
+    Integer,
+    PrimaryKeyConstraint,
+    String,
+    create_engine,
+)
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from sqlalchemy.orm import session as session_mod
 from sqlalchemy.orm import sessionmaker
 
+from . import profiling
+
+if TYPE_CHECKING:
+    from PySide6 import QtGui
+
 logger = logging.getLogger(__name__)
 
+# Applied to every new SQLite connection. A library can override these with a
+# "sqlite_pragmas" object in fantasia2.json, where null leaves SQLite's default.
+DEFAULT_SQLITE_PRAGMAS = {
+    # Readers don't block the writer and the writer doesn't block readers, so
+    # the GUI and a `fantasia2 sync` can use the database at the same time
+    "journal_mode": "WAL",
+    # Safe with WAL, only the last transactions can be lost on power failure
+    "synchronous": "NORMAL",
+    # Negative means KiB, so 64 MiB of page cache per connection
+    "cache_size": -65536,
+    "mmap_size": 256 * 2**20,
+    "temp_store": "MEMORY",
+    # Wait for a lock rather than failing straight away with "database is locked"
+    "busy_timeout": 5000,
+}
+
+_PRAGMA_NAME_RE = re.compile(r"^[a-z_]+$")
+_PRAGMA_VALUE_RE = re.compile(r"^-?[A-Za-z0-9_]+$")
+
 
 def hash_file(fname: pathlib.Path) -> bytes:
     with fname.open("rb") as fopen:
@@ -46,11 +83,14 @@ class Tag(Base):
     color_bytes = Column(BINARY(3), nullable=True)
 
     @property
-    def color(self) -> QtGui.QColor:
+    def color(self) -> "QtGui.QColor":
+        # Imported here so the command line tools don't load Qt
+        from PySide6 import QtGui  # pylint: disable=import-outside-toplevel
+
         return QtGui.QColor(*self.color_bytes) if self.color_bytes else QtGui.QColor()
 
     @color.setter
-    def color(self, value: QtGui.QColor) -> None:
+    def color(self, value: "QtGui.QColor") -> None:
         self.color_bytes = bytes((value.r(), value.g(), value.b()))
 
 
@@ -70,6 +110,12 @@ class Track(Base):
     rating = Column(Integer, nullable=True)
     tags = relationship("Tag", secondary="track_to_tags", back_populates="tracks")
     listenings = Column(Integer, nullable=False, server_default="0")
+    # EBU R128 integrated loudness (LUFS) and true peak (dBTP), filled in by
+    # the background analysis
+    loudness = Column(Float, nullable=True)
+    true_peak = Column(Float, nullable=True)
+    # When ffmpeg last couldn't analyse the file, so it isn't tried on every sync
+    loudness_failed_at = Column(DateTime, nullable=True)
 
     @property
     def path(self) -> pathlib.Path:
@@ -154,15 +200,115 @@ class Cover(Base):
     #     return self.album.folder
 
 
+class QueueEntry(Base):
+    __tablename__ = "queue_entry"
+    id = Column(Integer, primary_key=True)
+    # Not unique, so a range of entries can be shifted with a single UPDATE
+    position = Column(Integer, nullable=False, index=True)
+    track_id = Column(
+        Integer, ForeignKey("track.id", name="fk_queue_entry_track"), nullable=False
+    )
+
+
+class PlayEvent(Base):
+    __tablename__ = "play_event"
+    id = Column(Integer, primary_key=True)
+    track_id = Column(
+        Integer, ForeignKey("track.id", name="fk_play_event_track"), nullable=False
+    )
+    track = relationship("Track")
+    played_at = Column(DateTime, nullable=False)
+    seconds_played = Column(Float, nullable=False)
+
+
+class PlayRollupMixin:
+    # Keyed on (period_start, track_id), so a windowed query only touches the
+    # periods inside the window and never the raw event log
+    __table_args__ = (PrimaryKeyConstraint("period_start", "track_id"),)
+    period_start = Column(Date, nullable=False)
+    plays = Column(Integer, nullable=False, server_default="0")
+    seconds_played = Column(Float, nullable=False, server_default="0")
+    # Days in each period, counted from a Monday so that weeks start on one
+    period_days: int
+    PERIOD_EPOCH = datetime.date(2001, 1, 1)
+
+    @classmethod
+    def period_for(cls, day: datetime.date) -> datetime.date:
+        return day - datetime.timedelta(
+            days=(day - cls.PERIOD_EPOCH).days % cls.period_days
+        )
+
+    @classmethod
+    def totals_since(cls, start: datetime.date, track_ids=None):
+        query = sqlalchemy.select(
+            cls.track_id,
+            sqlalchemy.func.sum(cls.plays).label("plays"),
+            sqlalchemy.func.sum(cls.seconds_played).label("seconds_played"),
+        ).where(cls.period_start >= cls.period_for(start))
+        if track_ids is not None:
+            query = query.where(cls.track_id.in_(track_ids))
+        return query.group_by(cls.track_id).subquery()
+
+
+class DailyPlays(PlayRollupMixin, Base):
+    __tablename__ = "play_rollup_day"
+    period_days = 1
+    track_id = Column(
+        Integer,
+        ForeignKey("track.id", name="fk_play_rollup_day_track"),
+        nullable=False,
+        # For the totals of a few tracks, as the key starts with the period
+        index=True,
+    )
+
+
+class WeeklyPlays(PlayRollupMixin, Base):
+    __tablename__ = "play_rollup_week"
+    period_days = 7
+    track_id = Column(
+        Integer,
+        ForeignKey("track.id", name="fk_play_rollup_week_track"),
+        nullable=False,
+        # For the totals of a few tracks, as the key starts with the period
+        index=True,
+    )
+
+
+def _read_only(session, flush_context, instances):
+    raise RuntimeError("Read sessions can't write, use the database writer")
+
+
 class F2Instance:
     SPECFILE_NAME = "fantasia2.json"
 
-    def __init__(self, base_dir, db_addr):
+    def __init__(self, base_dir, db_addr, sqlite_pragmas=None):
         self._db_addr = db_addr
         self._engine = create_engine(
             db_addr, pool_recycle=100, isolation_level="READ UNCOMMITTED"
         )
+        self._sqlite_pragmas = {
+            name: value
+            for name, value in {
+                **DEFAULT_SQLITE_PRAGMAS,
+                **(sqlite_pragmas or {}),
+            }.items()
+            if value is not None
+        }
+        for name, value in self._sqlite_pragmas.items():
+            # They are formatted into the statement, so only allow plain values
+            if not _PRAGMA_NAME_RE.match(name) or not _PRAGMA_VALUE_RE.match(
+                str(value)
+            ):
+                raise ValueError(f"Invalid SQLite pragma {name}={value!r}")
+        if self._engine.dialect.name == "sqlite":
+            sqlalchemy.event.listen(self._engine, "connect", self._apply_pragmas)
+        if profiling.enabled():
+            profiling.instrument_engine(self._engine)
         self._session_cls = sessionmaker(bind=self._engine, autoflush=False)
+        self._read_session_cls = sessionmaker(
+            bind=self._engine, autoflush=False, expire_on_commit=False
+        )
+        sqlalchemy.event.listen(self._read_session_cls, "before_flush", _read_only)
         self._base_dir = base_dir.resolve()
 
     def __repr__(self) -> str:
@@ -187,6 +333,18 @@ class F2Instance:
     def engine(self):
         return self._engine
 
+    @property
+    def sqlite_pragmas(self):
+        return dict(self._sqlite_pragmas)
+
+    def _apply_pragmas(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in self._sqlite_pragmas.items():
+                cursor.execute(f"PRAGMA {name} = {value}")
+        finally:
+            cursor.close()
+
     @property
     def spec_file(self):
         return self._base_dir / self.SPECFILE_NAME
@@ -203,6 +361,14 @@ class F2Instance:
         finally:
             session.close()
 
+    def read_session(self):
+        """
+        A session for the GUI to load rows through. All writes go through the
+        database writer instead, so this is never committed, just closed once
+        nothing shows the rows loaded through it any more.
+        """
+        return self._read_session_cls(info={"instance": self})
+
     def initialize(self):
         with (self._base_dir / self.SPECFILE_NAME).open("w") as metaf:
             json.dump({"db_addr": self._db_addr, "version": 1}, metaf)
@@ -0,0 +1,829 @@
+import collections
+import concurrent.futures
+import contextlib
+import dataclasses
+import errno
+import hashlib
+import json
+import os
+import pathlib
+import re
+import subprocess
+import threading
+import time
+from typing import Callable, Optional, Sequence
+
+import tqdm
+
+from . import db, profiling, utils
+
+# ffmpeg is CPU bound, copying is bound by the target device, which is often
+# an SD card or USB stick that gets slower with too many writers
+TRANSCODE_JOBS = os.cpu_count() or 2
+COPY_JOBS = 2
+
+# Transcoded files are kept between exports, up to this many bytes
+TRANSCODE_CACHE_SIZE = 10 * 2**30
+
+# Written into the root of the export, describing what each file was made from
+MANIFEST_NAME = ".fantasia2-export.json"
+MANIFEST_VERSION = 1
+
+# How files that don't need transcoding are put in place. Each strategy falls
+# back to the next one when the filesystems involved don't support it.
+# Hardlinks share the inode with the library, so are only used when asked for.
+LINK_STRATEGIES = {
+    "auto": ("reflink", "copy_file_range", "copy"),
+    "reflink": ("reflink", "copy"),
+    "hardlink": ("hardlink", "reflink", "copy_file_range", "copy"),
+    "copy_file_range": ("copy_file_range", "copy"),
+    "copy": ("copy",),
+}
+
+# From linux/fs.h
+_FICLONE = 0x40049409
+
+# Errors meaning the method isn't available here, rather than a real failure
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EPERM,
+    errno.EMLINK,
+}
+
+
+def export_name_trans(name, strip_dot=False):
+    name = re.sub(r'[<>:"\\|?*\0-\x1f]', "_", name)
+    if strip_dot:
+        name = name.rstrip(".")
+    return name
+
+
+def export_ext(ext):
+    # https://www.seatcupra.net/forums/threads/sd-card-media-format-type-and-useful-information.468327/#post-4998551
+    if ext in {
+        ".mp2",
+        ".mp3",
+        ".wav",
+        ".wma",
+        ".m4a",
+        ".m4b",
+        ".aac",
+        ".ogg",
+        ".flac",
+        ".mka",
+    }:
+        return ext
+    if ext in {".opus"}:
+        return ".m4a"
+    if ext in {".mp4"}:
+        return ".m4a"
+    raise RuntimeError(f"Encoding for {ext}?")
+
+
+def transcode_args(src_ext):
+    if src_ext != ".opus":
+        return ["-c:a", "copy"]
+    return []
+
+
+def convert_ffmpeg(src, dst):
+    extra_args = transcode_args(src.suffix)
+    try:
+        subprocess.run(
+            ["ffmpeg", "-nostdin", "-y", "-i", src, *extra_args, dst],
+            check=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as exc:
+        lines = exc.stderr.decode(errors="replace").strip().splitlines()
+        raise RuntimeError(f"Transcoding failed: {lines[-1] if lines else exc}")
+
+
+def _reflink(src: pathlib.Path, dest: pathlib.Path) -> None:
+    import fcntl  # pylint: disable=import-outside-toplevel
+
+    with open(src, "rb") as src_f, open(dest, "wb") as dest_f:
+        fcntl.ioctl(dest_f.fileno(), _FICLONE, src_f.fileno())
+
+
+def _copy_file_range(src: pathlib.Path, dest: pathlib.Path) -> None:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    with open(src, "rb") as src_f, open(dest, "wb") as dest_f:
+        while os.copy_file_range(src_f.fileno(), dest_f.fileno(), 2**30):
+            pass
+
+
+_PLACE_METHODS = {
+    "reflink": _reflink,
+    "hardlink": os.link,
+    "copy_file_range": _copy_file_range,
+}
+
+# Read size when copying one source to several targets
+COPY_CHUNK_SIZE = 2**20
+
+# (method, source device, target device) combinations that have failed as
+# unsupported, so they aren't retried for every file
+_unsupported_methods: set[tuple[str, int, int]] = set()
+
+
+def _close_quietly(f) -> None:
+    with contextlib.suppress(OSError):
+        f.close()
+
+
+def _copy_to_many(
+    src: pathlib.Path, dests: Sequence[pathlib.Path]
+) -> dict[pathlib.Path, OSError]:
+    """
+    Copy `src` to each of `dests` from one read. A destination that can't be
+    written is dropped while the others carry on, and its error returned.
+    """
+    errors = {}
+    dest_fs = {}
+    try:
+        with open(src, "rb") as src_f:
+            for dest in dests:
+                try:
+                    # pylint: disable-next=consider-using-with
+                    dest_fs[dest] = open(dest, "wb")
+                except OSError as exc:
+                    errors[dest] = exc
+            while dest_fs and (chunk := src_f.read(COPY_CHUNK_SIZE)):
+                for dest, dest_f in list(dest_fs.items()):
+                    try:
+                        dest_f.write(chunk)
+                    except OSError as exc:
+                        errors[dest] = exc
+                        _close_quietly(dest_fs.pop(dest))
+        for dest in list(dest_fs):
+            try:
+                # Buffered writes can fail here too, on a full disk
+                dest_fs.pop(dest).close()
+            except OSError as exc:
+                errors[dest] = exc
+    finally:
+        for dest_f in dest_fs.values():
+            _close_quietly(dest_f)
+    return errors
+
+
+def place_files(
+    src: pathlib.Path, dests: Sequence[pathlib.Path], strategy: str = "auto"
+) -> list[str | OSError]:
+    """
+    Put copies of `src` at each of `dests` without transcoding, using the
+    first method from the strategy that each target's filesystem supports.
+    Destinations that need a real copy are all written from one read of the
+    source. Returns the method used for each destination, or the error for
+    one that couldn't be written, so one bad target doesn't fail the others.
+    """
+    src_dev = src.stat().st_dev
+    methods = {}
+    for dest in dests:
+        try:
+            dest_dev = dest.parent.stat().st_dev
+        except OSError as exc:
+            methods[dest] = exc
+            continue
+        for method in LINK_STRATEGIES[strategy]:
+            if method == "copy":
+                break
+            if (method, src_dev, dest_dev) in _unsupported_methods:
+                continue
+            try:
+                _PLACE_METHODS[method](src, dest)
+            except OSError as exc:
+                if exc.errno not in _UNSUPPORTED_ERRNOS:
+                    methods[dest] = exc
+                    break
+                _unsupported_methods.add((method, src_dev, dest_dev))
+                dest.unlink(missing_ok=True)
+            else:
+                methods[dest] = method
+                break
+    copies = [dest for dest in dests if dest not in methods]
+    if copies:
+        errors = _copy_to_many(src, copies)
+        methods.update({dest: errors.get(dest, "copy") for dest in copies})
+    return [methods[dest] for dest in dests]
+
+
+def _from_cache(methods: list[str | OSError], transcoded: bool) -> list[str | OSError]:
+    placed = [m if isinstance(m, OSError) else "cache" for m in methods]
+    if transcoded and not isinstance(placed[0], OSError):
+        placed[0] = "transcode"
+    return placed
+
+
+def default_transcode_cache_dir() -> pathlib.Path:
+    return utils.xdg_cache_dir() / "transcode"
+
+
+class TranscodeCache:
+    """
+    Transcoded files keyed by the source's content hash and the transcode
+    settings, so a source is transcoded once however many devices it is
+    exported to. The source's size and modification time are part of the key
+    too, as a file edited in place keeps its old hash until the next sync.
+    The directory is kept under `max_size` bytes by evicting the
+    least recently used files.
+    """
+
+    def __init__(
+        self,
+        cache_dir: Optional[pathlib.Path] = None,
+        max_size: int = TRANSCODE_CACHE_SIZE,
+    ) -> None:
+        self._cache_dir = cache_dir or default_transcode_cache_dir()
+        self._max_size = max_size
+        self._used: Optional[int] = None
+        # Entries being placed into an export, which eviction leaves alone
+        self._in_use = collections.Counter()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+    def _cache_path(self, src: pathlib.Path, file_hash: bytes, dest_ext: str):
+        stat = src.stat()
+        settings = " ".join(
+            [str(stat.st_size), str(stat.st_mtime_ns), dest_ext]
+            + transcode_args(src.suffix)
+        )
+        key = hashlib.sha1(file_hash + b"\0" + settings.encode()).hexdigest()
+        return self._cache_dir / (key + dest_ext)
+
+    def export(
+        self,
+        src: pathlib.Path,
+        file_hash: bytes,
+        dests: Sequence[pathlib.Path],
+        link: str,
+    ) -> list[str | OSError]:
+        """
+        Put a transcode of `src` at each of `dests`, from the cache if it's
+        there. Returns how each file was placed, as `place_files` does.
+        """
+        cached = self._cache_path(src, file_hash, dests[0].suffix)
+        with self._lock:
+            if self._used is None:
+                self._scan()
+            self._in_use[cached] += 1
+        try:
+            if cached.exists():
+                os.utime(cached)
+                with self._lock:
+                    self.hits += 1
+                return _from_cache(place_files(cached, dests, link), False)
+
+            with self._lock:
+                self.misses += 1
+            partial = cached.with_name(f".{threading.get_ident()}.{cached.name}")
+            try:
+                convert_ffmpeg(src, partial)
+                size = partial.stat().st_size
+                if size > self._max_size:
+                    methods = place_files(partial, dests, link)
+                    if not isinstance(methods[0], OSError):
+                        methods[0] = "transcode"
+                    return methods
+                os.replace(partial, cached)
+            finally:
+                partial.unlink(missing_ok=True)
+            with self._lock:
+                self._used += size
+                self._evict()
+            return _from_cache(place_files(cached, dests, link), True)
+        finally:
+            with self._lock:
+                self._in_use[cached] -= 1
+                if not self._in_use[cached]:
+                    del self._in_use[cached]
+
+    def _scan(self) -> None:
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        self._used = 0
+        for entry in self._cache_dir.iterdir():
+            if entry.name.startswith("."):
+                # Left over from a transcode that was interrupted
+                entry.unlink()
+            else:
+                self._used += entry.stat().st_size
+        self._evict()
+
+    def _evict(self) -> None:
+        if self._used <= self._max_size:
+            return
+        # Hits touch the entry, so mtime order is LRU order
+        entries = sorted(
+            (entry.stat().st_mtime_ns, entry)
+            for entry in self._cache_dir.iterdir()
+            if not entry.name.startswith(".") and entry not in self._in_use
+        )
+        for _, entry in entries:
+            if self._used <= self._max_size:
+                break
+            self._used -= entry.stat().st_size
+            entry.unlink()
+
+
+def _transcode_to_many(
+    src: pathlib.Path, dests: Sequence[pathlib.Path], link: str
+) -> list[str | Exception]:
+    # Transcode into the first target that takes it and place the others from
+    # there, so a target that can't be written doesn't fail the rest
+    errors = []
+    for i, dest in enumerate(dests):
+        try:
+            convert_ffmpeg(src, dest)
+        except (OSError, RuntimeError) as exc:
+            errors.append(exc)
+        else:
+            return [*errors, "transcode", *place_files(dest, dests[i + 1 :], link)]
+    return errors
+
+
+def _partial_path(dest: pathlib.Path) -> pathlib.Path:
+    # Keeps the suffix so ffmpeg can still pick the output format from it
+    return dest.with_name(f".{dest.stem}.part{dest.suffix}")
+
+
+@profiling.timed("export.file")
+def export_file(
+    src: pathlib.Path,
+    dests: Sequence[pathlib.Path],
+    link: str = "auto",
+    file_hash: Optional[bytes] = None,
+    cache: Optional[TranscodeCache] = None,
+) -> list[str | Exception]:
+    """
+    Copy or transcode one source to each of `dests`, reading and transcoding
+    it at most once. Returns how each file was made, or the error for a
+    destination that couldn't be written. The outputs are written under
+    temporary names and renamed into place, so an interrupted export never
+    leaves a truncated file that looks finished.
+    """
+    partials = [_partial_path(dest) for dest in dests]
+    for partial in partials:
+        # A target that can't be written fails when placing the file instead
+        with contextlib.suppress(OSError):
+            partial.unlink(missing_ok=True)
+    try:
+        if src.suffix == dests[0].suffix:
+            methods = place_files(src, partials, link)
+        elif cache is not None and file_hash is not None:
+            methods = cache.export(src, file_hash, partials, link)
+        else:
+            methods = _transcode_to_many(src, partials, link)
+        for i, (partial, dest) in enumerate(zip(partials, dests)):
+            if not isinstance(methods[i], Exception):
+                try:
+                    os.replace(partial, dest)
+                except OSError as exc:
+                    methods[i] = exc
+            if isinstance(methods[i], Exception):
+                with contextlib.suppress(OSError):
+                    partial.unlink(missing_ok=True)
+            else:
+                profiling.count("export.files", method=methods[i])
+        return methods
+    except BaseException:
+        for partial in partials:
+            with contextlib.suppress(OSError):
+                partial.unlink(missing_ok=True)
+        raise
+
+
+def _file_size(path: pathlib.Path) -> int:
+    try:
+        return path.stat().st_size
+    except OSError:
+        return 0
+
+
+@dataclasses.dataclass(frozen=True)
+class ExportSettings:
+    """
+    How files are exported: the sizes of the transcode and copy pools, the
+    link strategy for files that don't need transcoding, and the transcode
+    cache, if any.
+    """
+
+    transcode_jobs: int = TRANSCODE_JOBS
+    copy_jobs: int = COPY_JOBS
+    link: str = "auto"
+    cache: Optional[TranscodeCache] = None
+
+    def __post_init__(self) -> None:
+        if self.link not in LINK_STRATEGIES:
+            raise ValueError(
+                f"Unknown link strategy {self.link!r},"
+                f" expected one of {', '.join(LINK_STRATEGIES)}"
+            )
+
+
+class _TargetProgress:
+    """
+    How far the export to one target has got, on its own progress bar.
+    """
+
+    def __init__(
+        self, target: pathlib.Path, files: int, progress_bar: tqdm.tqdm
+    ) -> None:
+        self.target = target
+        self.files = files
+        self.done = 0
+        self.failed = 0
+        self.progress_bar = progress_bar
+
+    def update(self, size: int, failed: bool) -> None:
+        self.done += 1
+        self.failed += failed
+        self.progress_bar.update(size)
+        self.progress_bar.set_postfix(
+            files=f"{self.done}/{self.files}", failed=self.failed
+        )
+
+
+class ExportProgress(contextlib.ExitStack):
+    """
+    Progress of an export for each of its targets, and how each file was made
+    or why it failed, for the summary at the end.
+    """
+
+    def __init__(
+        self,
+        jobs: Sequence[tuple[pathlib.Path, Optional[bytes], Sequence[pathlib.Path]]],
+        targets: Sequence[pathlib.Path] = (),
+        progress: bool = True,
+    ) -> None:
+        super().__init__()
+        targets = list(targets) or [pathlib.Path("/")]
+        self._sizes = {src: _file_size(src) for src, _, _ in jobs}
+        # Targets can be nested, so a file belongs to the deepest one it is under
+        target_of = {
+            dest: max(
+                (i for i, target in enumerate(targets) if dest.is_relative_to(target)),
+                key=lambda i: len(targets[i].parts),
+            )
+            for _, _, dests in jobs
+            for dest in dests
+        }
+        total_bytes = [0] * len(targets)
+        files = [0] * len(targets)
+        for src, _, dests in jobs:
+            for dest in dests:
+                total_bytes[target_of[dest]] += self._sizes[src]
+                files[target_of[dest]] += 1
+        self._targets = [
+            _TargetProgress(
+                target,
+                files[i],
+                self.enter_context(
+                    tqdm.tqdm(
+                        total=total_bytes[i],
+                        desc=str(target) if len(targets) > 1 else None,
+                        position=i,
+                        unit="B",
+                        unit_scale=True,
+                        disable=not progress,
+                    )
+                ),
+            )
+            for i, target in enumerate(targets)
+        ]
+        self._target_of = {dest: self._targets[i] for dest, i in target_of.items()}
+        self._methods = collections.Counter()
+        self._started = time.monotonic()
+        self.failures: list[tuple[pathlib.Path, str]] = []
+
+    def exported(
+        self, src: pathlib.Path, dest: pathlib.Path, result: str | Exception
+    ) -> None:
+        """
+        Count one destination as done, by `result`, the method or the error.
+        """
+        if isinstance(result, Exception):
+            self.failures.append((dest, str(result)))
+        else:
+            self._methods[result] += 1
+        self._target_of[dest].update(
+            self._sizes[src], failed=isinstance(result, Exception)
+        )
+
+    def print_summary(self, cache: Optional[TranscodeCache] = None) -> None:
+        elapsed = time.monotonic() - self._started
+        read_bytes = sum(self._sizes.values())
+        total_files = sum(target.files for target in self._targets)
+        print(
+            f"Exported {total_files - len(self.failures)} of {total_files} files"
+            f" from {len(self._sizes)} sources, {read_bytes / 2**20:.1f} MiB read"
+            f" in {elapsed:.1f}s"
+            f" ({read_bytes / 2**20 / max(elapsed, 1e-9):.1f} MiB/s)"
+        )
+        if len(self._targets) > 1:
+            for target in self._targets:
+                print(
+                    f"    {target.target}: {target.files - target.failed}"
+                    f" of {target.files} files"
+                )
+        if self._methods:
+            print(
+                ", ".join(
+                    f"{count} by {method}" for method, count in self._methods.items()
+                )
+            )
+        if cache is not None and cache.hits + cache.misses:
+            print(f"Transcode cache: {cache.hits} hits, {cache.misses} misses")
+        if self.failures:
+            print(f"{len(self.failures)} files failed:")
+            for dest, error in self.failures:
+                print(f"    - {dest}: {error}")
+
+
+def _results_of(
+    future: "concurrent.futures.Future[list[str | Exception]]", count: int
+) -> list[str | Exception]:
+    """
+    The results of an export_file job for its `count` destinations, with the
+    job's error for each if it failed as a whole.
+    """
+    try:
+        return future.result()
+    except (OSError, RuntimeError) as exc:
+        return [exc] * count
+
+
+def export_files(
+    jobs: Sequence[tuple[pathlib.Path, Optional[bytes], Sequence[pathlib.Path]]],
+    targets: Sequence[pathlib.Path] = (),
+    settings: ExportSettings = ExportSettings(),
+    progress: bool = True,
+    on_exported: Optional[Callable[[pathlib.Path, pathlib.Path], None]] = None,
+) -> list[tuple[pathlib.Path, str]]:
+    """
+    Export (src, file_hash, dests) jobs, with transcodes and plain copies each
+    running in their own pool. Progress is shown for each of `targets`. A job
+    or destination that fails is reported and skipped rather than stopping the
+    export.
+    `on_exported` is called from this thread for each file that succeeds.
+    Returns the failed destinations and their errors.
+    """
+    with (
+        concurrent.futures.ThreadPoolExecutor(
+            max_workers=settings.transcode_jobs
+        ) as transcodes,
+        concurrent.futures.ThreadPoolExecutor(max_workers=settings.copy_jobs) as copies,
+        ExportProgress(jobs, targets, progress) as export_progress,
+    ):
+        futures = {
+            (copies if src.suffix == dests[0].suffix else transcodes).submit(
+                export_file, src, dests, settings.link, file_hash, settings.cache
+            ): (src, dests)
+            for src, file_hash, dests in jobs
+        }
+
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                src, dests = futures[future]
+                for dest, result in zip(dests, _results_of(future, len(dests))):
+                    export_progress.exported(src, dest, result)
+                    if on_exported is not None and not isinstance(result, Exception):
+                        on_exported(src, dest)
+        except BaseException:
+            # Don't wait for the whole queue when interrupted
+            transcodes.shutdown(cancel_futures=True)
+            copies.shutdown(cancel_futures=True)
+            raise
+
+    export_progress.print_summary(settings.cache)
+    return export_progress.failures
+
+
+def load_manifest(target_dir: pathlib.Path) -> Optional[dict[str, dict]]:
+    """
+    The manifest entries of a previous export, keyed by export path, or None
+    if the target has no usable manifest.
+    """
+    try:
+        with open(target_dir / MANIFEST_NAME, encoding="utf-8") as f:
+            manifest = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as exc:
+        print(f"Ignoring unreadable manifest: {exc}")
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest["files"]
+
+
+def save_manifest(target_dir: pathlib.Path, entries: dict[str, dict]) -> None:
+    path = target_dir / MANIFEST_NAME
+    partial = _partial_path(path)
+    with open(partial, "w", encoding="utf-8") as f:
+        json.dump({"version": MANIFEST_VERSION, "files": entries}, f)
+    os.replace(partial, path)
+
+
+def source_entry(track: db.Track) -> Optional[dict]:
+    """
+    What a manifest records about the source of an exported track. A change
+    to any of it means the file has to be exported again.
+    """
+    try:
+        stat = track.path.stat()
+    except OSError:
+        return None
+    return {
+        "track_id": track.id,
+        "file_hash": track.file_hash.hex(),
+        "size": stat.st_size,
+        "mtime": stat.st_mtime_ns,
+    }
+
+
+def _scan_target(
+    target_dir: pathlib.Path, wanted: dict[str, dict]
+) -> dict[str, dict]:
+    """
+    Build a manifest for an export made before manifests were written. Files
+    that are already there are assumed to be up to date, and anything else is
+    listed with no source so it gets removed.
+    """
+    print("    No manifest, scanning target structure")
+    entries = {}
+    for path in target_dir.rglob("*"):
+        if path.is_dir() or path.name == MANIFEST_NAME:
+            continue
+        name = path.relative_to(target_dir).as_posix()
+        entries[name] = wanted.get(name, {})
+    return entries
+
+
+def _remove_empty_dirs(target_dir: pathlib.Path, removed: Sequence[str]) -> None:
+    parents = {
+        parent
+        for name in removed
+        for parent in pathlib.PurePosixPath(name).parents
+        if parent != pathlib.PurePosixPath()
+    }
+    for parent in sorted(parents, key=lambda p: len(p.parts), reverse=True):
+        try:
+            (target_dir / parent).rmdir()
+        except OSError:
+            pass
+
+
+def _is_excluded(folder: str, excluded_albums: Sequence[str]) -> bool:
+    return folder in excluded_albums or any(
+        str(p) in excluded_albums for p in pathlib.Path(folder).parents
+    )
+
+
+def _render_library(
+    instance: db.F2Instance,
+) -> tuple[list[tuple[str, str, dict]], dict[str, tuple[pathlib.Path, bytes]]]:
+    """
+    The export name of every track that is there to export, as (folder,
+    export name, manifest entry), and the source of each export name.
+    """
+    rendered = []
+    sources = {}
+    with instance.session() as session:
+        for track in session.query(db.Track).all():
+            export_name = (
+                pathlib.PurePosixPath()
+                / export_name_trans(track.folder, strip_dot=True)
+                / (export_name_trans(track.name) + export_ext(track.extension))
+            ).as_posix()
+            entry = source_entry(track)
+            if entry is None:
+                print(f"Skipping missing {track.path}")
+                continue
+            rendered.append((track.folder, export_name, entry))
+            sources[export_name] = (track.path, track.file_hash)
+    return rendered, sources
+
+
+@dataclasses.dataclass
+class _TargetPlan:
+    """
+    What an export changes in one target: the files it should end up with,
+    the manifest of what is there, and the names to remove and add.
+    """
+
+    target_dir: pathlib.Path
+    wanted: dict[str, dict]
+    manifest: dict[str, dict]
+    to_remove: list[str]
+    to_add: list[str]
+
+
+def _plan_target(
+    target_dir: pathlib.Path,
+    excluded_albums: Sequence[str],
+    rendered: Sequence[tuple[str, str, dict]],
+) -> _TargetPlan:
+    wanted = {
+        export_name: entry
+        for folder, export_name, entry in rendered
+        if not _is_excluded(folder, excluded_albums)
+    }
+    print(f"{target_dir}:")
+    target_dir.mkdir(parents=True, exist_ok=True)
+    manifest = load_manifest(target_dir)
+    if manifest is None:
+        manifest = _scan_target(target_dir, wanted)
+
+    plan = _TargetPlan(
+        target_dir,
+        wanted,
+        manifest,
+        to_remove=[name for name in manifest if name not in wanted],
+        to_add=[name for name, entry in wanted.items() if manifest.get(name) != entry],
+    )
+    print("    Found", len(manifest), "paths")
+    print("    Targeting", len(wanted), "paths")
+    print("    Will remove", len(plan.to_remove), "paths")
+    print("    Will add", len(plan.to_add), "paths")
+    return plan
+
+
+def _export_jobs(
+    plans: Sequence[_TargetPlan],
+    sources: dict[str, tuple[pathlib.Path, bytes]],
+) -> tuple[list[tuple], dict[pathlib.Path, tuple[dict, str, dict]]]:
+    """
+    The (src, file_hash, dests) jobs for the files to add, grouped by source
+    so each is read once and fanned out to its targets, and the manifest,
+    name and entry to record for each destination once it is exported.
+    """
+    jobs = {}
+    manifest_entries = {}
+    for plan in plans:
+        for name in plan.to_add:
+            dest = plan.target_dir / name
+            dest.parent.mkdir(exist_ok=True, parents=True)
+            src, file_hash = sources[name]
+            jobs.setdefault(name, (src, file_hash, []))[2].append(dest)
+            manifest_entries[dest] = (plan.manifest, name, plan.wanted[name])
+    return list(jobs.values()), manifest_entries
+
+
+@profiling.timed("export.library")
+def export_library_to_location(
+    instance: db.F2Instance,
+    targets: Sequence[tuple[pathlib.Path, Sequence[str]]],
+    settings: ExportSettings = ExportSettings(),
+) -> None:
+    """
+    Export the library to each (target_dir, excluded_albums) target. Every
+    source is read and transcoded at most once, however many targets need it.
+    """
+    print("Rendering directory structure")
+    rendered, sources = _render_library(instance)
+    plans = [
+        _plan_target(target_dir, excluded_albums, rendered)
+        for target_dir, excluded_albums in targets
+    ]
+
+    if not any(plan.to_remove or plan.to_add for plan in plans):
+        for plan in plans:
+            save_manifest(plan.target_dir, plan.manifest)
+        print("Nothing to do")
+        return
+    input("Continue? ")
+
+    print("Removing excess paths")
+    for plan in plans:
+        for name in plan.to_remove:
+            (plan.target_dir / name).unlink(missing_ok=True)
+            del plan.manifest[name]
+        _remove_empty_dirs(plan.target_dir, plan.to_remove)
+        save_manifest(plan.target_dir, plan.manifest)
+
+    print("Adding new paths")
+    jobs, manifest_entries = _export_jobs(plans, sources)
+
+    def exported(src, dest):
+        manifest, name, entry = manifest_entries[dest]
+        manifest[name] = entry
+
+    try:
+        export_files(
+            jobs,
+            targets=[plan.target_dir for plan in plans],
+            settings=settings,
+            on_exported=exported,
+        )
+    finally:
+        # Also on interruption, so finished files aren't exported again
+        for plan in plans:
+            save_manifest(plan.target_dir, plan.manifest)
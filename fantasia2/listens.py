@@ -0,0 +1,217 @@
+import collections
+import concurrent.futures
+import datetime
+import logging
+import queue
+import threading
+import time
+from typing import Optional
+
+import sqlalchemy
+from PySide6 import QtCore, QtQml
+from sqlalchemy import exc
+
+from . import changes, db, writer
+
+QML_IMPORT_NAME = __name__
+QML_IMPORT_MAJOR_VERSION = 1
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+@QtQml.QmlElement
+@QtQml.QmlUncreatable()
+class ListenRecorder(QtCore.QObject):
+    """
+    Write-behind queue for listen counts and the play history. Increments and
+    play events are batched on a worker thread and written periodically, so a
+    locked database never stalls playback.
+    """
+
+    FLUSH_INTERVAL = 30
+    RETRY_INTERVAL = 5
+    # Seconds to keep trying the last flush for when closing, so a locked
+    # database can't hold up exiting for long
+    SHUTDOWN_DEADLINE = 2
+    SHUTDOWN_RETRY_INTERVAL = 0.25
+
+    def __init__(
+        self, db_writer: writer.Writer, flush_interval: float = FLUSH_INTERVAL
+    ) -> None:
+        super().__init__()
+        self._writer = db_writer
+        self._flush_interval = flush_interval
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="listen-recorder", daemon=True
+        )
+        self._thread.start()
+
+    @QtCore.Slot(int)
+    def record(self, track_id: int) -> None:
+        self._queue.put(track_id)
+
+    @QtCore.Slot(int, float, float)
+    def played(self, track_id: int, started_at: float, seconds: float) -> None:
+        """
+        Log a finished play of a track, started at the timestamp `started_at`,
+        of which `seconds` were actually heard.
+        """
+        self._queue.put(
+            db.PlayEvent(
+                track_id=track_id,
+                played_at=datetime.datetime.fromtimestamp(started_at),
+                seconds_played=seconds,
+            )
+        )
+
+    def close(self) -> None:
+        """
+        Flush everything still pending and stop the worker.
+        """
+        self._queue.put(_CLOSE)
+        # A flush already waiting on the writer when closing has no deadline
+        self._thread.join(self.SHUTDOWN_DEADLINE + self.SHUTDOWN_RETRY_INTERVAL)
+        if self._thread.is_alive():
+            logger.error("Gave up waiting to write listen counts")
+
+    def _run(self) -> None:
+        pending = _Pending()
+        deadline = None
+
+        while True:
+            timeout = None if deadline is None else max(0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if item is _CLOSE:
+                break
+
+            if item is not None:
+                pending.add(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self._flush_interval
+                continue
+
+            if self._flush(pending):
+                deadline = None
+            else:
+                deadline = time.monotonic() + self.RETRY_INTERVAL
+
+        give_up_at = time.monotonic() + self.SHUTDOWN_DEADLINE
+        while not self._flush(pending, give_up_at):
+            if time.monotonic() + self.SHUTDOWN_RETRY_INTERVAL > give_up_at:
+                break
+            time.sleep(self.SHUTDOWN_RETRY_INTERVAL)
+        else:
+            return
+        logger.error(
+            "Dropping %s unwritten listens and %s plays",
+            sum(pending.listens.values()),
+            len(pending.events),
+        )
+
+    def _flush(self, pending: "_Pending", give_up_at: Optional[float] = None) -> bool:
+        if not pending:
+            return True
+        timeout = None if give_up_at is None else max(0, give_up_at - time.monotonic())
+        try:
+            self._writer.call(pending.write, timeout)
+        except exc.OperationalError as e:
+            # Most likely another process holds the write lock, keep the
+            # counts and try again later
+            logger.warning("Could not write listen counts, will retry: %s", e)
+            return False
+        except concurrent.futures.TimeoutError:
+            # Stuck behind other writes; cancelled unless it already started
+            logger.warning("Timed out writing listen counts")
+            return False
+        pending.clear()
+        return True
+
+
+class _Pending:
+    def __init__(self) -> None:
+        self.listens = collections.Counter()
+        self.events: list[db.PlayEvent] = []
+
+    def __bool__(self) -> bool:
+        return bool(self.listens or self.events)
+
+    def add(self, item) -> None:
+        if isinstance(item, db.PlayEvent):
+            self.events.append(item)
+        else:
+            self.listens[item] += 1
+
+    def clear(self) -> None:
+        self.listens.clear()
+        self.events = []
+
+    def write(self, session) -> None:
+        conn = session.connection()
+        changeset = changes.for_session(session)
+        changeset.tracks_updated.update(self.listens)
+        changeset.tracks_updated.update(event.track_id for event in self.events)
+        if self.events:
+            changeset.track_fields.add("plays")
+        if self.listens:
+            changeset.track_fields.add("listenings")
+            conn.execute(
+                sqlalchemy.update(db.Track)
+                .where(db.Track.id == sqlalchemy.bindparam("track_id"))
+                .values(
+                    listenings=db.Track.listenings + sqlalchemy.bindparam("count")
+                ),
+                [
+                    {"track_id": track_id, "count": count}
+                    for track_id, count in self.listens.items()
+                ],
+            )
+        if not self.events:
+            return
+
+        conn.execute(
+            sqlalchemy.insert(db.PlayEvent),
+            [
+                {
+                    "track_id": event.track_id,
+                    "played_at": event.played_at,
+                    "seconds_played": event.seconds_played,
+                }
+                for event in self.events
+            ],
+        )
+
+        for rollup in (db.DailyPlays, db.WeeklyPlays):
+            totals = collections.defaultdict(lambda: [0, 0.0])
+            for event in self.events:
+                key = (rollup.period_for(event.played_at.date()), event.track_id)
+                totals[key][0] += 1
+                totals[key][1] += event.seconds_played
+
+            for (period_start, track_id), (plays, seconds) in totals.items():
+                updated = conn.execute(
+                    sqlalchemy.update(rollup)
+                    .where(
+                        (rollup.period_start == period_start)
+                        & (rollup.track_id == track_id)
+                    )
+                    .values(
+                        plays=rollup.plays + plays,
+                        seconds_played=rollup.seconds_played + seconds,
+                    )
+                )
+                if updated.rowcount == 0:
+                    conn.execute(
+                        sqlalchemy.insert(rollup).values(
+                            period_start=period_start,
+                            track_id=track_id,
+                            plays=plays,
+                            seconds_played=seconds,
+                        )
+                    )
@@ -0,0 +1,186 @@
+import concurrent.futures
+import datetime
+import logging
+import pathlib
+import re
+import subprocess
+import threading
+import time
+from typing import Optional
+
+import sqlalchemy
+import tqdm
+
+from . import db, writer
+
+logger = logging.getLogger(__name__)
+
+# ReplayGain 2.0 reference level
+TARGET_LOUDNESS = -18.0
+
+# Tracks analysed between database commits, which is also how much work is
+# lost if the analysis is interrupted
+COMMIT_EVERY = 20
+
+_INTEGRATED_RE = re.compile(r"^\s*I:\s+(-?[\d.]+|-inf) LUFS", re.MULTILINE)
+_PEAK_RE = re.compile(r"^\s*Peak:\s+(-?[\d.]+|-inf) dBFS", re.MULTILINE)
+
+# Measured in place of files not started because the run was cancelled
+_CANCELLED = object()
+
+
+def measure_loudness(path: pathlib.Path) -> tuple[float, float]:
+    """
+    Integrated loudness (LUFS) and true peak (dBTP) of a file, from ffmpeg's
+    ebur128 filter. Raises RuntimeError if ffmpeg rejects the file, and
+    OSError if it can't be run at all.
+    """
+    try:
+        result = subprocess.run(
+            [
+                "nice",
+                "-n",
+                "10",
+                "ffmpeg",
+                "-nostats",
+                "-hide_banner",
+                "-i",
+                path,
+                "-map",
+                "0:a:0",
+                "-af",
+                "ebur128=peak=true",
+                "-f",
+                "null",
+                "-",
+            ],
+            check=True,
+            capture_output=True,
+        )
+    except subprocess.CalledProcessError as exc:
+        if exc.returncode in (126, 127):
+            # From nice: ffmpeg itself couldn't be run, the file isn't at fault
+            raise OSError(
+                f"Could not run ffmpeg (exit status {exc.returncode})"
+            ) from exc
+        # The last lines say what went wrong, the rest is the file's details
+        error = exc.stderr.decode(errors="replace").strip().splitlines()[-3:]
+        raise RuntimeError("ffmpeg failed: " + " / ".join(error)) from exc
+
+    # The summary comes last, after the per-frame log lines
+    summary = result.stderr.decode().rpartition("Summary:")[2]
+    integrated = _INTEGRATED_RE.search(summary)
+    peak = _PEAK_RE.search(summary)
+    if integrated is None or peak is None:
+        raise RuntimeError(f"Could not parse loudness summary for {path}")
+    return float(integrated.group(1)), float(peak.group(1))
+
+
+def gain_for(
+    loudness: Optional[float],
+    true_peak: Optional[float],
+    target: float = TARGET_LOUDNESS,
+) -> float:
+    """
+    Linear gain to bring a track to the target loudness, limited so the true
+    peak stays below full scale. Unanalysed tracks are left alone.
+    """
+    if loudness is None:
+        return 1.0
+    gain_db = target - loudness
+    if true_peak is not None:
+        gain_db = min(gain_db, -true_peak)
+    return 10 ** (gain_db / 20)
+
+
+def analyse_library(
+    instance: db.F2Instance,
+    jobs: int = 2,
+    pause: float = 0.0,
+    progress: bool = True,
+    db_writer: Optional[writer.Writer] = None,
+    cancel: Optional[threading.Event] = None,
+    retry_failed: bool = False,
+) -> None:
+    """
+    Measure every track without a loudness value, `jobs` files at a time.
+    Results are committed as they come in, through `db_writer` if given, so an
+    interrupted run picks up where it left off. `pause` seconds are slept after
+    each file to throttle I/O. Setting `cancel` stops the run after the files
+    being measured, keeping their results. Files ffmpeg couldn't analyse are
+    marked as failed and skipped by later runs, unless `retry_failed`. If
+    ffmpeg can't be run, the run stops with an OSError without marking any.
+    """
+    with instance.session() as session:
+        query = session.query(db.Track).filter(db.Track.loudness.is_(None))
+        if not retry_failed:
+            query = query.filter(db.Track.loudness_failed_at.is_(None))
+        todo = {track.id: track.path for track in query.all()}
+    if not todo:
+        return
+
+    def cancelled() -> bool:
+        return cancel is not None and cancel.is_set()
+
+    def measure(track_id):
+        if cancelled():
+            return track_id, _CANCELLED
+        try:
+            return track_id, measure_loudness(todo[track_id])
+        except RuntimeError as exc:
+            logger.warning("Could not analyse %s: %s", todo[track_id], exc)
+            return track_id, None
+        finally:
+            if pause:
+                time.sleep(pause)
+
+    stmt = (
+        sqlalchemy.update(db.Track)
+        .where(db.Track.id == sqlalchemy.bindparam("track_id"))
+        .values(
+            loudness=sqlalchemy.bindparam("loudness"),
+            true_peak=sqlalchemy.bindparam("true_peak"),
+            loudness_failed_at=sqlalchemy.bindparam("failed_at"),
+        )
+    )
+    results = []
+
+    def write(session):
+        session.connection().execute(stmt, results)
+
+    def commit():
+        if results:
+            if db_writer is not None:
+                db_writer.call(write)
+            else:
+                with instance.session() as session:
+                    write(session)
+            results.clear()
+
+    pool = concurrent.futures.ThreadPoolExecutor(max_workers=jobs)
+    try:
+        for track_id, measured in tqdm.tqdm(
+            pool.map(measure, todo),
+            total=len(todo),
+            unit="track",
+            disable=not progress,
+        ):
+            if measured is _CANCELLED:
+                break
+            loudness, true_peak = measured or (None, None)
+            results.append(
+                {
+                    "track_id": track_id,
+                    "loudness": loudness,
+                    "true_peak": true_peak,
+                    "failed_at": None if measured else datetime.datetime.now(),
+                }
+            )
+            if len(results) >= COMMIT_EVERY:
+                commit()
+            if cancelled():
+                break
+    finally:
+        # Don't wait for the files not started yet
+        pool.shutdown(cancel_futures=True)
+    commit()
@@ -1,20 +1,197 @@
+import dataclasses
+import hashlib
 import os
+import pathlib
+import threading
 from typing import Any, Optional
 
-from PySide6 import QtCore, QtDBus, QtMultimedia, QtQml
+from PySide6 import QtCore, QtDBus, QtGui, QtMultimedia, QtQml
+from sqlalchemy.orm import object_session
 
+from . import db
 from . import player as player_mod
+from . import query_model, utils
 
 SERVICE_NAME = "org.mpris.MediaPlayer2.Fantasia2"
 MEDIAPLAYER2_PATH = "/org/mpris/MediaPlayer2"
 MP2_IFACE = "org.mpris.MediaPlayer2"
 MP2_PLAYER_IFACE = "org.mpris.MediaPlayer2.Player"
+MP2_TRACKLIST_IFACE = "org.mpris.MediaPlayer2.TrackList"
 PROPERTIES_IFACE = "org.freedesktop.DBus.Properties"
+TRACK_PATH_PREFIX = "/org/fantasia2/Track/"
+NO_TRACK_PATH = "/org/mpris/MediaPlayer2/TrackList/NoTrack"
+
+ART_SIZE = 512
 
 QML_IMPORT_NAME = __name__
 QML_IMPORT_MAJOR_VERSION = 1
 
 
+# Track ids are playlist entry ids rather than database ids, as the same track
+# can be queued more than once and MPRIS needs each entry to have its own
+def track_object_path(entry_id: int) -> QtDBus.QDBusObjectPath:
+    return QtDBus.QDBusObjectPath(f"{TRACK_PATH_PREFIX}{entry_id}")
+
+
+def entry_id_from_path(path: QtDBus.QDBusObjectPath) -> Optional[int]:
+    try:
+        return int(path.path().removeprefix(TRACK_PATH_PREFIX))
+    except ValueError:
+        return None
+
+
+def track_metadata(
+    track: db.Track,
+    entry_id: int,
+    duration: Optional[float] = None,
+    art_url: str = "",
+) -> dict[str, Any]:
+    """
+    Plain MPRIS metadata for the playlist entry `entry_id` holding a track,
+    with the track id left as a string so the result can be compared.
+    `dbus_metadata` converts it for sending.
+    """
+    # https://www.freedesktop.org/wiki/Specifications/mpris-spec/metadata/
+    metadata = {
+        "mpris:trackid": f"{TRACK_PATH_PREFIX}{entry_id}",
+        "mpris:length": round((duration or track.duration) * 1000000),
+        "xesam:title": track.name,
+        "xesam:album": track.album.name if track.album else "",
+        "xesam:url": QtCore.QUrl.fromLocalFile(track.path.as_posix()).toString(),
+        "xesam:useCount": track.listenings,
+    }
+    if track.rating is not None:
+        metadata["xesam:userRating"] = track.rating / 5
+    if art_url:
+        metadata["mpris:artUrl"] = art_url
+    return metadata
+
+
+def dbus_metadata(metadata: dict[str, Any]) -> dict[str, Any]:
+    metadata = dict(metadata)
+    if "mpris:trackid" in metadata:
+        metadata["mpris:trackid"] = QtDBus.QDBusObjectPath(metadata["mpris:trackid"])
+    return metadata
+
+
+def album_cover(track: db.Track) -> Optional[pathlib.Path]:
+    """
+    The cover of the track's album, or of the nearest parent album with one.
+    """
+    session = object_session(track)
+    album = track.album
+    while album is not None:
+        cover = (
+            session.query(db.Cover)
+            .filter_by(album_id=album.id)
+            .order_by(db.Cover.name)
+            .first()
+        )
+        if cover is not None:
+            return cover.path
+        album = album.parent
+    return None
+
+
+def thumbnail_path(cover: pathlib.Path, mtime: int) -> pathlib.Path:
+    key = hashlib.sha1(f"{cover}\0{mtime}".encode()).hexdigest()
+    return utils.xdg_cache_dir() / "art" / f"{key}.png"
+
+
+def render_album_art(cover: pathlib.Path, mtime: int) -> Optional[pathlib.Path]:
+    """
+    A thumbnail of a cover as of its modification time `mtime`, rendered once
+    into the cache directory. Decoding a large cover takes a while, so this is
+    meant for a background thread.
+    """
+    thumbnail = thumbnail_path(cover, mtime)
+    if not thumbnail.exists():
+        image = QtGui.QImage(str(cover))
+        if image.isNull():
+            return None
+        thumbnail.parent.mkdir(parents=True, exist_ok=True)
+        image.scaled(
+            ART_SIZE,
+            ART_SIZE,
+            QtCore.Qt.AspectRatioMode.KeepAspectRatio,
+            QtCore.Qt.TransformationMode.SmoothTransformation,
+        ).save(str(thumbnail))
+    return thumbnail
+
+
+class PropertiesAdaptor(QtDBus.QDBusAbstractAdaptor):
+    """
+    Collects property changes and sends them as one PropertiesChanged signal,
+    leaving out values that are the same as those last sent.
+    """
+
+    INTERFACE = ""
+    # How long changes are collected for before being sent, in ms
+    COALESCE_INTERVAL = 0
+
+    def __init__(
+        self, bus: QtDBus.QDBusConnection, parent: QtCore.QObject | None = None
+    ) -> None:
+        super().__init__(parent)
+        self._bus = bus
+
+        # Values last sent in PropertiesChanged, so unchanged ones are left out
+        self._sent_values: dict[str, Any] = {}
+        self._changed_properties = set()
+        self._invalidated_properties = set()
+        self._send_prop_changed_timer = QtCore.QTimer()
+        self._send_prop_changed_timer.setSingleShot(True)
+        self._send_prop_changed_timer.timeout.connect(self._sendPropChanged)
+
+    def _schedulePropChanged(self) -> None:
+        if not self._send_prop_changed_timer.isActive():
+            self._send_prop_changed_timer.start(self.COALESCE_INTERVAL)
+
+    @QtCore.Slot()
+    def _propChanged(self) -> None:
+        signal_idx = self.senderSignalIndex()
+        signal_name = bytes(self.metaObject().method(signal_idx).name()).decode()
+        self._changed_properties.add(signal_name.removesuffix("Changed"))
+        self._schedulePropChanged()
+
+    def _invalidate(self, name: str) -> None:
+        # For properties too large to send with every change
+        self._invalidated_properties.add(name)
+        self._schedulePropChanged()
+
+    def _comparison_key(self, name: str, value: Any) -> Any:
+        return value
+
+    def _flushChanges(self) -> None:
+        """
+        Called before PropertiesChanged is sent, for subclasses with their own
+        signals to send from the same batch.
+        """
+
+    @QtCore.Slot()
+    def _sendPropChanged(self) -> None:
+        self._flushChanges()
+        changed_props = {}
+        for name in self._changed_properties:
+            value = getattr(self, name)
+            key = self._comparison_key(name, value)
+            if name in self._sent_values and self._sent_values[name] == key:
+                continue
+            self._sent_values[name] = key
+            changed_props[name] = value
+        invalidated_props = sorted(self._invalidated_properties)
+        self._changed_properties = set()
+        self._invalidated_properties = set()
+        if not changed_props and not invalidated_props:
+            return
+
+        msg = QtDBus.QDBusMessage.createSignal(
+            MEDIAPLAYER2_PATH, PROPERTIES_IFACE, "PropertiesChanged"
+        )
+        msg.setArguments([self.INTERFACE, changed_props, invalidated_props])
+        self._bus.send(msg)
+
+
 @QtCore.ClassInfo({"D-Bus Interface": MP2_IFACE})
 class MediaPlayer2Interface(QtDBus.QDBusAbstractAdaptor):
     # https://specifications.freedesktop.org/mpris-spec/2.2/Media_Player.html
@@ -55,7 +232,7 @@ class MediaPlayer2Interface(QtDBus.QDBusAbstractAdaptor):
 
     @QtCore.Property(bool)
     def HasTrackList(self) -> bool:
-        return False
+        return True
 
     @QtCore.Property(str)
     def Identity(self) -> str:
@@ -75,41 +252,91 @@ class MediaPlayer2Interface(QtDBus.QDBusAbstractAdaptor):
 
 
 @QtCore.ClassInfo({"D-Bus Interface": MP2_PLAYER_IFACE})
-class MediaPlayer2PlayerInterface(QtDBus.QDBusAbstractAdaptor):
+class MediaPlayer2PlayerInterface(PropertiesAdaptor):
     # https://specifications.freedesktop.org/mpris-spec/2.2/Player_Interface.html
 
+    INTERFACE = MP2_PLAYER_IFACE
+
     def __init__(
         self, bus: QtDBus.QDBusConnection, parent: QtCore.QObject | None = None
     ) -> None:
-        super().__init__(parent)
+        super().__init__(bus, parent)
 
         self._player: Optional[player_mod.Player] = None
-        self._bus = bus
-
-        self._changed_properties = set()
-        self._send_prop_changed_timer = QtCore.QTimer()
-        self._send_prop_changed_timer.setSingleShot(True)
-        self._send_prop_changed_timer.timeout.connect(self._sendPropChanged)
+        self._model: Optional[query_model.PlaylistModel] = None
+
+        # Metadata is rebuilt when the track or its row changes rather than on
+        # every read, with a plain copy to tell whether anything actually
+        # changed
+        self._metadata: dict[str, Any] = {}
+        self._metadata_key: dict[str, Any] = {}
+        # Thumbnail URLs by cover path and modification time, so a changed
+        # cover is rendered again. Empty while rendering or if it failed.
+        self._art_urls: dict[tuple[pathlib.Path, int], str] = {}
+        self._artRendered.connect(self._storeArt)
 
         self.PlaybackStatusChanged.connect(self._propChanged)
         self.MetadataChanged.connect(self._propChanged)
+        self.ShuffleChanged.connect(self._propChanged)
+        self.LoopStatusChanged.connect(self._propChanged)
+        self.VolumeChanged.connect(self._propChanged)
+
+    def _comparison_key(self, name: str, value: Any) -> Any:
+        return self._metadata_key if name == "Metadata" else value
+
+    def _art_url(self, track: db.Track) -> str:
+        cover = album_cover(track)
+        if cover is None:
+            return ""
+        try:
+            key = cover, cover.stat().st_mtime_ns
+        except OSError:
+            return ""
+        if key not in self._art_urls:
+            thumbnail = thumbnail_path(*key)
+            if thumbnail.exists():
+                self._art_urls[key] = QtCore.QUrl.fromLocalFile(
+                    thumbnail.as_posix()
+                ).toString()
+            else:
+                # Sent without art until the thumbnail is ready
+                self._art_urls[key] = ""
+                threading.Thread(
+                    target=lambda: self._artRendered.emit(key, render_album_art(*key)),
+                    name="album-art",
+                    daemon=True,
+                ).start()
+        return self._art_urls[key]
+
+    _artRendered = QtCore.Signal(object, object)
+
+    @QtCore.Slot(object, object)
+    def _storeArt(self, key, thumbnail: Optional[pathlib.Path]) -> None:
+        self._art_urls[key] = (
+            QtCore.QUrl.fromLocalFile(thumbnail.as_posix()).toString()
+            if thumbnail
+            else ""
+        )
+        self._refreshMetadata()
 
     @QtCore.Slot()
-    def _propChanged(self) -> None:
-        signal_idx = self.senderSignalIndex()
-        signal_name = bytes(self.metaObject().method(signal_idx).name()).decode()
-        self._changed_properties.add(signal_name.removesuffix("Changed"))
-        self._send_prop_changed_timer.start(0)
-
-    @QtCore.Slot()
-    def _sendPropChanged(self) -> None:
-        changed_props = {n: getattr(self, n) for n in self._changed_properties}
-        msg = QtDBus.QDBusMessage.createSignal(
-            MEDIAPLAYER2_PATH, PROPERTIES_IFACE, "PropertiesChanged"
-        )
-        msg.setArguments([MP2_PLAYER_IFACE, changed_props, []])
-        self._bus.send(msg)
-        self._changed_properties = set()
+    def _refreshMetadata(self) -> None:
+        track = self._player.current_track if self._player is not None else None
+        if track is None:
+            key = {}
+        else:
+            key = track_metadata(
+                track,
+                self._player.current_entry,
+                self._player.duration,
+                self._art_url(track),
+            )
+
+        if key == self._metadata_key:
+            return
+        self._metadata_key = key
+        self._metadata = dbus_metadata(key)
+        self.MetadataChanged.emit()
 
     playerChanged = QtCore.Signal(name="playerChanged")
 
@@ -121,15 +348,39 @@ class MediaPlayer2PlayerInterface(QtDBus.QDBusAbstractAdaptor):
     def player(self, player: Optional[player_mod.Player]) -> None:
         if self._player:
             self._player.stateChanged.disconnect(self.PlaybackStatusChanged)
-            self._player.durationChanged.disconnect(self.MetadataChanged)
-            self._player.currentTrackChanged.disconnect(self.MetadataChanged)
+            self._player.durationChanged.disconnect(self._refreshMetadata)
+            self._player.currentTrackChanged.disconnect(self._refreshMetadata)
+            self._player.shuffleChanged.disconnect(self.ShuffleChanged)
+            self._player.loopStatusChanged.disconnect(self.LoopStatusChanged)
+            self._player.volumeChanged.disconnect(self.VolumeChanged)
+            self._player.playlistModelChanged.disconnect(self._playlistModelChanged)
         self._player = player
         if self._player:
             self._player.stateChanged.connect(self.PlaybackStatusChanged)
-            self._player.durationChanged.connect(self.MetadataChanged)
-            self._player.currentTrackChanged.connect(self.MetadataChanged)
+            self._player.durationChanged.connect(self._refreshMetadata)
+            self._player.currentTrackChanged.connect(self._refreshMetadata)
+            self._player.shuffleChanged.connect(self.ShuffleChanged)
+            self._player.loopStatusChanged.connect(self.LoopStatusChanged)
+            self._player.volumeChanged.connect(self.VolumeChanged)
+            self._player.playlistModelChanged.connect(self._playlistModelChanged)
+        self._playlistModelChanged()
+        self._refreshMetadata()
         self.playerChanged.emit()
 
+    @QtCore.Slot()
+    def _playlistModelChanged(self) -> None:
+        # Ratings and listen counts change through the playlist's rows
+        if self._model is not None:
+            self._model.dataChanged.disconnect(self._rowsChanged)
+        self._model = self._player.playlistModel if self._player is not None else None
+        if self._model is not None:
+            self._model.dataChanged.connect(self._rowsChanged)
+
+    @QtCore.Slot(QtCore.QModelIndex, QtCore.QModelIndex, list)
+    def _rowsChanged(self, top_left, bottom_right, roles) -> None:
+        if top_left.row() <= self._player.currentTrackIndex <= bottom_right.row():
+            self._refreshMetadata()
+
     @QtCore.Slot()
     def Next(self) -> None:
         if self._player is not None:
@@ -167,7 +418,12 @@ class MediaPlayer2PlayerInterface(QtDBus.QDBusAbstractAdaptor):
 
     @QtCore.Slot(QtDBus.QDBusObjectPath, "qint64")
     def SetPosition(self, TrackID: QtDBus.QDBusObjectPath, Position: int) -> None:
-        if self._player is not None:
+        # Ignored if the track has changed since the client looked, as the
+        # spec asks
+        if (
+            self._player is not None
+            and entry_id_from_path(TrackID) == self._player.current_entry
+        ):
             self._player.position = Position / 1000000
 
     @QtCore.Slot(str)
@@ -188,13 +444,18 @@ class MediaPlayer2PlayerInterface(QtDBus.QDBusAbstractAdaptor):
             case QtMultimedia.QMediaPlayer.PlaybackState.StoppedState:
                 return "Stopped"
 
-    @QtCore.Property(str)
+    LoopStatusChanged = QtCore.Signal(name="LoopStatusChanged")
+
+    @QtCore.Property(str, notify=LoopStatusChanged)
     def LoopStatus(self) -> str:
-        return "None"
+        if self._player is None:
+            return "None"
+        return self._player.loopStatus
 
     @LoopStatus.setter
     def LoopStatus(self, value: str) -> None:
-        ...
+        if self._player is not None:
+            self._player.loopStatus = value
 
     @QtCore.Property(float)
     def Rate(self) -> float:
@@ -204,36 +465,37 @@ class MediaPlayer2PlayerInterface(QtDBus.QDBusAbstractAdaptor):
     def Rate(self, value: float) -> None:
         ...
 
-    @QtCore.Property(bool)
-    def Shuffle(self) -> str:
-        return False
+    ShuffleChanged = QtCore.Signal(name="ShuffleChanged")
+
+    @QtCore.Property(bool, notify=ShuffleChanged)
+    def Shuffle(self) -> bool:
+        if self._player is None:
+            return False
+        return self._player.shuffle
 
     @Shuffle.setter
     def Shuffle(self, value: bool) -> None:
-        ...
+        if self._player is not None:
+            self._player.shuffle = value
 
     MetadataChanged = QtCore.Signal(name="MetadataChanged")
 
-    @QtCore.Property(dict)
+    @QtCore.Property(dict, notify=MetadataChanged)
     def Metadata(self) -> dict[str, Any]:
-        # https://www.freedesktop.org/wiki/Specifications/mpris-spec/metadata/
-        if self._player is None or self._player.currentTrackIndex == -1:
-            return {}
-        return {
-            "mpris:trackid": QtDBus.QDBusObjectPath("/Tracks/0"),
-            "mpris:length": round(self._player.duration * 1000000),
-            # "xesam:album": "Batman",
-            "xesam:title": self._player.currentTrackName,
-            # "xesam:url": "file://home/matthew/thing.mp3"
-        }
+        return self._metadata
 
-    @QtCore.Property(float)
+    VolumeChanged = QtCore.Signal(name="VolumeChanged")
+
+    @QtCore.Property(float, notify=VolumeChanged)
     def Volume(self) -> float:
-        return 1.0
+        if self._player is None:
+            return 1.0
+        return self._player.volume
 
     @Volume.setter
     def Volume(self, value: float) -> None:
-        ...
+        if self._player is not None:
+            self._player.volume = value
 
     @QtCore.Property("qint64")
     def Position(self) -> int:
@@ -274,6 +536,216 @@ class MediaPlayer2PlayerInterface(QtDBus.QDBusAbstractAdaptor):
         return True
 
 
+@dataclasses.dataclass
+class TrackListBatch:
+    """
+    Track list changes since the last batch was sent: (after entry id, added
+    entry ids), the removed entry ids and those whose track changed, or a flag
+    when the whole list is to be replaced.
+    """
+
+    added: list[tuple[Optional[int], list[int]]] = dataclasses.field(
+        default_factory=list
+    )
+    removed: list[int] = dataclasses.field(default_factory=list)
+    changed: set[int] = dataclasses.field(default_factory=set)
+    replaced: bool = False
+
+    def __len__(self) -> int:
+        return (
+            len(self.removed)
+            + sum(len(ids) for _, ids in self.added)
+            + len(self.changed)
+        )
+
+
+@QtCore.ClassInfo({"D-Bus Interface": MP2_TRACKLIST_IFACE})
+class MediaPlayer2TrackListInterface(PropertiesAdaptor):
+    # https://specifications.freedesktop.org/mpris-spec/2.2/Track_List_Interface.html
+
+    INTERFACE = MP2_TRACKLIST_IFACE
+    # Appends arrive in batches, so collect for a little while before sending
+    COALESCE_INTERVAL = 100
+    # Past this many changed rows per batch, send TrackListReplaced instead of
+    # a TrackAdded or TrackRemoved for each one
+    MAX_TRACK_SIGNALS = 32
+
+    def __init__(
+        self, bus: QtDBus.QDBusConnection, parent: QtCore.QObject | None = None
+    ) -> None:
+        super().__init__(bus, parent)
+
+        self._player: Optional[player_mod.Player] = None
+        self._model: Optional[query_model.PlaylistModel] = None
+
+        # Object paths for the whole playlist, built on the first read after a change
+        self._tracks: Optional[list[QtDBus.QDBusObjectPath]] = None
+        # Changes to send with the next batch
+        self._batch = TrackListBatch()
+
+    @property
+    def player(self) -> Optional[player_mod.Player]:
+        return self._player
+
+    @player.setter
+    def player(self, player: Optional[player_mod.Player]) -> None:
+        if self._player:
+            self._player.playlistModelChanged.disconnect(self._playlistModelChanged)
+        self._player = player
+        if self._player:
+            self._player.playlistModelChanged.connect(self._playlistModelChanged)
+        self._playlistModelChanged()
+
+    @QtCore.Slot()
+    def _playlistModelChanged(self) -> None:
+        model = self._player.playlistModel if self._player is not None else None
+        if model is self._model:
+            return
+        if self._model is not None:
+            self._model.rowsInserted.disconnect(self._rowsInserted)
+            self._model.rowsAboutToBeRemoved.disconnect(self._rowsAboutToBeRemoved)
+            self._model.rowsMoved.disconnect(self._listReplaced)
+            self._model.modelReset.disconnect(self._listReplaced)
+            self._model.dataChanged.disconnect(self._rowsChanged)
+        self._model = model
+        if self._model is not None:
+            self._model.rowsInserted.connect(self._rowsInserted)
+            self._model.rowsAboutToBeRemoved.connect(self._rowsAboutToBeRemoved)
+            self._model.rowsMoved.connect(self._listReplaced)
+            self._model.modelReset.connect(self._listReplaced)
+            self._model.dataChanged.connect(self._rowsChanged)
+        self._listReplaced()
+
+    def _listChanged(self) -> None:
+        self._tracks = None
+        if not self._batch.replaced and len(self._batch) > self.MAX_TRACK_SIGNALS:
+            self._listReplaced()
+        self._invalidate("Tracks")
+
+    @QtCore.Slot(QtCore.QModelIndex, int, int)
+    def _rowsInserted(self, parent, first, last) -> None:
+        if not self._batch.replaced:
+            after = self._model.entryId(first - 1) if first else None
+            self._batch.added.append((after, self._model.entryIds(first, last)))
+        self._listChanged()
+
+    @QtCore.Slot(QtCore.QModelIndex, int, int)
+    def _rowsAboutToBeRemoved(self, parent, first, last) -> None:
+        if not self._batch.replaced:
+            self._batch.removed.extend(self._model.entryIds(first, last))
+        self._listChanged()
+
+    @QtCore.Slot(QtCore.QModelIndex, QtCore.QModelIndex, list)
+    def _rowsChanged(self, top_left, bottom_right, roles) -> None:
+        if self._batch.replaced:
+            return
+        self._batch.changed.update(
+            self._model.entryIds(top_left.row(), bottom_right.row())
+        )
+        if len(self._batch) > self.MAX_TRACK_SIGNALS:
+            self._listReplaced()
+        else:
+            self._schedulePropChanged()
+
+    @QtCore.Slot()
+    def _listReplaced(self) -> None:
+        self._batch = TrackListBatch(replaced=True)
+        self._tracks = None
+        self._invalidate("Tracks")
+
+    def _current_track_path(self) -> QtDBus.QDBusObjectPath:
+        entry_id = self._player.current_entry if self._player is not None else None
+        if entry_id is None:
+            return QtDBus.QDBusObjectPath(NO_TRACK_PATH)
+        return track_object_path(entry_id)
+
+    def _flushChanges(self) -> None:
+        batch, self._batch = self._batch, TrackListBatch()
+        if batch.replaced:
+            self.TrackListReplaced.emit(self.Tracks, self._current_track_path())
+            return
+        for entry_id in batch.removed:
+            self.TrackRemoved.emit(track_object_path(entry_id))
+        added = [entry_id for _, ids in batch.added for entry_id in ids]
+        if added:
+            tracks = self._model.tracksByEntry(added)
+            for after, ids in batch.added:
+                for entry_id in ids:
+                    if entry_id in tracks:
+                        self.TrackAdded.emit(
+                            dbus_metadata(track_metadata(tracks[entry_id], entry_id)),
+                            track_object_path(after)
+                            if after is not None
+                            else QtDBus.QDBusObjectPath(NO_TRACK_PATH),
+                        )
+                        after = entry_id
+        # Added entries were just sent with their current metadata
+        changed = batch.changed.difference(added)
+        if changed:
+            for entry_id, track in self._model.tracksByEntry(changed).items():
+                self.TrackMetadataChanged.emit(
+                    track_object_path(entry_id),
+                    dbus_metadata(track_metadata(track, entry_id)),
+                )
+
+    @QtCore.Slot(list, result=list)
+    def GetTracksMetadata(self, TrackIds: list[QtDBus.QDBusObjectPath]) -> list:
+        if self._model is None:
+            return []
+        entry_ids = [entry_id_from_path(path) for path in TrackIds]
+        tracks = self._model.tracksByEntry(
+            entry_id for entry_id in entry_ids if entry_id is not None
+        )
+        return [
+            dbus_metadata(track_metadata(tracks[entry_id], entry_id))
+            for entry_id in entry_ids
+            if entry_id in tracks
+        ]
+
+    @QtCore.Slot(str, QtDBus.QDBusObjectPath, bool)
+    def AddTrack(
+        self, Uri: str, AfterTrack: QtDBus.QDBusObjectPath, SetAsCurrent: bool
+    ) -> None:
+        ...
+
+    @QtCore.Slot(QtDBus.QDBusObjectPath)
+    def RemoveTrack(self, TrackId: QtDBus.QDBusObjectPath) -> None:
+        ...
+
+    @QtCore.Slot(QtDBus.QDBusObjectPath)
+    def GoTo(self, TrackId: QtDBus.QDBusObjectPath) -> None:
+        entry_id = entry_id_from_path(TrackId)
+        if self._model is None or entry_id is None:
+            return
+        row = self._model.rowOfEntry(entry_id)
+        if row >= 0:
+            self._player.playRow(row)
+
+    TrackListReplaced = QtCore.Signal(
+        list, QtDBus.QDBusObjectPath, name="TrackListReplaced"
+    )
+    TrackAdded = QtCore.Signal(dict, QtDBus.QDBusObjectPath, name="TrackAdded")
+    TrackRemoved = QtCore.Signal(QtDBus.QDBusObjectPath, name="TrackRemoved")
+    TrackMetadataChanged = QtCore.Signal(
+        QtDBus.QDBusObjectPath, dict, name="TrackMetadataChanged"
+    )
+
+    @QtCore.Property(list)
+    def Tracks(self) -> list[QtDBus.QDBusObjectPath]:
+        if self._model is None:
+            return []
+        if self._tracks is None:
+            self._tracks = [
+                track_object_path(entry_id)
+                for entry_id in self._model.entryIds(0, self._model.count - 1)
+            ]
+        return self._tracks
+
+    @QtCore.Property(bool)
+    def CanEditTracks(self) -> bool:
+        return False
+
+
 @QtQml.QmlElement
 class MPRIS(QtCore.QObject, QtDBus.QDBusContext):
     raiseRequested = QtCore.Signal(name="raiseRequested")
@@ -295,6 +767,9 @@ class MPRIS(QtCore.QObject, QtDBus.QDBusContext):
 
         self._mp2_iface = MediaPlayer2Interface(self)
         self._mp2player_iface = MediaPlayer2PlayerInterface(self._session_bus, self)
+        self._mp2tracklist_iface = MediaPlayer2TrackListInterface(
+            self._session_bus, self
+        )
 
         self._mp2player_iface.playerChanged.connect(self.playerChanged)
         self._mp2_iface.raiseRequested.connect(self.raiseRequested)
@@ -311,3 +786,4 @@ class MPRIS(QtCore.QObject, QtDBus.QDBusContext):
     @player.setter
     def player(self, player: player_mod.Player) -> None:
         self._mp2player_iface.player = player
+        self._mp2tracklist_iface.player = player
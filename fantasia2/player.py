@@ -1,9 +1,12 @@
 import sys
+import time
+from typing import Optional
 
 from PySide6 import QtCore, QtMultimedia, QtQml
-from sqlalchemy.orm import object_session
+from sqlalchemy.orm import attributes
 
-from . import query_model
+from . import listens, loudness, prefetch, profiling, query_model
+from . import shuffle as shuffle_mod
 
 QML_IMPORT_NAME = __name__
 QML_IMPORT_MAJOR_VERSION = 1
@@ -15,29 +18,85 @@ class Player(QtCore.QObject):
         super().__init__(parent)
 
         self._playlist_model = None
+        self._listen_recorder = None
         self._current_index = QtCore.QPersistentModelIndex()
-        self._player = QtMultimedia.QMediaPlayer(self)
 
-        audio_output = QtMultimedia.QAudioOutput(self._player)
-        self._player.setAudioOutput(audio_output)
-
-        print("Output device", audio_output.device().description())
-        self._player.playbackStateChanged.connect(self.stateChanged)
-        self._player.durationChanged.connect(self.durationChanged)
-        self._player.positionChanged.connect(self.positionChanged)
-        self._player.mediaStatusChanged.connect(self._logMediaStatus)
-        self._player.playbackStateChanged.connect(self._logPlaybackState)
-        self._player.errorChanged.connect(self._logError)
+        self._volume = 1.0
+        self._normalise_loudness = True
+        # Per-track normalisation gain of the active and standby players
+        self._gain = 1.0
+        self._standby_gain = 1.0
+
+        self._read_ahead = 2
+        self._prefetcher = prefetch.Prefetcher()
+
+        self._shuffle: Optional[shuffle_mod.ShuffleOrder] = None
+        self._weighted_shuffle = False
+        self._loop_status = "None"
+
+        # For gapless playback the following track is loaded into a second
+        # player ahead of time, and the two are swapped when a track ends
+        self._gapless = True
+        self._next_index = QtCore.QPersistentModelIndex()
+        self._transition_started: Optional[float] = None
+        self._transition_latency = -1.0
+
+        # The play currently being timed, reported to the listen recorder once
+        # the track changes or playback stops
+        self._play_track_id: Optional[int] = None
+        self._play_started_at = 0.0
+        self._play_seconds = 0.0
+        self._playing_since: Optional[float] = None
+
+        self._player = self._create_player()
+        self._standby_player = self._create_player()
+        self._attach_player(self._player)
+
+        print("Output device", self._player.audioOutput().device().description())
+
+        if app := QtCore.QCoreApplication.instance():
+            app.aboutToQuit.connect(self._finish_play)
+
+    def _create_player(self) -> QtMultimedia.QMediaPlayer:
+        player = QtMultimedia.QMediaPlayer(self)
+        audio_output = QtMultimedia.QAudioOutput(player)
+        player.setAudioOutput(audio_output)
+        return player
+
+    def _attach_player(self, player: QtMultimedia.QMediaPlayer) -> None:
+        player.playbackStateChanged.connect(self.stateChanged)
+        player.durationChanged.connect(self.durationChanged)
+        player.positionChanged.connect(self.positionChanged)
+        player.mediaStatusChanged.connect(self._logMediaStatus)
+        player.playbackStateChanged.connect(self._logPlaybackState)
+        player.errorChanged.connect(self._logError)
+
+    def _detach_player(self, player: QtMultimedia.QMediaPlayer) -> None:
+        player.playbackStateChanged.disconnect(self.stateChanged)
+        player.durationChanged.disconnect(self.durationChanged)
+        player.positionChanged.disconnect(self.positionChanged)
+        player.mediaStatusChanged.disconnect(self._logMediaStatus)
+        player.playbackStateChanged.disconnect(self._logPlaybackState)
+        player.errorChanged.disconnect(self._logError)
 
     @QtCore.Slot(QtMultimedia.QMediaPlayer.MediaStatus)
     def _logMediaStatus(self, status):
         print("Media status", status, file=sys.stderr)
         if status == QtMultimedia.QMediaPlayer.MediaStatus.EndOfMedia:
-            self.next_track()
+            self._transition_started = time.perf_counter()
+            self._advance()
+        elif status == QtMultimedia.QMediaPlayer.MediaStatus.BufferedMedia:
+            if self._transition_started is not None:
+                self._set_transition_latency(
+                    (time.perf_counter() - self._transition_started) * 1000
+                )
+                self._transition_started = None
+            self._arm_next_track()
 
     @QtCore.Slot(QtMultimedia.QMediaPlayer.PlaybackState)
     def _logPlaybackState(self, state):
         print("Playback state", state)
+        self._update_play_clock(state)
 
     @QtCore.Slot()
     def _logError(self):
@@ -60,6 +119,7 @@ class Player(QtCore.QObject):
             self._playlist_model.modelReset.disconnect(self._check_current_index)
             self._playlist_model.rowsRemoved.disconnect(self._rows_removed)
             self._playlist_model.rowsInserted.disconnect(self._rows_inserted)
+            self._playlist_model.rowsMoved.disconnect(self._rows_moved)
 
         self._playlist_model = value
 
@@ -67,35 +127,76 @@ class Player(QtCore.QObject):
             self._playlist_model.modelReset.connect(self._check_current_index)
             self._playlist_model.rowsRemoved.connect(self._rows_removed)
             self._playlist_model.rowsInserted.connect(self._rows_inserted)
+            self._playlist_model.rowsMoved.connect(self._rows_moved)
 
         self._current_index = QtCore.QPersistentModelIndex(
             self._playlist_model.index(0, 0)
         )
+        if self._shuffle is not None:
+            self._reshuffle()
         self.currentTrackChanged.emit()
         self.playlistModelChanged.emit()
 
     @QtCore.Slot()
     def _check_current_index(self) -> None:
+        if self._shuffle is not None:
+            self._reshuffle()
         if not self._current_index.isValid():
             self.stop()
 
     @QtCore.Slot(QtCore.QModelIndex, int, int)
     def _rows_removed(self, parent, first, last) -> None:
+        if self._shuffle is not None:
+            self._shuffle.rows_removed(first, last - first + 1)
         if not self._current_index.isValid():
             self._current_index = QtCore.QPersistentModelIndex(
                 self._playlist_model.index(first, 0)
             )
             self.currentTrackChanged.emit()
             self._play()
+        else:
+            self._arm_next_track()
+            self._read_ahead_from_current()
 
     @QtCore.Slot(QtCore.QModelIndex, int, int)
     def _rows_inserted(self, parent, first, last) -> None:
+        if self._shuffle is not None:
+            self._shuffle.rows_inserted(
+                first,
+                self._shuffle_weights(first, last),
+                self._current_index.row() if self._current_index.isValid() else None,
+            )
         if self.stopped:
+            if self._shuffle is not None:
+                self._shuffle.play_next(None, first)
             self._current_index = QtCore.QPersistentModelIndex(
                 self._playlist_model.index(first, 0)
             )
             self.currentTrackChanged.emit()
             self._play()
+        else:
+            self._arm_next_track()
+            self._read_ahead_from_current()
+
+    @QtCore.Slot(QtCore.QModelIndex, int, int, QtCore.QModelIndex, int)
+    def _rows_moved(self, parent, start, end, destination, row) -> None:
+        if self._shuffle is not None:
+            self._shuffle.rows_moved(start, end - start + 1, row)
+        self._arm_next_track()
+        self._read_ahead_from_current()
+
+    listenRecorderChanged = QtCore.Signal(name="listenRecorderChanged")
+
+    @QtCore.Property(listens.ListenRecorder, notify=listenRecorderChanged)
+    def listenRecorder(self):
+        return self._listen_recorder
+
+    @listenRecorder.setter
+    def listenRecorder(self, value) -> None:
+        if value is self._listen_recorder:
+            return
+        self._listen_recorder = value
+        self.listenRecorderChanged.emit()
 
     ### State
 
@@ -126,6 +227,47 @@ class Player(QtCore.QObject):
             == QtMultimedia.QMediaPlayer.PlaybackState.StoppedState
         )
 
+    volumeChanged = QtCore.Signal(name="volumeChanged")
+
+    @QtCore.Property(float, notify=volumeChanged)
+    def volume(self) -> float:
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float) -> None:
+        value = max(0.0, min(1.0, value))
+        if value == self._volume:
+            return
+        self._volume = value
+        self._apply_volume()
+        self.volumeChanged.emit()
+
+    normaliseLoudnessChanged = QtCore.Signal(name="normaliseLoudnessChanged")
+
+    @QtCore.Property(bool, notify=normaliseLoudnessChanged)
+    def normaliseLoudness(self) -> bool:
+        """
+        Whether to apply the analysed per-track gain. Playback can only be
+        turned down, so tracks quieter than the target are left as they are.
+        """
+        return self._normalise_loudness
+
+    @normaliseLoudness.setter
+    def normaliseLoudness(self, value: bool) -> None:
+        if value == self._normalise_loudness:
+            return
+        self._normalise_loudness = value
+        if self._current_index.isValid():
+            self._gain = self._track_gain(
+                self._current_index.data(QtCore.Qt.ItemDataRole.UserRole)
+            )
+        if self._next_index.isValid():
+            self._standby_gain = self._track_gain(
+                self._next_index.data(QtCore.Qt.ItemDataRole.UserRole)
+            )
+        self._apply_volume()
+        self.normaliseLoudnessChanged.emit()
+
     durationChanged = QtCore.Signal(name="durationChanged")
 
     @QtCore.Property(float, notify=durationChanged)
@@ -146,9 +288,23 @@ class Player(QtCore.QObject):
 
     @QtCore.Property(str, notify=currentTrackChanged)
     def currentTrackName(self):
+        track = self.current_track
+        return track.path.stem if track is not None else ""
+
+    @property
+    def current_track(self):
+        if not self._current_index.isValid():
+            return None
+        return self._current_index.data(QtCore.Qt.ItemDataRole.UserRole)
+
+    @property
+    def current_entry(self):
+        """
+        The playlist entry id of the current track, see TrackQueue.
+        """
         if not self._current_index.isValid():
-            return ""
-        return self._current_index.data(QtCore.Qt.ItemDataRole.UserRole).path.stem
+            return None
+        return self._playlist_model.entryId(self._current_index.row())
 
     @QtCore.Property(int, notify=currentTrackChanged)
     def currentTrackIndex(self):
@@ -156,27 +312,400 @@ class Player(QtCore.QObject):
             return -1
         return self._current_index.row()
 
+    ### Gapless playback
+
+    gaplessChanged = QtCore.Signal(name="gaplessChanged")
+
+    @QtCore.Property(bool, notify=gaplessChanged)
+    def gapless(self) -> bool:
+        return self._gapless
+
+    @gapless.setter
+    def gapless(self, value: bool) -> None:
+        if value == self._gapless:
+            return
+        self._gapless = value
+        if value:
+            self._arm_next_track()
+        else:
+            self._disarm_next_track()
+        self.gaplessChanged.emit()
+
+    transitionLatencyChanged = QtCore.Signal(name="transitionLatencyChanged")
+
+    @QtCore.Property(float, notify=transitionLatencyChanged)
+    def transitionLatency(self) -> float:
+        """
+        Milliseconds between the end of the last track and the following one
+        having audio buffered, or -1 if no transition has happened yet.
+        """
+        return self._transition_latency
+
+    def _set_transition_latency(self, value: float) -> None:
+        self._transition_latency = value
+        print(f"Track transition took {value:.1f} ms", file=sys.stderr)
+        self.transitionLatencyChanged.emit()
+
+    def _advance_index(self, index) -> QtCore.QModelIndex:
+        """
+        The entry to play once the one at `index` finishes by itself.
+        """
+        if self._loop_status == "Track":
+            return self._playlist_model.index(index.row(), 0)
+        return self._following_index(index)
+
+    def _upcoming_indexes(self, index, count: int) -> list[QtCore.QModelIndex]:
+        """
+        Up to `count` entries to be played after the one at `index`, as
+        _advance_index would give them but without starting a new shuffle
+        cycle, which only happens once playback gets there.
+        """
+        if self._loop_status == "Track":
+            return [self._playlist_model.index(index.row(), 0)][:count]
+        if self._shuffle is not None:
+            rows = self._shuffle.upcoming(
+                index.row(),
+                count,
+                lambda: self._shuffle_weights(0, len(self._shuffle) - 1),
+                loop=self._loop_status == "Playlist",
+            )
+            return [self._playlist_model.index(row, 0) for row in rows]
+        indexes = []
+        while len(indexes) < count:
+            index = self._following_index(index)
+            if not index.isValid():
+                break
+            indexes.append(index)
+        return indexes
+
+    def _arm_next_track(self) -> None:
+        if not self._gapless or not self._current_index.isValid():
+            return
+        upcoming = self._upcoming_indexes(self._current_index, 1)
+        if not upcoming or not upcoming[0].isValid():
+            self._disarm_next_track()
+            return
+        following = upcoming[0]
+        if self._next_index.isValid() and self._next_index.row() == following.row():
+            return
+        obj = following.data(QtCore.Qt.ItemDataRole.UserRole)
+        if obj is None:
+            # Gone from the library, the playlist drops it shortly
+            self._disarm_next_track()
+            return
+        self._next_index = QtCore.QPersistentModelIndex(following)
+        self._standby_gain = self._track_gain(obj)
+        self._apply_volume()
+        self._standby_player.setSource(self._source_for(obj))
+
+    def _disarm_next_track(self) -> None:
+        self._next_index = QtCore.QPersistentModelIndex()
+        self._standby_player.setSource(QtCore.QUrl())
+
+    def _next_track_armed(self) -> bool:
+        return (
+            self._gapless
+            and self._next_index.isValid()
+            and self._next_index.row() == self._current_index.row()
+            and self._standby_player.mediaStatus()
+            in {
+                QtMultimedia.QMediaPlayer.MediaStatus.LoadedMedia,
+                QtMultimedia.QMediaPlayer.MediaStatus.BufferedMedia,
+            }
+        )
+
+    def _track_gain(self, obj) -> float:
+        if not self._normalise_loudness or obj is None:
+            return 1.0
+        return loudness.gain_for(obj.loudness, obj.true_peak)
+
+    def _apply_volume(self) -> None:
+        for player, gain in (
+            (self._player, self._gain),
+            (self._standby_player, self._standby_gain),
+        ):
+            player.audioOutput().setVolume(min(1.0, self._volume * gain))
+
+    def _source_for(self, obj) -> QtCore.QUrl:
+        path = self._prefetcher.resolve(obj.path)
+        self.readAheadStatsChanged.emit()
+        return QtCore.QUrl.fromLocalFile(path.as_posix())
+
+    def _switch_to_standby(self) -> None:
+        # Start the new track before touching the old player, so nothing sits
+        # between the end of one track and the start of the next
+        self._standby_player.play()
+        self._detach_player(self._player)
+        self._player.stop()
+        self._player, self._standby_player = self._standby_player, self._player
+        self._gain, self._standby_gain = self._standby_gain, self._gain
+        self._attach_player(self._player)
+        self._next_index = QtCore.QPersistentModelIndex()
+        self.stateChanged.emit()
+        self.durationChanged.emit()
+        self.positionChanged.emit()
+        if (
+            self._player.mediaStatus()
+            == QtMultimedia.QMediaPlayer.MediaStatus.BufferedMedia
+        ):
+            # Already buffered before the swap, so no status change will follow
+            self._logMediaStatus(self._player.mediaStatus())
+
+    ### Shuffle and repeat
+
+    shuffleChanged = QtCore.Signal(name="shuffleChanged")
+
+    @QtCore.Property(bool, notify=shuffleChanged)
+    def shuffle(self) -> bool:
+        return self._shuffle is not None
+
+    @shuffle.setter
+    def shuffle(self, value: bool) -> None:
+        if value == self.shuffle:
+            return
+        if value:
+            self._reshuffle()
+        else:
+            self._shuffle = None
+        self._arm_next_track()
+        self.shuffleChanged.emit()
+
+    weightedShuffleChanged = QtCore.Signal(name="weightedShuffleChanged")
+
+    @QtCore.Property(bool, notify=weightedShuffleChanged)
+    def weightedShuffle(self) -> bool:
+        """
+        Whether shuffle favours highly rated and often played tracks.
+        """
+        return self._weighted_shuffle
+
+    @weightedShuffle.setter
+    def weightedShuffle(self, value: bool) -> None:
+        if value == self._weighted_shuffle:
+            return
+        self._weighted_shuffle = value
+        if self._shuffle is not None:
+            self._reshuffle()
+            self._arm_next_track()
+        self.weightedShuffleChanged.emit()
+
+    loopStatusChanged = QtCore.Signal(name="loopStatusChanged")
+
+    @QtCore.Property(str, notify=loopStatusChanged)
+    def loopStatus(self) -> str:
+        """
+        One of "None", "Track" or "Playlist", as in MPRIS.
+        """
+        return self._loop_status
+
+    @loopStatus.setter
+    def loopStatus(self, value: str) -> None:
+        if value not in {"None", "Track", "Playlist"}:
+            raise ValueError(f"Unknown loop status {value!r}")
+        if value == self._loop_status:
+            return
+        self._loop_status = value
+        self._arm_next_track()
+        self.loopStatusChanged.emit()
+
+    def _shuffle_weights(self, first: int, last: int) -> list[float]:
+        if not self._weighted_shuffle:
+            return [1.0] * (last - first + 1)
+        return self._playlist_model.shuffleWeights(first, last)
+
+    def _reshuffle(self) -> None:
+        count = self._playlist_model.count if self._playlist_model is not None else 0
+        self._shuffle = shuffle_mod.ShuffleOrder(self._shuffle_weights(0, count - 1))
+        if self._current_index.isValid():
+            self._shuffle.play_next(None, self._current_index.row())
+
+    def _following_index(self, index) -> QtCore.QModelIndex:
+        row = index.row()
+        if self._shuffle is not None:
+            following = self._shuffle.following(row)
+            if following is None and self._loop_status == "Playlist":
+                self._shuffle.restart(
+                    self._shuffle_weights(0, len(self._shuffle) - 1), row
+                )
+                following = self._shuffle.following(row)
+            if following is None:
+                return QtCore.QModelIndex()
+            return self._playlist_model.index(following, 0)
+
+        if row + 1 >= self._playlist_model.count and self._loop_status == "Playlist":
+            return self._playlist_model.index(0, 0)
+        return self._playlist_model.index(row + 1, 0)
+
+    def _preceding_index(self, index) -> QtCore.QModelIndex:
+        row = index.row()
+        if self._shuffle is not None:
+            preceding = self._shuffle.preceding(row)
+            if preceding is None:
+                return QtCore.QModelIndex()
+            return self._playlist_model.index(preceding, 0)
+
+        if row == 0 and self._loop_status == "Playlist":
+            return self._playlist_model.index(self._playlist_model.count - 1, 0)
+        return self._playlist_model.index(row - 1, 0)
+
+    ### Read-ahead
+
+    readAheadChanged = QtCore.Signal(name="readAheadChanged")
+
+    @QtCore.Property(int, notify=readAheadChanged)
+    def readAhead(self) -> int:
+        """
+        How many upcoming entries to warm before they are played.
+        """
+        return self._read_ahead
+
+    @readAhead.setter
+    def readAhead(self, value: int) -> None:
+        if value == self._read_ahead:
+            return
+        self._read_ahead = value
+        self._read_ahead_from_current()
+        self.readAheadChanged.emit()
+
+    @QtCore.Property(str, notify=readAheadChanged)
+    def readAheadMode(self) -> str:
+        """
+        "fadvise" to ask the kernel to read files into the page cache, "copy"
+        to copy them into a local cache directory, or "off".
+        """
+        return self._prefetcher.mode
+
+    @readAheadMode.setter
+    def readAheadMode(self, value: str) -> None:
+        if value == self._prefetcher.mode:
+            return
+        self._prefetcher.mode = value
+        self._read_ahead_from_current()
+        self.readAheadChanged.emit()
+
+    @QtCore.Property(int, notify=readAheadChanged)
+    def readAheadCacheSize(self) -> int:
+        """
+        Size limit of the local cache used in "copy" mode, in MiB.
+        """
+        return self._prefetcher.cache_size // 2**20
+
+    @readAheadCacheSize.setter
+    def readAheadCacheSize(self, value: int) -> None:
+        self._prefetcher.cache_size = value * 2**20
+        self.readAheadChanged.emit()
+
+    readAheadStatsChanged = QtCore.Signal(name="readAheadStatsChanged")
+
+    @QtCore.Property(int, notify=readAheadStatsChanged)
+    def readAheadHits(self) -> int:
+        return self._prefetcher.hits
+
+    @QtCore.Property(int, notify=readAheadStatsChanged)
+    def readAheadMisses(self) -> int:
+        return self._prefetcher.misses
+
+    @QtCore.Property(float, notify=readAheadStatsChanged)
+    def readAheadHitRate(self) -> float:
+        return self._prefetcher.hit_rate
+
+    def _read_ahead_from_current(self) -> None:
+        paths = []
+        seen = set()
+        upcoming = []
+        if self._current_index.isValid():
+            upcoming = self._upcoming_indexes(self._current_index, self._read_ahead)
+        for index in upcoming:
+            if not index.isValid() or index.row() in seen:
+                break
+            seen.add(index.row())
+            track = index.data(QtCore.Qt.ItemDataRole.UserRole)
+            if track is not None:
+                paths.append(track.path)
+        self._prefetcher.prefetch(paths)
+
+    ### Play history
+
+    def _begin_play(self, obj) -> None:
+        self._play_track_id = obj.id
+        self._play_started_at = time.time()
+        self._play_seconds = 0.0
+        self._playing_since = None
+        self._update_play_clock(self._player.playbackState())
+
+    def _update_play_clock(self, state) -> None:
+        if state == QtMultimedia.QMediaPlayer.PlaybackState.PlayingState:
+            if self._playing_since is None:
+                self._playing_since = time.monotonic()
+            return
+        if self._playing_since is not None:
+            self._play_seconds += time.monotonic() - self._playing_since
+            self._playing_since = None
+        if state == QtMultimedia.QMediaPlayer.PlaybackState.StoppedState:
+            self._finish_play()
+
+    @QtCore.Slot()
+    def _finish_play(self) -> None:
+        if self._play_track_id is None:
+            return
+        if self._playing_since is not None:
+            self._play_seconds += time.monotonic() - self._playing_since
+            self._playing_since = None
+        if self._listen_recorder is not None and self._play_seconds > 0:
+            self._listen_recorder.played(
+                self._play_track_id, self._play_started_at, self._play_seconds
+            )
+        self._play_track_id = None
+
     ### Control
 
+    @profiling.timed("player.play")
     def _play(self):
         if not self._current_index.isValid():
             print("Can't play, current index is not valid")
             self.stop()
             return
         obj = self._current_index.data(QtCore.Qt.ItemDataRole.UserRole)
-        url = QtCore.QUrl.fromLocalFile(obj.path.as_posix())
-        obj.listenings += 1
-        object_session(obj).commit()
-        self._player.setSource(url)
+        if obj is None:
+            print("Can't play, the track is no longer in the library")
+            self.stop()
+            return
+        if self._listen_recorder is not None:
+            self._listen_recorder.record(obj.id)
+            # The recorder writes the real increment, this just keeps the loaded
+            # row current without making the session think it has something to
+            # commit
+            attributes.set_committed_value(obj, "listenings", obj.listenings + 1)
+        self._finish_play()
+        if self._next_track_armed():
+            self._switch_to_standby()
+            self._begin_play(obj)
+            self.currentTrackChanged.emit()
+        else:
+            url = self._source_for(obj)
+            self._gain = self._track_gain(obj)
+            self._apply_volume()
+            self._player.setSource(url)
+            self._begin_play(obj)
+            self.currentTrackChanged.emit()
+            self._player.play()
+        self._read_ahead_from_current()
+
+    def _advance(self) -> None:
+        if not self._current_index.isValid():
+            return
+        self._current_index = QtCore.QPersistentModelIndex(
+            self._advance_index(self._current_index)
+        )
         self.currentTrackChanged.emit()
-        self._player.play()
+        self._play()
 
     @QtCore.Slot()
     def next_track(self):
         if not self._current_index.isValid():
             return
         self._current_index = QtCore.QPersistentModelIndex(
-            self._playlist_model.index(self._current_index.row() + 1, 0)
+            self._following_index(self._current_index)
         )
         self.currentTrackChanged.emit()
         self._play()
@@ -186,7 +715,7 @@ class Player(QtCore.QObject):
         if not self._current_index.isValid():
             return
         self._current_index = QtCore.QPersistentModelIndex(
-            self._playlist_model.index(self._current_index.row() - 1, 0)
+            self._preceding_index(self._current_index)
         )
         self.currentTrackChanged.emit()
         self._play()
@@ -208,12 +737,27 @@ class Player(QtCore.QObject):
         if self.paused:
             self._player.play()
         else:
+            first = self._shuffle.first() if self._shuffle is not None else 0
             self._current_index = QtCore.QPersistentModelIndex(
-                self._playlist_model.index(0, 0)
+                self._playlist_model.index(first if first is not None else 0, 0)
             )
             self.currentTrackChanged.emit()
             self._play()
 
+    @QtCore.Slot(int)
+    def playRow(self, row: int) -> None:
+        index = self._playlist_model.index(row, 0)
+        if not index.isValid():
+            return
+        if self._shuffle is not None:
+            self._shuffle.play_next(
+                self._current_index.row() if self._current_index.isValid() else None,
+                row,
+            )
+        self._current_index = QtCore.QPersistentModelIndex(index)
+        self.currentTrackChanged.emit()
+        self._play()
+
     @QtCore.Slot()
     def stop(self) -> None:
         self._player.stop()
@@ -0,0 +1,193 @@
+import collections
+import hashlib
+import logging
+import os
+import pathlib
+import shutil
+import threading
+from typing import Optional, Sequence
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+MODES = {"off", "fadvise", "copy"}
+
+
+def default_cache_dir() -> pathlib.Path:
+    return utils.xdg_cache_dir() / "prefetch"
+
+
+class Prefetcher:
+    """
+    Warms the files that are about to be played on a worker thread, for
+    libraries on slow or networked storage.
+
+    In "fadvise" mode the kernel is asked to read the files into the page
+    cache. In "copy" mode they are copied into a local cache directory, which
+    is kept under `cache_size` bytes by evicting the least recently used
+    files, and `resolve` hands out the local copy.
+    """
+
+    # How many warmed paths to remember for hit counting in fadvise mode
+    WARMED_HISTORY = 64
+
+    def __init__(
+        self,
+        mode: str = "fadvise",
+        cache_dir: Optional[pathlib.Path] = None,
+        cache_size: int = 2 * 2**30,
+    ) -> None:
+        self._mode = mode
+        self._cache_dir = cache_dir or default_cache_dir()
+        self._cache_size = cache_size
+        self._cache_used = 0
+        self._cache_scanned = False
+
+        self._lock = threading.Lock()
+        self._wanted: list[pathlib.Path] = []
+        self._wakeup = threading.Condition(self._lock)
+        self._warmed = collections.OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._thread = threading.Thread(
+            target=self._run, name="prefetcher", daemon=True
+        )
+        self._thread.start()
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    @mode.setter
+    def mode(self, value: str) -> None:
+        if value not in MODES:
+            raise ValueError(f"Unknown prefetch mode {value!r}")
+        with self._lock:
+            self._mode = value
+            self._warmed.clear()
+
+    @property
+    def cache_size(self) -> int:
+        return self._cache_size
+
+    @cache_size.setter
+    def cache_size(self, value: int) -> None:
+        with self._lock:
+            self._cache_size = value
+            self._wakeup.notify()
+
+    @property
+    def cache_used(self) -> int:
+        return self._cache_used
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def prefetch(self, paths: Sequence[pathlib.Path]) -> None:
+        """
+        Replace the set of files to warm, in the order they will be needed.
+        """
+        with self._lock:
+            self._wanted = list(paths)
+            self._wakeup.notify()
+
+    def resolve(self, path: pathlib.Path) -> pathlib.Path:
+        """
+        The path to play `path` from, counting whether it was warmed in time.
+        """
+        with self._lock:
+            if self._mode == "off":
+                return path
+            if self._mode == "copy":
+                cached = self._cache_path(path)
+                if cached is not None and cached.exists():
+                    os.utime(cached)
+                    self.hits += 1
+                    return cached
+            elif path in self._warmed:
+                self.hits += 1
+                return path
+            self.misses += 1
+            return path
+
+    def _cache_path(self, path: pathlib.Path) -> Optional[pathlib.Path]:
+        try:
+            stat = path.stat()
+        except OSError:
+            return None
+        key = f"{path}\0{stat.st_size}\0{stat.st_mtime_ns}".encode()
+        return self._cache_dir / (hashlib.sha1(key).hexdigest() + path.suffix)
+
+    def _run(self) -> None:
+        while True:
+            with self._lock:
+                while not self._wanted:
+                    self._wakeup.wait()
+                path = self._wanted.pop(0)
+                mode = self._mode
+            try:
+                if mode == "fadvise":
+                    self._fadvise(path)
+                elif mode == "copy":
+                    self._copy(path)
+            except OSError as e:
+                logger.warning("Could not prefetch %s: %s", path, e)
+
+    def _fadvise(self, path: pathlib.Path) -> None:
+        if path in self._warmed:
+            return
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        finally:
+            os.close(fd)
+        with self._lock:
+            self._warmed[path] = None
+            while len(self._warmed) > self.WARMED_HISTORY:
+                self._warmed.popitem(last=False)
+
+    def _copy(self, path: pathlib.Path) -> None:
+        if not self._cache_scanned:
+            self._scan_cache()
+        cached = self._cache_path(path)
+        if cached is None or cached.exists():
+            return
+        size = path.stat().st_size
+        if size > self._cache_size:
+            return
+        self._evict(self._cache_size - size)
+        partial = cached.with_name(cached.name + ".part")
+        shutil.copyfile(path, partial)
+        partial.rename(cached)
+        self._cache_used += size
+
+    def _scan_cache(self) -> None:
+        self._cache_dir.mkdir(parents=True, exist_ok=True)
+        self._cache_used = 0
+        for entry in self._cache_dir.iterdir():
+            if entry.suffix == ".part":
+                # Left over from a copy that was interrupted
+                entry.unlink()
+            else:
+                self._cache_used += entry.stat().st_size
+        self._cache_scanned = True
+
+    def _evict(self, limit: int) -> None:
+        if self._cache_used <= limit:
+            return
+        # Played files are touched in resolve, so mtime order is LRU order
+        entries = sorted(
+            (entry.stat().st_mtime_ns, entry)
+            for entry in self._cache_dir.iterdir()
+            if entry.suffix != ".part"
+        )
+        for _, entry in entries:
+            if self._cache_used <= limit:
+                break
+            self._cache_used -= entry.stat().st_size
+            entry.unlink()
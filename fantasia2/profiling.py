@@ -0,0 +1,237 @@
+"""
+Lightweight timing and counting, off unless asked for. Enable it with
+`fantasia2 --profile=<file>` or by setting FANTASIA2_PROFILE to a file name.
+When the process exits the metrics are written there, as a Prometheus
+textfile if the name ends in ".prom" and as JSON otherwise.
+
+Metrics are named with dots and can carry labels:
+
+    with profiling.span("sync.hash"):
+        ...
+    @profiling.timed("player.play")
+    def _play(self): ...
+    profiling.count("model.data_calls", model="QueryModel")
+    profiling.observe("model.reset_rows", len(items), model="QueryModel")
+
+While disabled each of these returns straight away.
+"""
+
+import atexit
+import contextlib
+import functools
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+from typing import Optional
+
+import sqlalchemy
+
+ENV_VAR = "FANTASIA2_PROFILE"
+
+logger = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_output: Optional[pathlib.Path] = None
+# (name, sorted label items) -> [count, total, max]
+_spans: dict[tuple, list] = {}
+_observations: dict[tuple, list] = {}
+# (name, sorted label items) -> count
+_counters: dict[tuple, int] = {}
+_NO_SPAN = contextlib.nullcontext()
+
+
+def enabled() -> bool:
+    return _output is not None
+
+
+def enable(output: os.PathLike) -> None:
+    """
+    Start collecting, and write the metrics to `output` at exit.
+    """
+    global _output  # pylint: disable=global-statement
+    if _output is None:
+        atexit.register(write)
+    _output = pathlib.Path(output)
+
+
+def _key(name: str, labels: dict) -> tuple:
+    return name, tuple(sorted(labels.items()))
+
+
+def _record(table: dict, key: tuple, value: float) -> None:
+    with _lock:
+        entry = table.get(key)
+        if entry is None:
+            table[key] = [1, value, value]
+        else:
+            entry[0] += 1
+            entry[1] += value
+            entry[2] = max(entry[2], value)
+
+
+@contextlib.contextmanager
+def _span(key: tuple):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(_spans, key, time.perf_counter() - started)
+
+
+def span(name: str, **labels):
+    """
+    A context manager timing its body.
+    """
+    if _output is None:
+        return _NO_SPAN
+    return _span(_key(name, labels))
+
+
+def timed(name: str, **labels):
+    """
+    A decorator timing every call of the function as a span.
+    """
+    key = _key(name, labels)
+
+    def decorate(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _output is None:
+                return func(*args, **kwargs)
+            with _span(key):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorate
+
+
+def count(name: str, n: int = 1, **labels) -> None:
+    if _output is None:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + n
+
+
+def observe(name: str, value: float, **labels) -> None:
+    """
+    Record a size or other measurement, summarised by count, sum and maximum.
+    """
+    if _output is None:
+        return
+    _record(_observations, _key(name, labels), value)
+
+
+def instrument_engine(engine: sqlalchemy.engine.Engine) -> None:
+    """
+    Count and time the statements `engine` runs, by kind.
+    """
+
+    # The start time is kept on the statement's execution context, so one
+    # that raises, and never gets to `after`, leaves nothing behind. Internal
+    # statements run without a context aren't counted.
+    def before(conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.profiling_started = time.perf_counter()
+
+    def after(conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        elapsed = time.perf_counter() - context.profiling_started
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        _record(_spans, _key("db.statement", {"kind": kind}), elapsed)
+
+    sqlalchemy.event.listen(engine, "before_cursor_execute", before)
+    sqlalchemy.event.listen(engine, "after_cursor_execute", after)
+
+
+def snapshot() -> dict:
+    """
+    Everything collected so far, as plain data.
+    """
+
+    def rows(table, fields):
+        return [
+            {"name": name, "labels": dict(labels), **dict(zip(fields, values))}
+            for (name, labels), values in sorted(table.items())
+        ]
+
+    with _lock:
+        return {
+            "spans": rows(_spans, ("count", "seconds", "max_seconds")),
+            "observations": rows(_observations, ("count", "sum", "max")),
+            "counters": [
+                {"name": name, "labels": dict(labels), "count": value}
+                for (name, labels), value in sorted(_counters.items())
+            ],
+        }
+
+
+def _prometheus_name(name: str) -> str:
+    return "fantasia2_" + name.replace(".", "_").replace("-", "_")
+
+
+def _prometheus_labels(labels: dict) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (k, str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for k, v in labels.items()
+    )
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escaped) + "}"
+
+
+def prometheus_text(data: dict) -> str:
+    """
+    `data` from snapshot() in the Prometheus text exposition format.
+    """
+    lines = []
+    groups = (
+        ("spans", (("_seconds_total", "seconds"), ("_calls_total", "count"))),
+        ("spans", (("_seconds_max", "max_seconds"),)),
+        ("observations", (("_sum", "sum"), ("_count", "count"), ("_max", "max"))),
+        ("counters", (("_total", "count"),)),
+    )
+    for section, suffixes in groups:
+        for suffix, field in suffixes:
+            typed = set()
+            for row in data[section]:
+                metric = _prometheus_name(row["name"]) + suffix
+                if metric not in typed:
+                    typed.add(metric)
+                    kind = "counter" if suffix.endswith("_total") else "gauge"
+                    lines.append(f"# TYPE {metric} {kind}")
+                lines.append(
+                    f"{metric}{_prometheus_labels(row['labels'])} {row[field]}"
+                )
+    return "\n".join(lines) + "\n"
+
+
+def write(output: Optional[os.PathLike] = None) -> None:
+    """
+    Write the metrics to `output`, or to the file given when enabling.
+    """
+    output = pathlib.Path(output) if output is not None else _output
+    if output is None:
+        return
+    data = snapshot()
+    text = (
+        prometheus_text(data)
+        if output.suffix == ".prom"
+        else json.dumps(data, indent=2) + "\n"
+    )
+    # Replaced in one step, as textfile collectors may read it at any time
+    partial = output.with_name(f".{output.name}.part")
+    try:
+        partial.write_text(text, encoding="utf-8")
+        os.replace(partial, output)
+    except OSError as e:
+        logger.error("Could not write the profile to %s: %s", output, e)
+
+
+if os.environ.get(ENV_VAR):
+    enable(os.environ[ENV_VAR])
@@ -0,0 +1,14 @@
+from PySide6 import QtCore, QtQml
+
+from . import utils
+
+QML_IMPORT_NAME = __name__
+QML_IMPORT_MAJOR_VERSION = 1
+
+
+@QtQml.QmlElement
+@QtQml.QmlSingleton
+class Utils(QtCore.QObject):
+    @QtCore.Slot(float, result=str)
+    def formatDuration(self, seconds: float) -> str:
+        return utils.format_duration(seconds)
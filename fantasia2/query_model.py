@@ -1,15 +1,31 @@
+import array
+import datetime
 import enum
-from typing import Sequence
+import logging
+import pathlib
+import threading
+from typing import Optional, Sequence
 
 import sqlalchemy.orm
 from PySide6 import QtCore, QtQml
 from sqlalchemy.sql import expression, func
 
-from . import db, utils
+from . import (
+    changes,
+    db,
+    profiling,
+    shuffle,
+    snapshot,
+    track_queue,
+    track_rows,
+    utils,
+    writer,
+)
 
 QML_IMPORT_NAME = __name__
 QML_IMPORT_MAJOR_VERSION = 1
 
+logger = logging.getLogger(__name__)
 
 @QtQml.QmlElement
 class TrackModel(QtCore.QAbstractTableModel):
@@ -18,18 +34,20 @@ class TrackModel(QtCore.QAbstractTableModel):
         len(HEADERS)
     )
 
-    def __init__(self) -> None:
+    def __init__(self, db_writer: writer.Writer) -> None:
         super().__init__()
+        self._writer = db_writer
         self._items: Sequence[db.Track] = []
         self.layoutChanged.connect(self.countChanged)
         self.rowsInserted.connect(self.countChanged)
+        self.rowsRemoved.connect(self.countChanged)
         self.modelReset.connect(self.countChanged)
 
     def columnCount(self, parent: QtCore.QModelIndex) -> int:
-        return len(self.HEADERS) if not parent.isValid() else None
+        return len(self.HEADERS) if not parent.isValid() else 0
 
     def rowCount(self, parent: QtCore.QModelIndex) -> int:
-        return len(self._items) if not parent.isValid() else None
+        return len(self._items) if not parent.isValid() else 0
 
     def headerData(self, section, orientation, role):
         if (
@@ -40,6 +58,8 @@ class TrackModel(QtCore.QAbstractTableModel):
         return None
 
     def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.ItemFlag.NoItemFlags
         return (
             QtCore.Qt.ItemIsSelectable
             | QtCore.Qt.ItemIsEnabled
@@ -47,35 +67,49 @@ class TrackModel(QtCore.QAbstractTableModel):
         )
 
     def data(self, index, role):
+        profiling.count("model.data_calls", model=type(self).__name__)
         if not self.checkIndex(index):
             return None
+        track = self._items[index.row()]
+        if track is None:
+            self._track_missing(index.row())
+            return None
 
         if role == QtCore.Qt.ItemDataRole.DisplayRole:
             match index.column():
                 case self.ALBUM_COLUMN:
-                    return self._items[index.row()].folder
+                    return track.folder
                 case self.TITLE_COLUMN:
-                    return self._items[index.row()].name
+                    return track.name
                 case self.TAGS_COLUMN:
-                    return ", ".join(t.name for t in self._items[index.row()].tags)
+                    return ", ".join(t.name for t in track.tags)
                 case self.RATING_COLUMN:
-                    if self._items[index.row()].rating is None:
+                    if track.rating is None:
                         return ""
-                    return "★" * self._items[index.row()].rating + "☆" * (
-                        5 - self._items[index.row()].rating
-                    )
+                    return "★" * track.rating + "☆" * (5 - track.rating)
                 case self.DURATION_COLUMN:
-                    return utils.format_duration(self._items[index.row()].duration)
+                    return utils.format_duration(track.duration)
                 case _:
                     return ""
 
         elif role == QtCore.Qt.ItemDataRole.UserRole:
-            return self._items[index.row()]
+            return track
 
         return None
 
+    def _track_missing(self, row: int) -> None:
+        """
+        Called when the track of `row` turns out to have left the library.
+        """
+
+    def _editable(self, index) -> bool:
+        # Rows from a snapshot can't be edited until the database has been read
+        return self.checkIndex(index) and isinstance(
+            self._items[index.row()], db.Track
+        )
+
     def setData(self, index, value, role=QtCore.Qt.ItemDataRole.EditRole):
-        if not self.checkIndex(index):
+        if not self._editable(index):
             return False
 
         if role == QtCore.Qt.ItemDataRole.EditRole:
@@ -87,10 +121,16 @@ class TrackModel(QtCore.QAbstractTableModel):
                 case self.TAGS_COLUMN:
                     return False
                 case self.RATING_COLUMN:
-                    self._items[index.row()].rating = (
-                        int(value) if value is not None else None
+                    track = self._items[index.row()]
+                    rating = int(value) if value is not None else None
+                    writer.log_failure(
+                        self._writer.submit(writer.set_rating(track.id, rating)),
+                        "save the rating",
+                    )
+                    # Show it straight away, the rows are only ever read
+                    sqlalchemy.orm.attributes.set_committed_value(
+                        track, "rating", rating
                     )
-                    sqlalchemy.orm.object_session(self._items[index.row()]).commit()
                 case self.DURATION_COLUMN:
                     return False
                 case _:
@@ -109,15 +149,52 @@ class TrackModel(QtCore.QAbstractTableModel):
     def count(self) -> int:
         return len(self._items)
 
+    @QtCore.Slot(object)
+    def applyChanges(self, changeset: changes.ChangeSet) -> None:
+        self._reload_rows(changeset.tracks_updated)
+
+    def _reload_rows(self, track_ids: set[int]) -> None:
+        """
+        Re-read the shown rows of `track_ids` and tell the views.
+        """
+        rows = track_rows.rows_of(self._items, track_ids)
+        if not rows:
+            return
+        track_rows.load_tracks(
+            sqlalchemy.orm.object_session(self._items[rows[0]]),
+            {self._items[row].id for row in rows},
+            reload=True,
+        )
+        self._emit_rows_changed(rows)
+
+    def _emit_rows_changed(self, rows: Sequence[int]) -> None:
+        for first, last in track_rows.runs(rows):
+            self.dataChanged.emit(
+                self.index(first, 0),
+                self.index(last, len(self.HEADERS) - 1),
+                [QtCore.Qt.ItemDataRole.DisplayRole, QtCore.Qt.ItemDataRole.UserRole],
+            )
+
+    # (tag_id, delta) whenever a track gains or loses a tag
+    tagUsageChanged = QtCore.Signal(int, int)
+
     @QtCore.Slot(QtCore.QModelIndex, int)
     def addTag(self, index, tag_id):
-        if not self.checkIndex(index):
+        if not self._editable(index):
             return
 
         assert index.column() == self.TAGS_COLUMN
-        sesh = sqlalchemy.orm.object_session(self._items[index.row()])
-        self._items[index.row()].tags.append(sesh.query(db.Tag).get(tag_id))
-        sesh.commit()
+        track = self._items[index.row()]
+        tag = sqlalchemy.orm.object_session(track).get(db.Tag, tag_id)
+        if tag is None or tag in track.tags:
+            return
+        writer.log_failure(
+            self._writer.submit(writer.add_tag(track.id, tag_id)), "add the tag"
+        )
+        sqlalchemy.orm.attributes.set_committed_value(
+            track, "tags", [*track.tags, tag]
+        )
+        self.tagUsageChanged.emit(tag_id, 1)
         self.dataChanged.emit(
             index,
             index,
@@ -126,13 +203,22 @@ class TrackModel(QtCore.QAbstractTableModel):
 
     @QtCore.Slot(QtCore.QModelIndex, int)
     def removeTag(self, index, tag_id):
-        if not self.checkIndex(index):
+        if not self._editable(index):
             return
 
         assert index.column() == self.TAGS_COLUMN
-        sesh = sqlalchemy.orm.object_session(self._items[index.row()])
-        self._items[index.row()].tags.remove(sesh.query(db.Tag).get(tag_id))
-        sesh.commit()
+        track = self._items[index.row()]
+        tag = sqlalchemy.orm.object_session(track).get(db.Tag, tag_id)
+        if tag is None or tag not in track.tags:
+            return
+        writer.log_failure(
+            self._writer.submit(writer.remove_tag(track.id, tag_id)),
+            "remove the tag",
+        )
+        sqlalchemy.orm.attributes.set_committed_value(
+            track, "tags", [t for t in track.tags if t is not tag]
+        )
+        self.tagUsageChanged.emit(tag_id, -1)
         self.dataChanged.emit(
             index,
             index,
@@ -149,6 +235,85 @@ class QueryModel(TrackModel):
         MOST_PLAYED = enum.auto()
         RATING = enum.auto()
         DURATION = enum.auto()
+        MOST_PLAYED_WEEK = enum.auto()
+        MOST_PLAYED_MONTH = enum.auto()
+        MOST_PLAYED_YEAR = enum.auto()
+
+        @property
+        def window(self):
+            """
+            The play rollup and number of days for orderings over recent plays.
+            """
+            match self:
+                case self.MOST_PLAYED_WEEK:
+                    return db.DailyPlays, 7
+                case self.MOST_PLAYED_MONTH:
+                    return db.DailyPlays, 30
+                case self.MOST_PLAYED_YEAR:
+                    return db.WeeklyPlays, 365
+            return None
+
+        def plays(self, track_ids=None):
+            """
+            Recent play totals by track, for orderings over a window, of every
+            track or just `track_ids`.
+            """
+            rollup, days = self.window
+            return rollup.totals_since(
+                datetime.date.today() - datetime.timedelta(days=days), track_ids
+            )
+
+        def apply(self, query):
+            if self.window is None:
+                return query.order_by(*self.sql)
+            plays = self.plays()
+            return query.outerjoin(plays, plays.c.track_id == db.Track.id).order_by(
+                -func.coalesce(plays.c.seconds_played, 0),
+                -expression.nullslast(db.Track.rating),
+                db.Track.folder,
+                db.Track.name,
+            )
+
+        @property
+        def fields(self) -> set[str]:
+            """
+            What about a track this ordering depends on, as in
+            ChangeSet.track_fields.
+            """
+            match self:
+                case self.ALPHABETICAL:
+                    return {"folder", "name"}
+                case self.MOST_PLAYED:
+                    return {"listenings", "duration", "rating", "folder", "name"}
+                case self.RATING:
+                    return {"rating", "folder", "name"}
+                case self.DURATION:
+                    return {"duration", "folder", "name"}
+            return {"plays", "rating", "folder", "name"}
+
+        def key(self, track: db.Track, seconds_played: Optional[float] = None):
+            """
+            A sort key giving the same order as the SQL, so a changed row can
+            be placed among the others without querying them again.
+            `seconds_played` is the track's total for orderings over a window.
+            """
+            # -rating NULLS LAST
+            rating = (track.rating is None, -(track.rating or 0))
+            match self:
+                case self.ALPHABETICAL:
+                    return track.folder, track.name
+                case self.MOST_PLAYED:
+                    return (
+                        -track.listenings * track.duration,
+                        rating,
+                        track.folder,
+                        track.name,
+                    )
+                case self.RATING:
+                    return rating, track.folder, track.name
+                case self.DURATION:
+                    return -track.duration, track.folder, track.name
+            return -(seconds_played or 0), rating, track.folder, track.name
 
         @property
         def sql(self):
@@ -175,13 +340,32 @@ class QueryModel(TrackModel):
                         db.Track.name,
                     )
 
-    def __init__(self, session) -> None:
-        super().__init__()
-        self._session = session
+    def __init__(
+        self,
+        instance: db.F2Instance,
+        db_writer: writer.Writer,
+        snapshot_path: Optional[pathlib.Path] = None,
+    ) -> None:
+        super().__init__(db_writer)
+        self._instance = instance
+        self._session = None
         self._query = ""
         self._ordering = QueryModel.SortOrder.ALPHABETICAL
         self._items = []
-        self.refresh()
+        self._generation = 0
+        self._pending_changes = changes.ChangeSet()
+        self._loaded.connect(self._finish_load)
+
+        # Show the last saved copy of the default view straight away, and
+        # read the database in the background
+        self._snapshot = (
+            snapshot.Snapshot.open(snapshot_path) if snapshot_path else None
+        )
+        if self._snapshot is not None:
+            self._items = self._snapshot
+            self._load_in_background()
+        else:
+            self.refresh()
 
     queryChanged = QtCore.Signal(name="queryChanged")
 
@@ -207,19 +391,203 @@ class QueryModel(TrackModel):
         self.orderingChanged.emit()
         self.refresh()
 
+    def _filter(self, query):
+        return query.filter(
+            db.Track.name.ilike("%" + self._query + "%")
+            | db.Track.folder.ilike("%" + self._query + "%")
+            | db.Track.tags.any(db.Tag.name.ilike("%" + self._query + "%"))
+        )
+
+    def _search(self, query):
+        return self._ordering.apply(self._filter(query))
+
+    @profiling.timed("model.refresh", model="QueryModel")
     def refresh(self):
-        self._set(
-            self._session.query(db.Track)
-            .filter(
-                db.Track.name.ilike("%" + self._query + "%")
-                | db.Track.folder.ilike("%" + self._query + "%")
-                | db.Track.tags.any(db.Tag.name.ilike("%" + self._query + "%"))
-            )
-            .order_by(*self._ordering.sql)
-            .all()
+        # Each refresh reads through a fresh session, so it sees everything
+        # committed since and the rows of the last one can be let go
+        session = self._instance.read_session()
+        self._generation += 1
+        self._use(session, self._search(session.query(db.Track)).all())
+
+    def _use(self, session, items) -> None:
+        self._set(items)
+        if self._session is not None:
+            self._session.close()
+        self._session = session
+        if self._snapshot is not None:
+            self._snapshot.close()
+            self._snapshot = None
+
+    # (generation, session, rows) from the background load
+    _loaded = QtCore.Signal(int, object, object)
+
+    def _load_in_background(self) -> None:
+        self._generation += 1
+        generation = self._generation
+        search = self._search
+
+        def load():
+            session = self._instance.read_session()
+            try:
+                with profiling.span("model.background_load", model="QueryModel"):
+                    items = search(session.query(db.Track)).all()
+                # Hand the rows over without a connection tied to this thread
+                session.commit()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Could not load the library")
+                session.close()
+                session = items = None
+            self._loaded.emit(generation, session, items)
+
+        threading.Thread(target=load, name="library-load", daemon=True).start()
+
+    @QtCore.Slot(int, object, object)
+    def _finish_load(self, generation: int, session, items) -> None:
+        if generation != self._generation:
+            # Superseded by a refresh in the meantime
+            if session is not None:
+                session.close()
+            return
+        if session is None:
+            self.refresh()
+            return
+        self._use(session, items)
+        pending, self._pending_changes = self._pending_changes, changes.ChangeSet()
+        # Writes committed while loading may or may not be in the rows, but
+        # applying them again is harmless
+        self.applyChanges(pending)
+
+    @QtCore.Slot(object)
+    @profiling.timed("model.apply_changes", model="QueryModel")
+    def applyChanges(self, changeset: changes.ChangeSet) -> None:
+        """
+        Bring the rows up to date with a write. Updates that can't affect the
+        search or the order only reload their rows. Otherwise just the changed
+        tracks are queried again, and each is removed, inserted or moved to
+        its place by sort key.
+        """
+        if not changeset.tracks and not (changeset.tags and self._query):
+            return
+        if self._snapshot is not None:
+            self._pending_changes = self._pending_changes | changeset
+            return
+        if not changeset.tracks or len(changeset.tracks) > self.PLACE_CHANGES_LIMIT:
+            # A renamed tag can change which tracks match without any of them
+            # changing, and past a point one query for everything is quicker
+            self._requery_ids(changeset)
+            return
+
+        fields = self._ordering.fields
+        if self._query:
+            fields = fields | {"name", "folder", "tags"}
+        if (
+            not changeset.tracks_added
+            and not changeset.tracks_removed
+            and changeset.track_fields
+            and not changeset.track_fields & fields
+        ):
+            self._reload_rows(changeset.tracks_updated)
+            return
+        self._place_tracks(changeset.tracks)
+
+    # Changed tracks placed one at a time, past which the whole search is
+    # queried again
+    PLACE_CHANGES_LIMIT = 1000
+
+    def _place_tracks(self, track_ids: set[int]) -> None:
+        # Looked up before reloading, as that may load rows not shown yet
+        shown = track_rows.rows_of(self._items, track_ids)
+        matching = track_rows.load_tracks(
+            self._session, track_ids, reload=True, search=self._filter
         )
 
+        removed = [row for row in shown if self._items[row].id not in matching]
+        for first, last in reversed(list(track_rows.runs(removed))):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self._items[first : last + 1]
+            self.endRemoveRows()
+
+        key = track_rows.sort_key(self._session, self._ordering, set(matching))
+        shown = {
+            self._items[row].id for row in track_rows.rows_of(self._items, matching)
+        }
+        # Rows changed by the same write are out of order until they're placed
+        unplaced = set(shown)
+        for track_id in sorted(matching, key=lambda i: i not in shown):
+            track = matching[track_id]
+            unplaced.discard(track_id)
+            if track_id in shown:
+                self._move_into_place(track, key, unplaced)
+            else:
+                row = track_rows.place_of(self._items, track, key, unplaced=unplaced)
+                self.beginInsertRows(QtCore.QModelIndex(), row, row)
+                self._items.insert(row, track)
+                self.endInsertRows()
+
+    def _move_into_place(self, track: db.Track, key, unplaced: set[int]) -> None:
+        row = self._items.index(track)
+        target = track_rows.place_of(self._items, track, key, row, unplaced)
+        if target not in (row, row + 1):
+            self.beginMoveRows(
+                QtCore.QModelIndex(), row, row, QtCore.QModelIndex(), target
+            )
+            del self._items[row]
+            if target > row:
+                target -= 1
+            self._items.insert(target, track)
+            self.endMoveRows()
+            row = target
+        self._emit_rows_changed([row])
+
+    def _requery_ids(self, changeset: changes.ChangeSet) -> None:
+        """
+        Query the ids of every result again, and insert, remove and reload
+        rows by difference. A change of order falls back to a layout change.
+        """
+        old_ids = [track.id for track in self._items]
+        new_ids = [
+            track_id
+            for (track_id,) in self._search(self._session.query(db.Track.id))
+        ]
+        old_set, new_set = set(old_ids), set(new_ids)
+
+        if [i for i in old_ids if i in new_set] != [
+            i for i in new_ids if i in old_set
+        ]:
+            tracks = {track.id: track for track in self._items}
+            tracks.update(track_rows.load_tracks(self._session, new_set - old_set))
+            track_rows.load_tracks(
+                self._session, changeset.tracks_updated & old_set & new_set, True
+            )
+            self._set([tracks[i] for i in new_ids if i in tracks])
+            return
+
+        removed = [row for row, i in enumerate(old_ids) if i not in new_set]
+        for first, last in reversed(list(track_rows.runs(removed))):
+            self.beginRemoveRows(QtCore.QModelIndex(), first, last)
+            del self._items[first : last + 1]
+            self.endRemoveRows()
+
+        added = [row for row, i in enumerate(new_ids) if i not in old_set]
+        if added:
+            tracks = track_rows.load_tracks(
+                self._session, (new_ids[row] for row in added)
+            )
+            if len(tracks) < len(added):
+                # Removed again since the ids were read
+                self.refresh()
+                return
+            for first, last in track_rows.runs(added):
+                self.beginInsertRows(QtCore.QModelIndex(), first, last)
+                self._items[first:first] = [
+                    tracks[i] for i in new_ids[first : last + 1]
+                ]
+                self.endInsertRows()
+
+        self._reload_rows(changeset.tracks_updated)
+
     def _set(self, items):
+        profiling.observe("model.reset_rows", len(items), model="QueryModel")
         # FIXME Maybe layoutChanged does not imply rowCount changed strongly enough?
         self.layoutAboutToBeChanged.emit()
         indexList = self.persistentIndexList()
@@ -239,78 +607,257 @@ class QueryModel(TrackModel):
 @QtQml.QmlElement
 @QtQml.QmlUncreatable()
 class PlaylistModel(TrackModel):
-    def __init__(self, session) -> None:
-        super().__init__()
-        self._session = session
+    # Large appends are inserted this many rows per event loop iteration
+    APPEND_BATCH_SIZE = 1000
+
+    def __init__(self, instance: db.F2Instance, db_writer: writer.Writer) -> None:
+        super().__init__(db_writer)
+        self._session = instance.read_session()
+        # Only the ids are read back, rows are loaded as they come into view
+        stored_ids, complete = track_queue.QueueStore.load(self._session)
+        self._items = track_queue.TrackQueue(self._session, stored_ids)
+        self._pending_ids = array.array("q")
+
+        self._store = track_queue.QueueStore(db_writer)
+        if not complete:
+            # Entries for deleted tracks were skipped, so renumber the rest
+            self._store.replace(stored_ids)
+        self.rowsInserted.connect(self._store_inserted)
+        self.rowsRemoved.connect(self._store_removed)
+        self.rowsMoved.connect(self._store_moved)
+        self.modelReset.connect(self._store_reset)
+
+        self._append_timer = QtCore.QTimer(self)
+        self._append_timer.setSingleShot(True)
+        self._append_timer.timeout.connect(self._append_pending)
+        # Rows can't be removed while a view is reading them, so entries for
+        # deleted tracks are dropped on the next event loop iteration
+        self._drop_missing_timer = QtCore.QTimer(self)
+        self._drop_missing_timer.setSingleShot(True)
+        self._drop_missing_timer.timeout.connect(self._drop_missing)
+
+    def close(self) -> None:
+        self._append_timer.stop()
+        self._drop_missing_timer.stop()
+        self._store.close()
+
+    def _track_missing(self, row: int) -> None:
+        if not self._drop_missing_timer.isActive():
+            self._drop_missing_timer.start(0)
+
+    @QtCore.Slot()
+    def _drop_missing(self) -> None:
+        missing = self._items.missing
+        rows = [
+            row for row, track_id in enumerate(self._items.ids) if track_id in missing
+        ]
+        if rows:
+            logger.info("Dropping %s playlist entries for deleted tracks", len(rows))
+        for first, last in reversed(list(track_rows.runs(rows))):
+            self.removeRows(first, last - first + 1)
+
+    @QtCore.Slot(object)
+    def applyChanges(self, changeset: changes.ChangeSet) -> None:
+        if not (changeset.tracks_removed or changeset.tracks_updated):
+            return
+        removed, updated = [], []
+        for row, track_id in enumerate(self._items.ids):
+            if track_id in changeset.tracks_removed:
+                removed.append(row)
+            elif track_id in changeset.tracks_updated:
+                updated.append(row)
+
+        self._items.reload(changeset.tracks_updated)
+        self._emit_rows_changed(updated)
+        # Tracks gone from the library can't be played any more
+        for first, last in reversed(list(track_rows.runs(removed))):
+            self.removeRows(first, last - first + 1)
+
+    @QtCore.Slot(QtCore.QModelIndex, int, int)
+    def _store_inserted(self, parent, first, last) -> None:
+        self._store.insert(first, self._items.ids[first : last + 1])
+
+    @QtCore.Slot(QtCore.QModelIndex, int, int)
+    def _store_removed(self, parent, first, last) -> None:
+        self._store.remove(first, last - first + 1)
+
+    @QtCore.Slot(QtCore.QModelIndex, int, int, QtCore.QModelIndex, int)
+    def _store_moved(self, parent, start, end, destination, row) -> None:
+        self._store.move(start, end - start + 1, row)
+
+    @QtCore.Slot()
+    def _store_reset(self) -> None:
+        self._store.replace(self._items.ids)
+
+    def _insert_ids(self, track_ids) -> None:
+        if not track_ids:
+            return
+        self.beginInsertRows(
+            QtCore.QModelIndex(),
+            len(self._items),
+            len(self._items) + len(track_ids) - 1,
+        )
+        self._items.extend_ids(track_ids)
+        self.endInsertRows()
+
+    @QtCore.Slot()
+    def _append_pending(self) -> None:
+        batch = self._pending_ids[: self.APPEND_BATCH_SIZE]
+        del self._pending_ids[: self.APPEND_BATCH_SIZE]
+        self._insert_ids(batch)
+        if self._pending_ids:
+            self._append_timer.start(0)
 
     @QtCore.Slot(list)
     def appendItems(self, indexes) -> None:
-        # Remove duplicates
-        new_items = []
+        # Remove duplicates. Only the ids are taken, as the rows belong to
+        # another model's session
+        new_ids = []
         seen_ids = set()
 
         for idx in indexes:
             item = idx.data(QtCore.Qt.ItemDataRole.UserRole)
             if item.id not in seen_ids:
                 seen_ids.add(item.id)
-                new_items.append(item)
+                new_ids.append(item.id)
 
-        self.beginInsertRows(
-            QtCore.QModelIndex(),
-            len(self._items),
-            len(self._items) + len(new_items) - 1,
-        )
-        self._items = list(self._items) + new_items
-        self.endInsertRows()
+        self._insert_ids(new_ids)
 
     @QtCore.Slot(int)
     def appendAlbum(self, album_id: int) -> None:
         album = self._session.query(db.Album).filter_by(id=album_id).one_or_none()
         if album is None:
             return
-        new_items = (
-            self._session.query(db.Track)
-            .filter_by(album_id=album.self_and_children().c.id)
-            .order_by(*QueryModel.SortOrder.ALPHABETICAL.sql)
-            .all()
-        )
-        self.beginInsertRows(
-            QtCore.QModelIndex(),
-            len(self._items),
-            len(self._items) + len(new_items) - 1,
+        # Only the ids are fetched here, rows are loaded as they are displayed
+        self._pending_ids.extend(
+            self._session.scalars(
+                sqlalchemy.select(db.Track.id)
+                .filter_by(album_id=album.self_and_children().c.id)
+                .order_by(*QueryModel.SortOrder.ALPHABETICAL.sql)
+            )
         )
-        self._items = list(self._items) + new_items
-        self.endInsertRows()
+        if not self._append_timer.isActive():
+            self._append_pending()
 
     def removeRows(self, row, count, parent=QtCore.QModelIndex()) -> bool:
         self.beginRemoveRows(parent, row, row + count - 1)
-        self._items = self._items[:row] + self._items[row + count :]
+        del self._items[row : row + count]
         self.endRemoveRows()
         return True
 
+    def moveRows(
+        self, sourceParent, sourceRow, count, destinationParent, destinationChild
+    ) -> bool:
+        if sourceParent.isValid() or destinationParent.isValid():
+            return False
+        if sourceRow <= destinationChild <= sourceRow + count:
+            return False
+        if not self.beginMoveRows(
+            sourceParent,
+            sourceRow,
+            sourceRow + count - 1,
+            destinationParent,
+            destinationChild,
+        ):
+            return False
+        self._items.move(sourceRow, count, destinationChild)
+        self.endMoveRows()
+        return True
+
+    @QtCore.Slot(int, int)
+    def moveItem(self, row: int, destination: int) -> None:
+        self.moveRows(QtCore.QModelIndex(), row, 1, QtCore.QModelIndex(), destination)
+
+    def entryIds(self, first: int, last: int) -> list[int]:
+        return self._items.entry_ids[first : last + 1].tolist()
+
+    def entryId(self, row: int) -> Optional[int]:
+        if not 0 <= row < len(self._items):
+            return None
+        return self._items.entry_ids[row]
+
+    def rowOfEntry(self, entry_id: int) -> int:
+        return self._items.row_of_entry(entry_id)
+
+    def tracksByEntry(self, entry_ids) -> dict[int, db.Track]:
+        """
+        The tracks of any number of entries, skipping entries that are gone.
+        """
+        wanted = set(entry_ids)
+        track_ids = {
+            entry_id: track_id
+            for entry_id, track_id in zip(self._items.entry_ids, self._items.ids)
+            if entry_id in wanted
+        }
+        tracks = self._items.lookup(track_ids.values())
+        return {
+            entry_id: tracks[track_id]
+            for entry_id, track_id in track_ids.items()
+            if track_id in tracks
+        }
+
+    def shuffleWeights(self, first: int, last: int) -> list[float]:
+        """
+        Weighted shuffle weights for a range of rows, from one query per
+        thousand tracks rather than loading every row.
+        """
+        track_ids = self._items.ids[first : last + 1]
+        stats = {}
+        for start in range(0, len(track_ids), 1000):
+            for track_id, rating, listenings in self._session.execute(
+                sqlalchemy.select(
+                    db.Track.id, db.Track.rating, db.Track.listenings
+                ).where(db.Track.id.in_(list(track_ids[start : start + 1000])))
+            ):
+                stats[track_id] = shuffle.track_weight(rating, listenings)
+        return [stats.get(track_id, 1.0) for track_id in track_ids]
+
     @QtCore.Slot()
     def clear(self) -> None:
+        self._append_timer.stop()
+        self._pending_ids = array.array("q")
         self.beginResetModel()
-        self._items = []
+        self._items.clear()
         self.endResetModel()
 
 
 @QtQml.QmlElement
 @QtQml.QmlUncreatable()
 class AlbumModel(QtCore.QAbstractListModel):
-    def __init__(self, session) -> None:
+    def __init__(self, instance: db.F2Instance, db_writer: writer.Writer) -> None:
         super().__init__()
-        self._session = session
+        self._instance = instance
+        self._session = None
         self._items: Sequence[db.Album] = []
         self.layoutChanged.connect(self.countChanged)
         self.rowsInserted.connect(self.countChanged)
         self.modelReset.connect(self.countChanged)
 
+        self._root_id = None
         self._root_album = None
-        self._tracks_model = TrackModel()
+        self._tracks_model = TrackModel(db_writer)
         self._refresh()
 
+    @QtCore.Slot(object)
+    def applyChanges(self, changeset: changes.ChangeSet) -> None:
+        # Only one level of the tree is shown, so just read it again if any
+        # album changed
+        if changeset.albums:
+            self._refresh()
+        else:
+            self._tracks_model.applyChanges(changeset)
+
+    @profiling.timed("model.refresh", model="AlbumModel")
     def _refresh(self) -> None:
+        old_session, self._session = self._session, self._instance.read_session()
+        self._root_album = (
+            self._session.get(db.Album, self._root_id)
+            if self._root_id is not None
+            else None
+        )
+        if self._root_album is None:
+            # The album went away in a sync
+            self._root_id = None
         self.beginResetModel()
         self._items = list(
             self._session.query(db.Album)
@@ -328,11 +875,19 @@ class AlbumModel(QtCore.QAbstractListModel):
             .all()
         )
         self._tracks_model.endResetModel()
+        profiling.observe("model.reset_rows", len(self._items), model="AlbumModel")
+        profiling.observe(
+            "model.reset_rows", len(self._tracks_model._items), model="TrackModel"
+        )
+        if old_session is not None:
+            old_session.close()
 
     def rowCount(self, parent: QtCore.QModelIndex) -> int:
-        return len(self._items) if not parent.isValid() else None
+        return len(self._items) if not parent.isValid() else 0
 
     def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.ItemFlag.NoItemFlags
         return (
             QtCore.Qt.ItemIsSelectable
             | QtCore.Qt.ItemIsEnabled
@@ -340,6 +895,7 @@ class AlbumModel(QtCore.QAbstractListModel):
         )
 
     def data(self, index, role):
+        profiling.count("model.data_calls", model="AlbumModel")
         if not self.checkIndex(index):
             return None
 
@@ -424,12 +980,12 @@ class AlbumModel(QtCore.QAbstractListModel):
 
     @QtCore.Slot(int)
     def enterAlbum(self, index: int) -> None:
-        self._root_album = self._items[index]
+        self._root_id = self._items[index].id
         self._refresh()
 
     @QtCore.Slot()
     def exitAlbum(self) -> None:
-        self._root_album = self._root_album.parent if self._root_album else None
+        self._root_id = self._root_album.parent_id if self._root_album else None
         self._refresh()
 
     @QtCore.Property(TrackModel, constant=True)
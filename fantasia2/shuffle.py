@@ -0,0 +1,176 @@
+import bisect
+import math
+import random
+from typing import Callable, Optional, Sequence
+
+
+def track_weight(rating: Optional[int], listenings: int) -> float:
+    """
+    Relative chance of a track being picked early in a weighted shuffle.
+    Unrated tracks count as middling, and play count adds a gentle bonus.
+    """
+    return (1 + (rating if rating is not None else 2.5)) * (1 + math.log1p(listenings))
+
+
+class ShuffleOrder:
+    """
+    A precomputed play order over the rows of a playlist. Looking up the track
+    before or after a row is O(1). Inserted rows are placed among the upcoming
+    tracks and removed rows are dropped, without reshuffling what is left.
+
+    Weighted shuffles use Efraimidis-Spirakis keys (u ** (1 / weight)): the
+    upcoming part of the order is kept sorted by key, so new rows can be
+    placed by bisection with the same distribution as a full reshuffle.
+
+    The order of the next cycle can be looked at before it starts. It is kept
+    until the order changes, so the next cycle starts the way it was seen.
+    """
+
+    def __init__(self, weights: Sequence[float], rng=None) -> None:
+        self._rng = rng or random.Random()
+        self._order: list[int] = []
+        self._neg_keys: list[float] = []
+        self._index_of: list[int] = []
+        # (order, keys) of the next cycle, once it has been looked at
+        self._next_cycle: Optional[tuple[list[int], list[float]]] = None
+        self._reshuffle(weights)
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def _key(self, weight: float) -> float:
+        return -(self._rng.random() ** (1 / max(weight, 1e-6)))
+
+    def _shuffled(
+        self, weights: Sequence[float], first: Optional[int] = None
+    ) -> tuple[list[int], list[float]]:
+        keyed = sorted((self._key(w), row) for row, w in enumerate(weights))
+        neg_keys = [k for k, _ in keyed]
+        order = [row for _, row in keyed]
+        if first is not None:
+            # Start the new cycle with this row, so it doesn't come up again
+            # until everything else has played
+            pos = order.index(first)
+            order.insert(0, order.pop(pos))
+            neg_keys.insert(0, neg_keys.pop(pos))
+        return order, neg_keys
+
+    def _reshuffle(self, weights: Sequence[float], first: Optional[int] = None) -> None:
+        self._order, self._neg_keys = self._shuffled(weights, first)
+        self._reindex()
+
+    def _reindex(self) -> None:
+        # Any change to this cycle's order can change how the next one starts
+        self._next_cycle = None
+        self._index_of = [0] * len(self._order)
+        for pos, row in enumerate(self._order):
+            self._index_of[row] = pos
+
+    def following(self, row: int) -> Optional[int]:
+        pos = self._index_of[row] + 1
+        return self._order[pos] if pos < len(self._order) else None
+
+    def preceding(self, row: int) -> Optional[int]:
+        pos = self._index_of[row] - 1
+        return self._order[pos] if pos >= 0 else None
+
+    def first(self) -> Optional[int]:
+        return self._order[0] if self._order else None
+
+    def last(self) -> Optional[int]:
+        return self._order[-1] if self._order else None
+
+    def upcoming(
+        self,
+        row: int,
+        count: int,
+        weights: Callable[[], Sequence[float]],
+        loop: bool = False,
+    ) -> list[int]:
+        """
+        Up to `count` rows to be played after `row`, without changing the
+        order. With `loop`, carries on into the next cycle, calling `weights`
+        if it hasn't been shuffled yet.
+        """
+        pos = self._index_of[row] + 1
+        rows = self._order[pos : pos + count]
+        if len(rows) < count and loop and self._order:
+            if self._next_cycle is None:
+                self._next_cycle = self._shuffled(weights(), self._order[-1])
+            # It starts with the last row of this cycle, which plays before it
+            rows += self._next_cycle[0][1 : 1 + count - len(rows)]
+        return rows
+
+    def restart(self, weights: Sequence[float], first: int) -> None:
+        """
+        Start a new cycle once every row has been played.
+        """
+        if (
+            self._next_cycle is not None
+            and self._next_cycle[0][0] == first
+            and len(self._next_cycle[0]) == len(weights)
+        ):
+            # As it was looked at by upcoming()
+            self._order, self._neg_keys = self._next_cycle
+            self._reindex()
+        else:
+            self._reshuffle(weights, first)
+
+    def play_next(self, current: Optional[int], row: int) -> None:
+        """
+        Make `row` the track after `current`, for when a row is picked by hand.
+        """
+        pos = self._index_of[row]
+        key = self._neg_keys[pos]
+        del self._order[pos], self._neg_keys[pos]
+        target = self._index_of[current] + 1 if current is not None else 0
+        if current is not None and pos < target:
+            target -= 1
+        self._order.insert(target, row)
+        self._neg_keys.insert(target, key)
+        self._reindex()
+
+    def rows_inserted(
+        self, first: int, weights: Sequence[float], current: Optional[int]
+    ) -> None:
+        """
+        Place rows inserted at `first` among the tracks still to come after
+        `current`, which is the current row after the insertion.
+        """
+        count = len(weights)
+        self._order = [row + count if row >= first else row for row in self._order]
+        start = self._order.index(current) + 1 if current is not None else 0
+        for offset, weight in enumerate(weights):
+            key = self._key(weight)
+            pos = bisect.bisect(self._neg_keys, key, lo=start)
+            self._order.insert(pos, first + offset)
+            self._neg_keys.insert(pos, key)
+        self._reindex()
+
+    def rows_removed(self, first: int, count: int) -> None:
+        last = first + count - 1
+        kept = [
+            (row - count if row > last else row, key)
+            for row, key in zip(self._order, self._neg_keys)
+            if not first <= row <= last
+        ]
+        self._order = [row for row, _ in kept]
+        self._neg_keys = [key for _, key in kept]
+        self._reindex()
+
+    def rows_moved(self, start: int, count: int, destination: int) -> None:
+        def moved(row: int) -> int:
+            if destination > start:
+                if start <= row < start + count:
+                    return row - start + destination - count
+                if start + count <= row < destination:
+                    return row - count
+            else:
+                if start <= row < start + count:
+                    return row - start + destination
+                if destination <= row < start:
+                    return row + count
+            return row
+
+        self._order = [moved(row) for row in self._order]
+        self._reindex()
@@ -0,0 +1,220 @@
+"""
+Opt-in log of slow SQL statements. Each statement taking longer than the
+threshold is appended to a JSON lines file with its parameters, its SQLite
+query plan and the function in fantasia2 that ran it. `fantasia2 slowqueries`
+summarises the log.
+
+Times are measured around the cursor's execute call. SQLite returns from that
+at the first row, so sorting, grouping and any other work before the first
+row is included, but not fetching the rest of a plain scan.
+"""
+
+import collections
+import datetime
+import json
+import logging
+import pathlib
+import re
+import sys
+import threading
+import time
+from typing import Iterable, Optional
+
+import sqlalchemy
+
+from . import utils
+
+logger = logging.getLogger(__name__)
+
+# Parameter lists longer than this are cut short in the log
+MAX_PARAMS = 20
+MAX_PARAM_LENGTH = 200
+
+
+def default_log_path() -> pathlib.Path:
+    return utils.xdg_cache_dir() / "slow-queries.jsonl"
+
+
+def _jsonable(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        value = "x'" + bytes(value).hex() + "'"
+    elif isinstance(value, (datetime.date, datetime.datetime)):
+        value = value.isoformat()
+    elif value is not None and not isinstance(value, (int, float, bool, str)):
+        value = repr(value)
+    if isinstance(value, str) and len(value) > MAX_PARAM_LENGTH:
+        value = value[:MAX_PARAM_LENGTH] + "..."
+    return value
+
+
+def _params(parameters) -> list:
+    if isinstance(parameters, dict):
+        parameters = list(parameters.values())
+    parameters = list(parameters or ())
+    shown = [_jsonable(p) for p in parameters[:MAX_PARAMS]]
+    if len(parameters) > MAX_PARAMS:
+        shown.append(f"... {len(parameters) - MAX_PARAMS} more")
+    return shown
+
+
+_PLUMBING = {__name__, "fantasia2.profiling"}
+
+
+def _caller() -> str:
+    """
+    The innermost fantasia2 function outside the database plumbing.
+    """
+    frame = sys._getframe(1)  # pylint: disable=protected-access
+    package = __name__.rpartition(".")[0]
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith(package + ".") and module not in _PLUMBING:
+            code = frame.f_code
+            return f"{module}:{code.co_qualname}:{frame.f_lineno}"
+        frame = frame.f_back
+    return "unknown"
+
+
+def _query_plan(dbapi_connection, statement: str, parameters) -> Optional[list]:
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+        return [row[-1] for row in cursor.fetchall()]
+    except Exception as e:  # pylint: disable=broad-exception-caught
+        return [f"Could not explain: {e}"]
+    finally:
+        cursor.close()
+
+
+class SlowQueryLog:
+    """
+    Engine hook appending statements slower than `threshold_ms` to `log_path`.
+    """
+
+    def __init__(
+        self,
+        engine: sqlalchemy.engine.Engine,
+        library: pathlib.Path,
+        threshold_ms: float,
+        log_path: Optional[pathlib.Path] = None,
+    ) -> None:
+        self._library = str(library)
+        self._threshold = threshold_ms / 1000
+        self._log_path = log_path or default_log_path()
+        self._explain = engine.dialect.name == "sqlite"
+        self._lock = threading.Lock()
+        sqlalchemy.event.listen(engine, "before_cursor_execute", self._before)
+        sqlalchemy.event.listen(engine, "after_cursor_execute", self._after)
+
+    @property
+    def log_path(self) -> pathlib.Path:
+        return self._log_path
+
+    # As in profiling.instrument_engine, the start time goes on the execution
+    # context so a statement that raises leaves nothing behind
+    def _before(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context.slow_query_started = time.perf_counter()
+
+    def _after(self, conn, cursor, statement, parameters, context, executemany):
+        if context is None:
+            return
+        elapsed = time.perf_counter() - context.slow_query_started
+        if elapsed < self._threshold:
+            return
+        entry = {
+            "at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "library": self._library,
+            "ms": round(elapsed * 1000, 3),
+            "statement": statement,
+            "executemany": executemany,
+            # Only the first set for executemany
+            "params": _params(
+                parameters[0] if executemany and parameters else parameters
+            ),
+            "caller": _caller(),
+            "plan": (
+                _query_plan(cursor.connection, statement, parameters)
+                if self._explain and not executemany
+                else None
+            ),
+        }
+        line = json.dumps(entry) + "\n"
+        try:
+            with self._lock:
+                self._log_path.parent.mkdir(parents=True, exist_ok=True)
+                with self._log_path.open("a", encoding="utf-8") as f:
+                    f.write(line)
+        except OSError as e:
+            logger.warning("Could not write the slow query log: %s", e)
+
+
+def read_log(
+    log_path: Optional[pathlib.Path] = None, library: Optional[pathlib.Path] = None
+) -> list[dict]:
+    """
+    The logged statements, only those for `library` if given.
+    """
+    entries = []
+    try:
+        with (log_path or default_log_path()).open(encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if library is None or entry["library"] == str(library):
+                    entries.append(entry)
+    except FileNotFoundError:
+        pass
+    return entries
+
+
+def _normalise(statement: str) -> str:
+    return re.sub(r"\s+", " ", statement).strip()
+
+
+def summarise(entries: Iterable[dict]) -> list[dict]:
+    """
+    Group logged statements by their text, worst total time first.
+    """
+    groups = collections.defaultdict(list)
+    for entry in entries:
+        groups[_normalise(entry["statement"])].append(entry)
+    summary = []
+    for statement, group in groups.items():
+        worst = max(group, key=lambda e: e["ms"])
+        summary.append(
+            {
+                "statement": statement,
+                "count": len(group),
+                "total_ms": sum(e["ms"] for e in group),
+                "max_ms": worst["ms"],
+                "callers": collections.Counter(e["caller"] for e in group),
+                "worst_params": worst["params"],
+                "plan": worst["plan"],
+            }
+        )
+    summary.sort(key=lambda s: s["total_ms"], reverse=True)
+    return summary
+
+
+def print_summary(
+    library: pathlib.Path, top: int = 10, log_path: Optional[pathlib.Path] = None
+) -> None:
+    summary = summarise(read_log(log_path, library))
+    if not summary:
+        print("No slow queries logged for this library")
+        return
+    for rank, group in enumerate(summary[:top], 1):
+        print(
+            f"{rank}. {group['count']} times, {group['total_ms']:.1f} ms total, "
+            f"{group['max_ms']:.1f} ms worst"
+        )
+        print(f"    {group['statement'][:500]}")
+        print(f"    Params of the worst: {group['worst_params']}")
+        for caller, count in group["callers"].most_common(3):
+            print(f"    From {caller} ({count})")
+        for detail in group["plan"] or ():
+            print(f"    Plan: {detail}")
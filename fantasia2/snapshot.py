@@ -0,0 +1,190 @@
+"""
+A compact on-disk copy of the library's default view, so the GUI can show it
+before the database has been queried. The file is memory-mapped and rows are
+decoded as they are displayed, so opening it costs the same for any size of
+library.
+
+Layout, in the machine's byte order: the header, then the ids as int64, the
+ratings as int8 (-1 for none), the durations as float64, and the string
+offsets as uint32, three per row (folder, name, tags) plus an end offset, into
+the UTF-8 string data that follows. Tag names are separated by TAG_SEPARATOR.
+Sections are padded to 8 bytes.
+"""
+
+import hashlib
+import mmap
+import os
+import pathlib
+import struct
+from typing import Iterable, NamedTuple, Optional, Sequence
+
+import sqlalchemy
+
+from . import db, utils
+
+MAGIC = b"F2SNAP"
+VERSION = 1
+HEADER = struct.Struct("=6sHQ")
+TAG_SEPARATOR = "\x1f"
+
+
+class SnapshotTag(NamedTuple):
+    name: str
+
+
+class SnapshotTrack(NamedTuple):
+    """
+    The displayed fields of a track, standing in for a db.Track until the
+    database has been read.
+    """
+
+    id: int
+    folder: str
+    name: str
+    tags: tuple[SnapshotTag, ...]
+    rating: Optional[int]
+    duration: float
+
+
+def default_path(instance: db.F2Instance) -> pathlib.Path:
+    key = hashlib.sha1(str(instance.base_dir.resolve()).encode()).hexdigest()
+    return utils.xdg_cache_dir() / "snapshots" / f"{key}.bin"
+
+
+def _padded(size: int) -> int:
+    return -(-size // 8) * 8
+
+
+class Snapshot(Sequence[SnapshotTrack]):
+    def __init__(self, mapping: mmap.mmap) -> None:
+        self._mapping = mapping
+        magic, version, count = HEADER.unpack_from(mapping)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("Not a library snapshot, or an older version")
+        offset = _padded(HEADER.size)
+        view = memoryview(mapping)
+        sections = []
+        for fmt, size in (("q", 8 * count), ("b", count), ("d", 8 * count)):
+            sections.append(view[offset : offset + size].cast(fmt))
+            offset = _padded(offset + size)
+        self.ids, self._ratings, self._durations = sections
+        size = 4 * (3 * count + 1)
+        self._offsets = view[offset : offset + size].cast("I")
+        self._strings = view[_padded(offset + size) :]
+        if (
+            len(self._offsets) != 3 * count + 1
+            or len(self._strings) < self._offsets[-1]
+        ):
+            raise ValueError("Truncated library snapshot")
+
+    @classmethod
+    def open(cls, path: pathlib.Path) -> Optional["Snapshot"]:
+        """
+        The snapshot at `path`, or None if there isn't a usable one.
+        """
+        try:
+            with path.open("rb") as f:
+                mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            return None
+        try:
+            return cls(mapping)
+        except (ValueError, TypeError, struct.error):
+            mapping.close()
+            return None
+
+    def close(self) -> None:
+        # The views have to go before the mapping can be closed
+        for view in (self.ids, self._ratings, self._durations, self._offsets):
+            view.release()
+        self._strings.release()
+        self._mapping.close()
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __getitem__(self, row: int) -> SnapshotTrack:
+        if row < 0:
+            row += len(self)
+        folder, name, tags = (
+            str(self._strings[self._offsets[i] : self._offsets[i + 1]], "utf-8")
+            for i in range(3 * row, 3 * row + 3)
+        )
+        rating = self._ratings[row]
+        return SnapshotTrack(
+            id=self.ids[row],
+            folder=folder,
+            name=name,
+            tags=tuple(SnapshotTag(t) for t in tags.split(TAG_SEPARATOR) if t),
+            rating=rating if rating >= 0 else None,
+            duration=self._durations[row],
+        )
+
+
+def tracks(session, order_by) -> list[SnapshotTrack]:
+    """
+    Every track in the library, ordered by the `order_by` clauses, with two
+    queries rather than loading the ORM rows.
+    """
+    tags = {}
+    for track_id, name in session.execute(
+        sqlalchemy.select(db.TrackToTags.track_id, db.Tag.name)
+        .join(db.Tag, db.Tag.id == db.TrackToTags.tag_id)
+        .order_by(db.Tag.name)
+    ):
+        tags.setdefault(track_id, []).append(SnapshotTag(name))
+    return [
+        SnapshotTrack(
+            id=track_id,
+            folder=folder,
+            name=name,
+            tags=tuple(tags.get(track_id, ())),
+            rating=rating,
+            duration=duration,
+        )
+        for track_id, folder, name, rating, duration in session.execute(
+            sqlalchemy.select(
+                db.Track.id,
+                db.Track.folder,
+                db.Track.name,
+                db.Track.rating,
+                db.Track.duration,
+            ).order_by(*order_by)
+        )
+    ]
+
+
+def write(path: pathlib.Path, rows: Iterable[SnapshotTrack]) -> None:
+    """
+    Save `rows` as a snapshot. The file is replaced atomically, so a mapped
+    older snapshot stays readable.
+    """
+    ids, ratings, durations, offsets, strings = [], [], [], [0], bytearray()
+    for track in rows:
+        ids.append(track.id)
+        ratings.append(track.rating if track.rating is not None else -1)
+        durations.append(track.duration)
+        for text in (
+            track.folder,
+            track.name,
+            TAG_SEPARATOR.join(t.name for t in track.tags),
+        ):
+            strings += text.encode("utf-8")
+            offsets.append(len(strings))
+
+    count = len(ids)
+    parts = [
+        HEADER.pack(MAGIC, VERSION, count),
+        struct.pack(f"={count}q", *ids),
+        struct.pack(f"={count}b", *ratings),
+        struct.pack(f"={count}d", *durations),
+        struct.pack(f"={len(offsets)}I", *offsets),
+        bytes(strings),
+    ]
+    path.parent.mkdir(parents=True, exist_ok=True)
+    partial = path.with_name(f".{path.name}.part")
+    with partial.open("wb") as f:
+        for part in parts:
+            f.write(part)
+            f.write(b"\0" * (_padded(len(part)) - len(part)))
+    os.replace(partial, path)
@@ -1,8 +1,9 @@
 from typing import Sequence
 
 from PySide6 import QtCore, QtQml
+from sqlalchemy.sql import func
 
-from . import db
+from . import changes, db, profiling
 
 QML_IMPORT_NAME = __name__
 QML_IMPORT_MAJOR_VERSION = 1
@@ -11,20 +12,27 @@ QML_IMPORT_MAJOR_VERSION = 1
 @QtQml.QmlElement
 @QtQml.QmlUncreatable()
 class TagModel(QtCore.QAbstractListModel):
-    def __init__(self, session) -> None:
+    ID_ROLE = QtCore.Qt.ItemDataRole.UserRole + 1
+    COUNT_ROLE = QtCore.Qt.ItemDataRole.UserRole + 2
+
+    def __init__(self, instance: db.F2Instance) -> None:
         super().__init__()
-        self._session = session
-        self._items: Sequence[db.Tag] = (
-            session.query(db.Tag).order_by(db.Tag.name).all()
-        )
+        self._instance = instance
+        self._session = None
+        self._items: Sequence[db.Tag] = []
+        self._rows: dict[int, int] = {}
+        self._counts: dict[int, int] = {}
         self.layoutChanged.connect(self.countChanged)
         self.rowsInserted.connect(self.countChanged)
         self.modelReset.connect(self.countChanged)
+        self.refresh()
 
     def rowCount(self, parent: QtCore.QModelIndex) -> int:
-        return len(self._items) if not parent.isValid() else None
+        return len(self._items) if not parent.isValid() else 0
 
     def flags(self, index):
+        if not index.isValid():
+            return QtCore.Qt.ItemFlag.NoItemFlags
         return (
             QtCore.Qt.ItemIsSelectable
             | QtCore.Qt.ItemIsEnabled
@@ -44,16 +52,20 @@ class TagModel(QtCore.QAbstractListModel):
         if role == QtCore.Qt.ItemDataRole.UserRole:
             return self._items[index.row()]
 
-        if role == QtCore.Qt.ItemDataRole.UserRole + 1:
+        if role == self.ID_ROLE:
             return self._items[index.row()].id
 
+        if role == self.COUNT_ROLE:
+            return self._counts.get(self._items[index.row()].id, 0)
+
         return None
 
     def roleNames(self):
         return {
             QtCore.Qt.ItemDataRole.DisplayRole: b"name",
             QtCore.Qt.ItemDataRole.BackgroundRole: b"color",
-            QtCore.Qt.ItemDataRole.UserRole + 1: b"id",
+            self.ID_ROLE: b"id",
+            self.COUNT_ROLE: b"count",
         }
 
     countChanged = QtCore.Signal()
@@ -61,3 +73,61 @@ class TagModel(QtCore.QAbstractListModel):
     @QtCore.Property(int, notify=countChanged)
     def count(self) -> int:
         return len(self._items)
+
+    @staticmethod
+    def _usage_counts(session) -> dict[int, int]:
+        # One grouped query instead of walking Tag.tracks for every tag
+        return dict(
+            session.query(db.TrackToTags.tag_id, func.count())
+            .group_by(db.TrackToTags.tag_id)
+            .all()
+        )
+
+    @QtCore.Slot()
+    @profiling.timed("model.refresh", model="TagModel")
+    def refresh(self) -> None:
+        session = self._instance.read_session()
+        items = session.query(db.Tag).order_by(db.Tag.name).all()
+        counts = self._usage_counts(session)
+        if self._session is not None:
+            self._session.close()
+        self._session = session
+
+        if [t.id for t in items] == [t.id for t in self._items]:
+            # Same tags in the same order, so only the row contents can differ
+            self._items = items
+            self._counts = counts
+            if self._items:
+                self.dataChanged.emit(
+                    self.index(0),
+                    self.index(len(self._items) - 1),
+                    [
+                        QtCore.Qt.ItemDataRole.DisplayRole,
+                        QtCore.Qt.ItemDataRole.BackgroundRole,
+                        self.COUNT_ROLE,
+                    ],
+                )
+            return
+
+        self.beginResetModel()
+        self._items = items
+        self._rows = {t.id: row for row, t in enumerate(items)}
+        self._counts = counts
+        self.endResetModel()
+
+    @QtCore.Slot(object)
+    def applyChanges(self, changeset: changes.ChangeSet) -> None:
+        # Removed tracks take their tags with them, but which tags isn't known
+        # by then
+        if changeset.tags or changeset.tracks_removed:
+            self.refresh()
+
+    @QtCore.Slot(int, int)
+    def adjustCount(self, tag_id: int, delta: int) -> None:
+        self._counts[tag_id] = self._counts.get(tag_id, 0) + delta
+        if tag_id not in self._rows:
+            # A tag we haven't seen yet, so pick it up from the database
+            self.refresh()
+            return
+        index = self.index(self._rows[tag_id])
+        self.dataChanged.emit(index, index, [self.COUNT_ROLE])
@@ -0,0 +1,347 @@
+import array
+import collections
+import concurrent.futures
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Iterable, Optional, Sequence
+
+import sqlalchemy
+from sqlalchemy import exc
+
+from . import db, writer
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class TrackQueue(Sequence[Optional[db.Track]]):
+    """
+    Playlist storage. Entries are kept as a flat array of track ids, so
+    appending is amortised O(1) and removing or moving a range only shifts
+    machine integers. ORM rows are loaded a page at a time when first accessed.
+    Entries whose track has left the library read as None.
+
+    Each entry also gets its own entry id, never reused, which follows it when
+    it moves, so a track queued twice can still be told apart.
+    """
+
+    PAGE_SIZE = 128
+
+    def __init__(self, session, track_ids: Iterable[int] = ()) -> None:
+        self._session = session
+        self._ids = array.array("q", track_ids)
+        self._entries = array.array("q", range(len(self._ids)))
+        self._next_entry = len(self._ids)
+        self._refs = collections.Counter(self._ids)
+        self._rows: dict[int, db.Track] = {}
+        # Queued ids found to be no longer in the library
+        self._missing: set[int] = set()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __getitem__(self, row: int) -> Optional[db.Track]:
+        track_id = self._ids[row]
+        if track_id not in self._rows and track_id not in self._missing:
+            self._hydrate(row if row >= 0 else len(self._ids) + row)
+        return self._rows.get(track_id)
+
+    def __delitem__(self, rows: slice) -> None:
+        self._release(self._ids[rows])
+        del self._ids[rows]
+        del self._entries[rows]
+
+    @property
+    def ids(self) -> array.array:
+        return self._ids
+
+    def track_id(self, row: int) -> int:
+        return self._ids[row]
+
+    @property
+    def entry_ids(self) -> array.array:
+        return self._entries
+
+    def row_of_entry(self, entry_id: int) -> int:
+        try:
+            return self._entries.index(entry_id)
+        except ValueError:
+            return -1
+
+    @property
+    def missing(self) -> set[int]:
+        return self._missing
+
+    def lookup(self, track_ids: Iterable[int]) -> dict[int, db.Track]:
+        """
+        Rows for any number of track ids, loaded with a single query. The ids
+        are passed as one JSON parameter, so the length of the list isn't
+        limited by SQLite's bound variable cap.
+        """
+        found = {}
+        missing = set()
+        for track_id in track_ids:
+            if track_id in self._rows:
+                found[track_id] = self._rows[track_id]
+            else:
+                missing.add(track_id)
+        if missing:
+            wanted = sqlalchemy.func.json_each(json.dumps(sorted(missing)))
+            for track in self._session.query(db.Track).filter(
+                db.Track.id.in_(sqlalchemy.select(wanted.table_valued("value").c.value))
+            ):
+                found[track.id] = track
+                if track.id in self._refs:
+                    self._rows[track.id] = track
+        return found
+
+    def extend(self, tracks: Iterable[db.Track]) -> None:
+        for track in tracks:
+            self._rows[track.id] = track
+            self._ids.append(track.id)
+            self._add_entries(1)
+            self._refs[track.id] += 1
+
+    def extend_ids(self, track_ids: Sequence[int]) -> None:
+        self._ids.extend(track_ids)
+        self._add_entries(len(track_ids))
+        self._refs.update(track_ids)
+
+    def move(self, row: int, count: int, destination: int) -> None:
+        """
+        Move `count` entries starting at `row` so they sit before the entry
+        that was at `destination`.
+        """
+        target = destination - count if destination > row else destination
+        for entries in (self._ids, self._entries):
+            moved = entries[row : row + count]
+            del entries[row : row + count]
+            entries[target:target] = moved
+
+    def reload(self, track_ids: Iterable[int]) -> None:
+        """
+        Re-read the loaded rows among `track_ids`.
+        """
+        loaded = [track_id for track_id in track_ids if track_id in self._rows]
+        for start in range(0, len(loaded), self.PAGE_SIZE):
+            self._session.query(db.Track).filter(
+                db.Track.id.in_(loaded[start : start + self.PAGE_SIZE])
+            ).populate_existing().all()
+
+    def clear(self) -> None:
+        self._ids = array.array("q")
+        self._entries = array.array("q")
+        self._refs.clear()
+        self._rows.clear()
+        self._missing.clear()
+
+    def _hydrate(self, row: int) -> None:
+        start = max(0, row - self.PAGE_SIZE // 2)
+        wanted = (
+            set(self._ids[start : start + self.PAGE_SIZE])
+            - self._rows.keys()
+            - self._missing
+        )
+        for track in (
+            self._session.query(db.Track).filter(db.Track.id.in_(wanted)).all()
+        ):
+            self._rows[track.id] = track
+        # Deleted by a sync in another process, or not yet removed by the
+        # change bus
+        self._missing.update(wanted - self._rows.keys())
+
+    def _add_entries(self, count: int) -> None:
+        self._entries.extend(range(self._next_entry, self._next_entry + count))
+        self._next_entry += count
+
+    def _release(self, track_ids: Iterable[int]) -> None:
+        for track_id in track_ids:
+            self._refs[track_id] -= 1
+            if not self._refs[track_id]:
+                del self._refs[track_id]
+                self._rows.pop(track_id, None)
+                self._missing.discard(track_id)
+
+
+class QueueStore:
+    """
+    Mirrors a TrackQueue into the queue_entry table. Edits are sent as small
+    operations and applied in order on a worker thread, so the playlist can be
+    restored on the next start without rewriting it on every change.
+    """
+
+    RETRY_INTERVAL = 5
+    # As for ListenRecorder, a locked database only holds up exiting this long
+    SHUTDOWN_DEADLINE = 2
+    SHUTDOWN_RETRY_INTERVAL = 0.25
+
+    def __init__(self, db_writer: writer.Writer) -> None:
+        self._writer = db_writer
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(
+            target=self._run, name="queue-store", daemon=True
+        )
+        self._thread.start()
+
+    @staticmethod
+    def load(session) -> tuple[array.array, bool]:
+        """
+        The stored queue as track ids, skipping tracks that have since been
+        removed from the library, and whether nothing had to be skipped.
+        """
+        track_ids = array.array(
+            "q",
+            session.scalars(
+                sqlalchemy.select(db.QueueEntry.track_id)
+                .join(db.Track, db.Track.id == db.QueueEntry.track_id)
+                .order_by(db.QueueEntry.position)
+            ),
+        )
+        stored = session.scalar(
+            sqlalchemy.select(sqlalchemy.func.count(db.QueueEntry.id))
+        )
+        return track_ids, stored == len(track_ids)
+
+    def insert(self, position: int, track_ids: Sequence[int]) -> None:
+        self._queue.put(("insert", position, array.array("q", track_ids)))
+
+    def remove(self, position: int, count: int) -> None:
+        self._queue.put(("remove", position, count))
+
+    def move(self, position: int, count: int, destination: int) -> None:
+        self._queue.put(("move", position, count, destination))
+
+    def replace(self, track_ids: Sequence[int]) -> None:
+        self._queue.put(("replace", array.array("q", track_ids)))
+
+    def close(self) -> None:
+        self._queue.put(_CLOSE)
+        # A save already waiting on the writer when closing has no deadline
+        self._thread.join(self.SHUTDOWN_DEADLINE + self.SHUTDOWN_RETRY_INTERVAL)
+        if self._thread.is_alive():
+            logger.error("Gave up waiting to save the play queue")
+
+    def _run(self) -> None:
+        pending = []
+        closing = False
+        while not closing:
+            pending.append(self._queue.get())
+            # Apply everything that has queued up in one transaction
+            while True:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if _CLOSE in pending:
+                closing = True
+                pending = [op for op in pending if op is not _CLOSE]
+            give_up_at = time.monotonic() + self.SHUTDOWN_DEADLINE
+
+            while pending:
+                try:
+                    self._writer.call(
+                        self._apply_all(pending),
+                        max(0, give_up_at - time.monotonic()) if closing else None,
+                    )
+                except exc.OperationalError as e:
+                    logger.warning("Could not save the play queue, will retry: %s", e)
+                except concurrent.futures.TimeoutError:
+                    # Cancelled unless it already started, so not tried again
+                    logger.error("Dropping %s unsaved play queue changes", len(pending))
+                    return
+                else:
+                    pending = []
+                    continue
+
+                if closing:
+                    if time.monotonic() + self.SHUTDOWN_RETRY_INTERVAL > give_up_at:
+                        logger.error(
+                            "Dropping %s unsaved play queue changes", len(pending)
+                        )
+                        return
+                    time.sleep(self.SHUTDOWN_RETRY_INTERVAL)
+                    continue
+                # Keep taking edits while waiting to retry, and notice closing
+                try:
+                    op = self._queue.get(timeout=self.RETRY_INTERVAL)
+                except queue.Empty:
+                    continue
+                if op is _CLOSE:
+                    closing = True
+                    give_up_at = time.monotonic() + self.SHUTDOWN_DEADLINE
+                else:
+                    pending.append(op)
+
+    def _apply_all(self, ops):
+        def job(session):
+            for op in ops:
+                self._apply(session.connection(), *op)
+
+        return job
+
+    def _apply(self, conn, kind, *args) -> None:
+        pos = db.QueueEntry.position
+        match kind:
+            case "insert":
+                position, track_ids = args
+                conn.execute(
+                    sqlalchemy.update(db.QueueEntry)
+                    .where(pos >= position)
+                    .values(position=pos + len(track_ids))
+                )
+                conn.execute(
+                    sqlalchemy.insert(db.QueueEntry),
+                    [
+                        {"position": position + i, "track_id": track_id}
+                        for i, track_id in enumerate(track_ids)
+                    ],
+                )
+            case "remove":
+                position, count = args
+                conn.execute(
+                    sqlalchemy.delete(db.QueueEntry).where(
+                        (pos >= position) & (pos < position + count)
+                    )
+                )
+                conn.execute(
+                    sqlalchemy.update(db.QueueEntry)
+                    .where(pos >= position + count)
+                    .values(position=pos - count)
+                )
+            case "move":
+                position, count, destination = args
+                if destination > position:
+                    # Moving down, the entries in between shift up
+                    low, high = position, destination
+                    moved_by, shifted_by = destination - count - position, -count
+                else:
+                    low, high = destination, position + count
+                    moved_by, shifted_by = destination - position, count
+                conn.execute(
+                    sqlalchemy.update(db.QueueEntry)
+                    .where((pos >= low) & (pos < high))
+                    .values(
+                        position=sqlalchemy.case(
+                            (
+                                (pos >= position) & (pos < position + count),
+                                pos + moved_by,
+                            ),
+                            else_=pos + shifted_by,
+                        )
+                    )
+                )
+            case "replace":
+                (track_ids,) = args
+                conn.execute(sqlalchemy.delete(db.QueueEntry))
+                if track_ids:
+                    conn.execute(
+                        sqlalchemy.insert(db.QueueEntry),
+                        [
+                            {"position": i, "track_id": track_id}
+                            for i, track_id in enumerate(track_ids)
+                        ],
+                    )
@@ -0,0 +1,137 @@
+from typing import Callable, Container, Optional, Sequence
+
+import sqlalchemy.orm
+
+from . import db
+
+# Ids per IN (...) when loading rows by id
+LOAD_CHUNK_SIZE = 1000
+
+# Past this many tracks, rows are found by going through every row
+ROW_LOOKUP_LIMIT = 32
+
+
+def runs(rows: Sequence[int]):
+    """
+    Split sorted rows into (first, last) ranges of consecutive rows.
+    """
+    first = last = None
+    for row in rows:
+        if last is not None and row == last + 1:
+            last = row
+            continue
+        if first is not None:
+            yield first, last
+        first = last = row
+    if first is not None:
+        yield first, last
+
+
+def load_tracks(
+    session,
+    track_ids,
+    reload: bool = False,
+    search: Optional[Callable] = None,
+) -> dict[int, db.Track]:
+    """
+    Load tracks by id, only those `search` keeps from a query if given.
+    """
+    track_ids = list(track_ids)
+    found = {}
+    for start in range(0, len(track_ids), LOAD_CHUNK_SIZE):
+        query = session.query(db.Track)
+        if search is not None:
+            query = search(query)
+        query = query.filter(
+            db.Track.id.in_(track_ids[start : start + LOAD_CHUNK_SIZE])
+        )
+        if reload:
+            query = query.populate_existing()
+        found.update((track.id, track) for track in query)
+    return found
+
+
+def rows_of(items: Sequence[db.Track], track_ids) -> list[int]:
+    """
+    The rows of `items` showing any of `track_ids`. For a few tracks, their
+    loaded rows are taken from the session and searched for by identity,
+    which doesn't go through the ORM for every row.
+    """
+    if not items:
+        return []
+    if len(track_ids) > ROW_LOOKUP_LIMIT:
+        return [row for row, track in enumerate(items) if track.id in track_ids]
+    identity_map = sqlalchemy.orm.object_session(items[0]).identity_map
+    rows = []
+    for track_id in track_ids:
+        track = identity_map.get(sqlalchemy.orm.util.identity_key(db.Track, track_id))
+        if track is None:
+            continue
+        try:
+            rows.append(items.index(track))
+        except ValueError:
+            pass
+    return sorted(rows)
+
+
+def sort_key(session, ordering, track_ids: set[int]):
+    """
+    The sort key of a QueryModel ordering for rows, reading recent plays for
+    orderings over a window as they are needed, starting with `track_ids`.
+    """
+    if ordering.window is None:
+        return ordering.key
+    seconds = {}
+
+    def read(ids):
+        plays = ordering.plays(list(ids))
+        seconds.update(dict.fromkeys(ids))
+        seconds.update(
+            session.execute(
+                sqlalchemy.select(plays.c.track_id, plays.c.seconds_played)
+            ).all()
+        )
+
+    read(track_ids)
+
+    def key(track):
+        if track.id not in seconds:
+            read([track.id])
+        return ordering.key(track, seconds[track.id])
+
+    return key
+
+
+def place_of(
+    items: Sequence[db.Track],
+    track: db.Track,
+    key,
+    row: Optional[int] = None,
+    unplaced: Container[int] = frozenset(),
+) -> int:
+    """
+    The row of `items`, sorted by `key`, to put `track` before. Its own `row`
+    if it's shown, and rows of `unplaced` track ids, whose place isn't known
+    yet, are skipped over. A shown track that is in order stays put.
+    """
+
+    def skip(i):
+        return i == row or items[i].id in unplaced
+
+    track_key = key(track)
+    if row is not None:
+        before = next((i for i in range(row - 1, -1, -1) if not skip(i)), None)
+        after = next((i for i in range(row + 1, len(items)) if not skip(i)), None)
+        if (before is None or key(items[before]) <= track_key) and (
+            after is None or track_key <= key(items[after])
+        ):
+            return row
+    lo, hi = 0, len(items)
+    while lo < hi:
+        mid = (lo + hi) // 2
+        probe = next((i for i in range(mid, hi) if not skip(i)), hi)
+        if probe < hi and key(items[probe]) <= track_key:
+            lo = probe + 1
+        else:
+            hi = mid
+    return lo
@@ -1,25 +1,24 @@
+import dataclasses
+import datetime
 import math
+import os
 import pathlib
-import re
-import shutil
 import subprocess
-from typing import Sequence
 
-import tqdm
-from alembic import config as alembic_config
-from PySide6 import QtCore, QtQml
-
-from . import db
-
-QML_IMPORT_NAME = __name__
-QML_IMPORT_MAJOR_VERSION = 1
+import sqlalchemy
 
+from . import db, profiling
 
 SUPPORTED_EXTS = {".mp3", ".wav", ".flac", ".ogg", ".opus", ".m4a", ".mp4"}
 SUPPORTED_COVER_EXTS = {".jpg", ".jpeg", ".png"}
 
 
 def alembic_cfg(instance):
+    # Only the database commands need alembic, so don't load it for the rest
+    from alembic import (  # pylint: disable=import-outside-toplevel
+        config as alembic_config,
+    )
+
     cfg = alembic_config.Config(pathlib.Path(__file__).parent / "alembic.ini")
     cfg.set_main_option(
         "script_location", str(pathlib.Path(__file__).parent / "alembic")
@@ -28,51 +27,90 @@ def alembic_cfg(instance):
     return cfg
 
 
-def export_name_trans(name, strip_dot=False):
-    name = re.sub(r'[<>:"\\|?*\0-\x1f]', "_", name)
-    if strip_dot:
-        name = name.rstrip(".")
-    return name
-
-
-def export_ext(ext):
-    # https://www.seatcupra.net/forums/threads/sd-card-media-format-type-and-useful-information.468327/#post-4998551
-    if ext in {
-        ".mp2",
-        ".mp3",
-        ".wav",
-        ".wma",
-        ".m4a",
-        ".m4b",
-        ".aac",
-        ".ogg",
-        ".flac",
-        ".mka",
-    }:
-        return ext
-    if ext in {".opus"}:
-        return ".m4a"
-    if ext in {".mp4"}:
-        return ".m4a"
-    raise RuntimeError(f"Encoding for {ext}?")
-
-
-def convert_ffmpeg(src, dst):
-    extra_args = []
-    if src.suffix != ".opus":
-        extra_args.extend(["-c:a", "copy"])
+@dataclasses.dataclass
+class SyncPlan:
+    """
+    The changes a sync makes, worked out from the files and a read of the
+    database. Existing rows are referred to by id with their old paths, and
+    new tracks come already hashed and probed, so applying the plan only
+    writes.
+    """
+
+    # Track id: (old path, new path)
+    moved: dict[int, tuple[pathlib.Path, pathlib.Path]] = dataclasses.field(
+        default_factory=dict
+    )
+    # Track id: old path
+    deleted: dict[int, pathlib.Path] = dataclasses.field(default_factory=dict)
+    # Path: (duration, file hash, file size)
+    added: dict[pathlib.Path, tuple[float, bytes, int]] = dataclasses.field(
+        default_factory=dict
+    )
+    # Ids of tracks whose loudness analysis failed, but whose file has changed
+    # since, so it is tried again
+    loudness_retried: set[int] = dataclasses.field(default_factory=set)
+    covers_deleted: dict[int, pathlib.Path] = dataclasses.field(default_factory=dict)
+    covers_added: set[pathlib.Path] = dataclasses.field(default_factory=set)
+    albums_deleted: set[pathlib.Path] = dataclasses.field(default_factory=set)
+
+
+@profiling.timed("sync.total")
+def sync_database_with_fs(instance: db.F2Instance, db_writer=None) -> None:
+    """
+    Bring the database in line with the files under the base directory. The
+    files are scanned, hashed and probed first, then only the changes are
+    written: with a `db_writer` as one job on its thread, so other writes just
+    wait for those, otherwise in a session of our own.
+    """
+    with instance.read_session() as session:
+        plan = _plan_sync(session)
+    if db_writer is not None:
+        db_writer.call(lambda session: _apply_sync(session, plan))
+    else:
+        with instance.session() as session:
+            _apply_sync(session, plan)
+
+
+def _probe_duration(path: pathlib.Path) -> float:
     try:
-        subprocess.run(
-            ["ffmpeg", "-i", src, *extra_args, dst], check=True, capture_output=True
-        )
+        duration = subprocess.check_output(
+            [
+                "ffprobe",
+                "-i",
+                path,
+                "-show_entries",
+                "format=duration",
+                "-v",
+                "quiet",
+                "-of",
+                "csv=p=0",
+            ]
+        ).decode()
     except subprocess.CalledProcessError as exc:
-        print(exc.stderr.decode())
-        raise RuntimeError("Transcoding failed")
+        print(path, exc.output.decode())
+        print()
+        duration = "nan"
+    return float(duration)
+
+
+def _changed_since_failing(path: pathlib.Path, track: db.Track) -> bool:
+    """
+    Whether the file of a track whose loudness analysis failed has changed
+    since.
+    """
+    if track.loudness_failed_at is None:
+        return False
+    stat = path.stat()
+    return (
+        stat.st_size != track.file_size
+        or datetime.datetime.fromtimestamp(stat.st_mtime) > track.loudness_failed_at
+    )
 
 
-def sync_database_with_fs(instance: db.F2Instance) -> None:
-    with instance.session() as session:
-        base_dir = instance.base_dir
+def _plan_sync(session) -> SyncPlan:
+    base_dir = session.info["instance"].base_dir
+    plan = SyncPlan()
+    with profiling.span("sync.scan"):
         paths_on_fs = set(base_dir.rglob("*"))
 
         tracks_on_fs = {
@@ -94,69 +132,101 @@ def sync_database_with_fs(instance: db.F2Instance) -> None:
 
         # print(paths_on_fs - tracks_on_fs - albums_on_fs - covers_on_fs)
 
+    with profiling.span("sync.hash"):
         new_track_hashes = {
             f: db.hash_file(base_dir / f) for f in tracks_on_fs - set(tracks_in_db)
         }
         reverse_track_hashes = {h: f for f, h in new_track_hashes.items()}
 
-        for removed_path in set(tracks_in_db) - tracks_on_fs:
-            removed_track = tracks_in_db[removed_path]
-            if removed_track.file_hash in reverse_track_hashes:
-                tracks_in_db.pop(removed_path)
-                new_path = reverse_track_hashes[removed_track.file_hash]
-                print(
-                    f"Moved {removed_track.path.relative_to(base_dir)} to {new_path.relative_to(base_dir)}"
-                )
+    for removed_path in set(tracks_in_db) - tracks_on_fs:
+        removed_track = tracks_in_db.pop(removed_path)
+        new_path = reverse_track_hashes.get(removed_track.file_hash)
+        if new_path is not None:
+            plan.moved[removed_track.id] = (removed_path, new_path)
+            tracks_in_db[new_path] = removed_track
+        else:
+            plan.deleted[removed_track.id] = removed_path
+
+    plan.loudness_retried = {
+        track.id
+        for path, track in tracks_in_db.items()
+        if path in tracks_on_fs and _changed_since_failing(path, track)
+    }
+
+    with profiling.span("sync.probe"):
+        for added_path in tracks_on_fs - set(tracks_in_db):
+            plan.added[added_path] = (
+                _probe_duration(added_path),
+                new_track_hashes[added_path],
+                added_path.stat().st_size,
+            )
 
-                removed_track.name = new_path.stem
-                removed_track.folder = new_path.parent.relative_to(base_dir).as_posix()
-                removed_track.extension = new_path.suffix
-                removed_track.album = db.Album.get_for_path(session, new_path.parent)
-                tracks_in_db[new_path] = removed_track
-            else:
-                print(f"Deleted {removed_track.path.relative_to(base_dir)}")
-                session.delete(removed_track)
+    plan.covers_deleted = {
+        covers_in_db[path].id: path for path in set(covers_in_db) - covers_on_fs
+    }
+    plan.covers_added = covers_on_fs - set(covers_in_db)
+    plan.albums_deleted = set(albums_in_db) - albums_on_fs
+    return plan
 
-        for added_path in tracks_on_fs - set(tracks_in_db):
+
+def _apply_sync(session, plan: SyncPlan) -> None:
+    base_dir = session.info["instance"].base_dir
+
+    with profiling.span("sync.remove"):
+        for track_id, (old_path, new_path) in plan.moved.items():
+            moved_track = session.get(db.Track, track_id)
+            if moved_track is None:
+                continue
+            print(
+                f"Moved {old_path.relative_to(base_dir)} to {new_path.relative_to(base_dir)}"
+            )
+
+            moved_track.name = new_path.stem
+            moved_track.folder = new_path.parent.relative_to(base_dir).as_posix()
+            moved_track.extension = new_path.suffix
+            moved_track.album = db.Album.get_for_path(session, new_path.parent)
+
+        for track_id, removed_path in plan.deleted.items():
+            removed_track = session.get(db.Track, track_id)
+            if removed_track is None:
+                continue
+            print(f"Deleted {removed_path.relative_to(base_dir)}")
+            session.delete(removed_track)
+
+    with profiling.span("sync.loudness"):
+        if plan.loudness_retried:
+            session.execute(
+                sqlalchemy.update(db.Track)
+                .where(db.Track.id.in_(plan.loudness_retried))
+                .values(loudness_failed_at=None)
+            )
+
+    with profiling.span("sync.add"):
+        for added_path, (duration, file_hash, file_size) in plan.added.items():
             print(f"Added {added_path}")
-            try:
-                duration = subprocess.check_output(
-                    [
-                        "ffprobe",
-                        "-i",
-                        added_path,
-                        "-show_entries",
-                        "format=duration",
-                        "-v",
-                        "quiet",
-                        "-of",
-                        "csv=p=0",
-                    ]
-                ).decode()
-            except subprocess.CalledProcessError as exc:
-                print(added_path, exc.output.decode())
-                print()
-                duration = "nan"
 
             session.add(
                 db.Track(
                     name=added_path.stem,
                     folder=added_path.parent.relative_to(base_dir).as_posix(),
                     extension=added_path.suffix,
-                    duration=float(duration),
+                    duration=duration,
                     rating=None,
-                    file_hash=new_track_hashes[added_path],
-                    file_size=added_path.stat().st_size,
+                    file_hash=file_hash,
+                    file_size=file_size,
                     album=db.Album.get_for_path(session, added_path.parent),
                 )
             )
 
-        for removed_cover_path in set(covers_in_db) - covers_on_fs:
-            removed_cover = covers_in_db[removed_cover_path]
+    with profiling.span("sync.covers"):
+        for cover_id, removed_cover_path in plan.covers_deleted.items():
+            removed_cover = session.get(db.Cover, cover_id)
+            if removed_cover is None:
+                continue
             print(f"Deleted {removed_cover_path.relative_to(base_dir)}")
             session.delete(removed_cover)
 
-        for added_cover_path in covers_on_fs - set(covers_in_db):
+        for added_cover_path in plan.covers_added:
             print(f"Added {added_cover_path}")
 
             session.add(
@@ -168,76 +238,15 @@ def sync_database_with_fs(instance: db.F2Instance) -> None:
                 )
             )
 
+    with profiling.span("sync.albums"):
         for removed_album in sorted(
-            set(albums_in_db) - albums_on_fs, key=lambda x: len(x.parts), reverse=True
+            plan.albums_deleted, key=lambda x: len(x.parts), reverse=True
         ):
             print(f"Deleted {removed_album.relative_to(base_dir)}")
             session.remove(db.Album.get_for_path(session, added_path.parent))
 
-
-def export_library_to_location(
-    instance: db.F2Instance, target_dir: pathlib.Path, excluded_albums: Sequence[str]
-) -> None:
-    with instance.session() as session:
-        print("Rendering directory structure")
-        paths = {}
-        all_paths = set()
-
-        for track in session.query(db.Track).all():
-            if track.folder in excluded_albums or any(
-                str(p) in excluded_albums for p in pathlib.Path(track.folder).parents
-            ):
-                continue
-            export_name = (
-                pathlib.Path()
-                / export_name_trans(track.folder, strip_dot=True)
-                / (export_name_trans(track.name) + export_ext(track.extension))
-            )
-            paths[export_name] = track.path
-            all_paths.add(export_name)
-            all_paths.update(export_name.parents)
-
-        all_paths.remove(pathlib.Path())
-
-        print("Scanning target structure")
-        existing_export_paths = set(
-            x.relative_to(target_dir) for x in target_dir.rglob("*")
-        )
-
-        to_remove = existing_export_paths - all_paths
-        to_add = all_paths - existing_export_paths
-
-        print("Found", sum(f.suffix != "" for f in existing_export_paths), "paths")
-        print("Targeting", sum(f.suffix != "" for f in all_paths), "paths")
-        print("Will remove", sum(f.suffix != "" for f in to_remove), "paths")
-        print("Will add", sum(f.suffix != "" for f in to_add), "paths")
-        input("Continue? ")
-
-        print("Removing excess paths")
-        for path in sorted(
-            existing_export_paths - all_paths,
-            key=lambda p: len(p.parents),
-            reverse=True,
-        ):
-            assert (target_dir / path).exists()
-            if (target_dir / path).is_dir():
-                (target_dir / path).rmdir()
-            else:
-                (target_dir / path).unlink()
-
-        input("Continue? ")
-
-        print("Adding new paths")
-        for dest_path, src_path in tqdm.tqdm(
-            [(d, s) for d, s in paths.items() if d in to_add], unit="file"
-        ):
-            if (target_dir / dest_path).exists():
-                continue
-            (target_dir / dest_path).parent.mkdir(exist_ok=True, parents=True)
-            if src_path.suffix == dest_path.suffix:
-                shutil.copyfile(src_path, target_dir / dest_path)
-            else:
-                convert_ffmpeg(src_path, target_dir / dest_path)
+    with profiling.span("sync.flush"):
+        session.flush()
 
 
 def xdg_music_dir() -> pathlib.Path:
@@ -246,6 +255,11 @@ def xdg_music_dir() -> pathlib.Path:
     )
 
 
+def xdg_cache_dir() -> pathlib.Path:
+    base = os.environ.get("XDG_CACHE_HOME") or pathlib.Path.home() / ".cache"
+    return pathlib.Path(base) / "fantasia2"
+
+
 def print_stats(instance: db.F2Instance) -> None:
     num_tracks = 0
     tracks_size = 0
@@ -277,11 +291,3 @@ def format_duration(seconds: float) -> str:
         return f"{round(mins):02}:{math.floor(seconds):02}"
     hours, mins = divmod(mins, 60)
     return f"{round(hours):02}:{round(mins):02}:{math.floor(seconds):02}"
-
-
-@QtQml.QmlElement
-@QtQml.QmlSingleton
-class Utils(QtCore.QObject):
-    @QtCore.Slot(float, result=str)
-    def formatDuration(self, seconds: float) -> str:
-        return format_duration(seconds)
@@ -0,0 +1,156 @@
+import concurrent.futures
+import logging
+import queue
+import threading
+from typing import Callable, Optional, TypeVar
+
+from sqlalchemy import orm
+
+from . import changes, db, profiling
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+_CLOSE = object()
+
+
+class Writer:
+    """
+    The one thread that writes to the database. Jobs are callables taking a
+    session, run in the order they were submitted, each in its own
+    transaction. With a single writer, background work like syncing never
+    competes with the GUI for the write lock, and readers only ever see
+    committed changes. What each job changed is passed to the subscribers
+    once it has committed.
+    """
+
+    def __init__(self, instance: db.F2Instance) -> None:
+        self._instance = instance
+        self._queue = queue.SimpleQueue()
+        self._closed = False
+        self._subscribers: list[Callable[[changes.ChangeSet], None]] = []
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+
+    def submit(
+        self, job: Callable[[orm.Session], T]
+    ) -> "concurrent.futures.Future[T]":
+        if self._closed:
+            raise RuntimeError("The database writer has been closed")
+        future = concurrent.futures.Future()
+        self._queue.put((job, future))
+        return future
+
+    def call(
+        self, job: Callable[[orm.Session], T], timeout: Optional[float] = None
+    ) -> T:
+        """
+        Run a job and wait for its result, for background threads. After
+        `timeout` seconds, the job is cancelled if it hasn't started, and
+        concurrent.futures.TimeoutError raised.
+        """
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("Writer jobs can't wait for other writer jobs")
+        future = self.submit(job)
+        try:
+            return future.result(timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    def subscribe(self, callback: Callable[[changes.ChangeSet], None]) -> None:
+        """
+        Call `callback` with the changes of every job that changed something.
+        It is called on the writer thread.
+        """
+        self._subscribers.append(callback)
+
+    def close(self) -> None:
+        """
+        Finish the jobs already submitted and stop the thread.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is _CLOSE:
+                return
+            job, future = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                with profiling.span("writer.job"), self._instance.session() as session:
+                    changes.record_flushes(session)
+                    result = job(session)
+                    changeset = changes.for_session(session)
+            except BaseException as e:  # pylint: disable=broad-exception-caught
+                future.set_exception(e)
+                continue
+            self._publish(changeset.normalised())
+            future.set_result(result)
+
+    def _publish(self, changeset: changes.ChangeSet) -> None:
+        if not changeset:
+            return
+        for callback in self._subscribers:
+            try:
+                callback(changeset)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Change subscriber failed")
+
+
+def log_failure(future: concurrent.futures.Future, what: Optional[str] = None) -> None:
+    """
+    Log the error of a job that nothing waits on.
+    """
+
+    def done(future):
+        if future.exception() is not None:
+            logger.error("Could not %s: %s", what or "write", future.exception())
+
+    future.add_done_callback(done)
+
+
+def set_rating(track_id: int, rating: Optional[int]) -> Callable[[orm.Session], None]:
+    def job(session):
+        session.query(db.Track).filter_by(id=track_id).update({"rating": rating})
+        changeset = changes.for_session(session)
+        changeset.tracks_updated.add(track_id)
+        changeset.track_fields.add("rating")
+
+    return job
+
+
+def add_tag(track_id: int, tag_id: int) -> Callable[[orm.Session], None]:
+    def job(session):
+        exists = (
+            session.query(db.TrackToTags)
+            .filter_by(track_id=track_id, tag_id=tag_id)
+            .one_or_none()
+        )
+        if exists is None:
+            session.add(db.TrackToTags(track_id=track_id, tag_id=tag_id))
+
+    return job
+
+
+def remove_tag(track_id: int, tag_id: int) -> Callable[[orm.Session], None]:
+    def job(session):
+        removed = (
+            session.query(db.TrackToTags)
+            .filter_by(track_id=track_id, tag_id=tag_id)
+            .delete()
+        )
+        if removed:
+            changeset = changes.for_session(session)
+            changeset.tracks_updated.add(track_id)
+            changeset.track_fields.add("tags")
+            changeset.tags.add(tag_id)
+
+    return job